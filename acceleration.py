@@ -0,0 +1,177 @@
+import math
+import re
+import threading
+from urllib.parse import urlsplit
+
+from yt_dlp.downloader import PROTOCOL_MAP
+from yt_dlp.downloader.fragment import FragmentFD
+from yt_dlp.downloader.http import HttpFD
+from yt_dlp.networking import Request
+from yt_dlp.networking.exceptions import HTTPError, TransportError
+from yt_dlp.utils.networking import HTTPHeaderDict
+
+RANGES_PROTOCOL = "http_ranges"
+# ydl param holding a callable that is told whenever the server pushes back
+THROTTLE_HOOK_PARAM = "throttle_hook"
+THROTTLE_STATUSES = (403, 429, 503)
+MIN_RANGE_SIZE = 256 * 1024
+RANGES_PER_CONNECTION = 4
+_CONTENT_RANGE_RE = re.compile(r'bytes\s+0-0/(\d+)')
+
+
+class ParallelRangeFD(FragmentFD):
+    """
+    Downloads a single-file HTTP format as byte-range fragments over
+    `concurrent_fragment_downloads` connections.
+
+    yt-dlp's fragment machinery does the retries, resume (.ytdl state file) and
+    progress reporting; this only cuts the file into ranges. Servers that do not
+    honour Range requests get a plain single-connection download instead.
+    """
+    FD_NAME = "ranges"
+
+    def real_download(self, filename, info_dict):
+        size = self._probe_size(info_dict)
+        if size is None or size < 2 * MIN_RANGE_SIZE:
+            return self._single_connection(filename, info_dict)
+
+        connections = max(1, self.params.get('concurrent_fragment_downloads') or 1)
+        # http_chunk_size caps the range size; fragments must not chunk again on their own
+        range_cap = self.params.get('http_chunk_size') or size
+        self.params = {**self.params, 'http_chunk_size': None}
+        range_size = max(MIN_RANGE_SIZE, min(range_cap, math.ceil(size / (connections * RANGES_PER_CONNECTION))))
+
+        ctx = {'filename': filename, 'total_frags': math.ceil(size / range_size)}
+        self._prepare_frag_download(ctx)
+        # A resumed download must keep cutting at the offsets its .ytdl file refers to
+        range_size = ctx.setdefault('extra_state', {}).setdefault('range_size', range_size)
+        ctx['total_frags'] = math.ceil(size / range_size)
+        self._start_frag_download(ctx, info_dict)
+
+        fragments = [{
+            'frag_index': index + 1,
+            'index': index,
+            'url': info_dict['url'],
+            'byte_range': {'start': start, 'end': min(size, start + range_size)},
+        } for index, start in enumerate(range(0, size, range_size)) if index + 1 > ctx['fragment_index']]
+        # Every byte is needed, so no fragment may be skipped
+        return self.download_and_append_fragments(ctx, fragments, info_dict, is_fatal=lambda index: True)
+
+    def report_retry(self, err, count, retries, frag_index=None, fatal=True):
+        if isinstance(err, HTTPError) and err.status in THROTTLE_STATUSES:
+            self._report_throttle()
+        return super().report_retry(err, count, retries, frag_index, fatal)
+
+    def _probe_size(self, info_dict):
+        """Returns the file size if the server answers a one-byte Range request with 206, else None."""
+        headers = HTTPHeaderDict(info_dict.get('http_headers'), {'Range': 'bytes=0-0'})
+        try:
+            response = self.ydl.urlopen(Request(info_dict['url'], headers=headers))
+        except HTTPError as e:
+            if e.status in THROTTLE_STATUSES:
+                self._report_throttle()
+            return None
+        except TransportError:
+            return None
+        with response:
+            if response.status != 206:
+                return None
+            match = _CONTENT_RANGE_RE.match(response.headers.get('Content-Range') or '')
+            return int(match.group(1)) if match else None
+
+    def _single_connection(self, filename, info_dict):
+        fd = HttpFD(self.ydl, self.params)
+        for hook in self._progress_hooks:
+            fd.add_progress_hook(hook)
+        return fd.real_download(filename, info_dict)
+
+    def _report_throttle(self):
+        hook = self.params.get(THROTTLE_HOOK_PARAM)
+        if hook:
+            hook()
+
+
+PROTOCOL_MAP.setdefault(RANGES_PROTOCOL, ParallelRangeFD)
+
+
+def accelerate_format(fmt):
+    """Returns the selected format with its single-file HTTP streams switched to parallel ranges."""
+    if fmt.get('requested_formats'):
+        requested = [accelerate_format(f) for f in fmt['requested_formats']]
+        return {**fmt, 'requested_formats': requested, 'protocol': '+'.join(f['protocol'] for f in requested)}
+    if fmt.get('protocol') in ('http', 'https') and not fmt.get('is_live') and not fmt.get('fragments'):
+        return {**fmt, 'protocol': RANGES_PROTOCOL}
+    return fmt
+
+
+def stream_host(fmt):
+    """The host a selected format's data comes from, e.g. a CDN node rather than the video page's host."""
+    for f in fmt.get('requested_formats') or [fmt]:
+        url = f.get('url') or f.get('fragment_base_url') or f.get('manifest_url')
+        if url:
+            return urlsplit(url).hostname
+    return None
+
+
+class ConnectionTuner:
+    """
+    Picks, per host, how many connections an accelerated job opens, from the
+    throughput the previous jobs on that host achieved.
+
+    It climbs while more connections still pay (at least `gain` better than the
+    next lower level tried), settles one step below the point where they stop
+    paying, and halves on throttling (403/429/503), climbing back to just below
+    the refused level. A settled or throttled host is probed upwards again after
+    `probe_after` jobs, since conditions change.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=16, step=2, gain=1.1, probe_after=20):
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.step = step
+        self.gain = gain
+        self.probe_after = probe_after
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def connections(self, host):
+        with self._lock:
+            return self._state(host)['connections']
+
+    def record(self, host, connections, throughput, throttled=False):
+        """Feeds back one finished job: the connections it used and the bytes per second it got."""
+        with self._lock:
+            state = self._state(host)
+            state['jobs'] += 1
+            if state['ceiling'] < self.maximum and state['jobs'] - state['ceiling_set_at'] >= self.probe_after:
+                state['ceiling'] = self.maximum
+            if throttled:
+                # Halve, then climb back no further than just below the level that was refused
+                state['connections'] = max(self.minimum, connections // 2)
+                self._set_ceiling(state, max(self.minimum, connections - 1))
+                state['rates'] = {}
+                return
+            if not throughput:
+                return
+            rates = state['rates']
+            rates[connections] = throughput if connections not in rates else (rates[connections] + throughput) / 2
+            lower = max((n for n in rates if n < connections), default=None)
+            if lower is not None and rates[connections] < rates[lower] * self.gain:
+                # The extra connections did not pay for themselves
+                state['connections'] = lower
+                self._set_ceiling(state, lower)
+            else:
+                state['connections'] = max(self.minimum, min(state['ceiling'], connections + self.step))
+
+    def _state(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = {'connections': self.initial, 'rates': {}, 'jobs': 0,
+                                         'ceiling': self.maximum, 'ceiling_set_at': 0}
+        return state
+
+    @staticmethod
+    def _set_ceiling(state, ceiling):
+        state['ceiling'] = ceiling
+        state['ceiling_set_at'] = state['jobs']
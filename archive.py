@@ -0,0 +1,244 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from yt_dlp.extractor import gen_extractor_classes
+from yt_dlp.utils import make_archive_id
+
+from downloader import YOUTUBE_ID_RE
+
+
+def archive_id_for_url(url):
+    """
+    Works out the `"<extractor> <video id>"` key of a URL without extracting it,
+    or returns None when only an extraction can tell (e.g. generic pages).
+    """
+    match = YOUTUBE_ID_RE.search(url)
+    if match:
+        return make_archive_id('Youtube', match.group(1))
+    for ie in gen_extractor_classes():
+        if ie.ie_key() != 'Generic' and ie.suitable(url):
+            video_id = ie.get_temp_id(url)
+            return make_archive_id(ie, video_id) if video_id else None
+    return None
+
+
+def archive_id_for_info(info):
+    extractor = info.get('extractor_key') or info.get('ie_key')
+    if not extractor or not info.get('id'):
+        return None
+    return make_archive_id(extractor, info['id'])
+
+
+class DownloadArchive:
+    """
+    Persistent record of already-downloaded videos, keyed like yt-dlp's archive
+    (`"<extractor> <video id>"`) plus the file format, so fetching a video in
+    another format is not skipped. An entry only counts while its file is still
+    there. Lookups hit an in-memory dict and at most one stat.
+    """
+
+    def __init__(self, path="download_archive.sqlite"):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(archive)")]
+        # Archives written before the format was part of the key are copied over below
+        legacy = bool(columns) and 'file_format' not in columns
+        if legacy:
+            self._db.execute("ALTER TABLE archive RENAME TO archive_legacy")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS archive (
+            archive_id TEXT NOT NULL, file_format TEXT NOT NULL, path TEXT, downloaded_at REAL NOT NULL,
+            PRIMARY KEY (archive_id, file_format))""")
+        if legacy:
+            self._migrate()
+        self._db.commit()
+        self._paths = {(archive_id, file_format): path
+                       for archive_id, file_format, path in self._db.execute("SELECT archive_id, file_format, path FROM archive")}
+
+    def _migrate(self):
+        # The format of an old entry is taken from its file name
+        rows = self._db.execute("SELECT archive_id, path, downloaded_at FROM archive_legacy").fetchall()
+        self._db.executemany("INSERT OR REPLACE INTO archive VALUES (?, ?, ?, ?)",
+                             [(archive_id, os.path.splitext(path or '')[1].lstrip('.').lower(), path, downloaded_at)
+                              for archive_id, path, downloaded_at in rows])
+        self._db.execute("DROP TABLE archive_legacy")
+
+    def __len__(self):
+        return len(self._paths)
+
+    def contains(self, archive_id, file_format):
+        """True when the video was downloaded in `file_format` and its file has not been removed since."""
+        key = (archive_id, file_format)
+        if key not in self._paths:
+            return False
+        path = self._paths[key]
+        return path is None or os.path.exists(path)
+
+    def contains_url(self, url, file_format):
+        archive_id = archive_id_for_url(url)
+        return archive_id is not None and self.contains(archive_id, file_format)
+
+    def contains_info(self, info, file_format):
+        archive_id = archive_id_for_info(info)
+        return archive_id is not None and self.contains(archive_id, file_format)
+
+    def add(self, info, path, file_format):
+        archive_id = archive_id_for_info(info)
+        if archive_id is None:
+            return
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO archive VALUES (?, ?, ?, ?)", (archive_id, file_format, path, time.time()))
+            self._db.commit()
+            self._paths[(archive_id, file_format)] = path
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class JobJournal:
+    """
+    Durable record of submitted jobs and their last state, so a restarted
+    process can pick up batches that were queued or running when it stopped.
+    """
+
+    def __init__(self, path="job_journal.sqlite"):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT NOT NULL, options TEXT NOT NULL,
+            status TEXT NOT NULL, created_at REAL NOT NULL, updated_at REAL NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+        self._db.commit()
+
+    def add(self, url, options, status):
+        """Records a new job and returns its journal id."""
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute("INSERT INTO jobs (url, options, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                                      (url, json.dumps(options), status, now, now))
+            self._db.commit()
+        return cursor.lastrowid
+
+    def update(self, journal_id, status):
+        with self._lock:
+            self._db.execute("UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?", (status, time.time(), journal_id))
+            self._db.commit()
+
+    def unfinished(self, statuses):
+        """Returns `(journal_id, url, options)` for every job last seen in one of `statuses`, oldest first."""
+        marks = ", ".join("?" for _ in statuses)
+        with self._lock:
+            rows = self._db.execute(f"SELECT id, url, options FROM jobs WHERE status IN ({marks}) ORDER BY id",
+                                    tuple(statuses)).fetchall()
+        return [(journal_id, url, json.loads(options)) for journal_id, url, options in rows]
+
+    def prune(self, finished_statuses, older_than=7 * 24 * 3600):
+        """Forgets finished jobs older than `older_than` seconds so the journal stays small."""
+        marks = ", ".join("?" for _ in finished_statuses)
+        with self._lock:
+            self._db.execute(f"DELETE FROM jobs WHERE status IN ({marks}) AND updated_at < ?",
+                             (*finished_statuses, time.time() - older_than))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class SharedJobQueue:
+    """
+    Queue of jobs that several download daemons, possibly on different hosts, work
+    through together (see service.QueueWorker). A claimed job is leased to one worker
+    for `lease` seconds and goes back to the queue if the worker stops renewing it,
+    up to `max_attempts` times.
+    """
+
+    def __init__(self, path="shared_queue.sqlite", lease=120, max_attempts=3):
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS queue (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT NOT NULL, options TEXT NOT NULL,
+            status TEXT NOT NULL, worker TEXT, lease_until REAL, attempts INTEGER NOT NULL DEFAULT 0,
+            result TEXT, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS queue_status ON queue (status, id)")
+        self._db.commit()
+
+    def put(self, url, options):
+        """Adds a job and returns its queue id."""
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO queue (url, options, status, created_at, updated_at) VALUES (?, ?, 'queued', ?, ?)",
+                (url, json.dumps(options), now, now))
+            self._db.commit()
+        return cursor.lastrowid
+
+    def claim(self, worker):
+        """Leases the oldest queued job to `worker`. Returns `{'id', 'url', 'options'}`, or None if there is none."""
+        now = time.time()
+        with self._lock:
+            self._expire_leases(now)
+            row = self._db.execute("SELECT id, url, options FROM queue WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                self._db.commit()
+                return None
+            self._db.execute("""UPDATE queue SET status = 'claimed', worker = ?, lease_until = ?,
+                                attempts = attempts + 1, updated_at = ? WHERE id = ?""",
+                             (worker, now + self.lease, now, row[0]))
+            self._db.commit()
+        return {'id': row[0], 'url': row[1], 'options': json.loads(row[2])}
+
+    def renew(self, queue_id, worker):
+        """Extends `worker`'s lease on a job. Returns False if the lease was lost meanwhile."""
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute("""UPDATE queue SET lease_until = ?, updated_at = ?
+                                         WHERE id = ? AND worker = ? AND status = 'claimed'""",
+                                      (now + self.lease, now, queue_id, worker))
+            self._db.commit()
+        return cursor.rowcount == 1
+
+    def release(self, queue_id, worker):
+        """Hands a job `worker` will not finish back to the queue, without counting the attempt."""
+        with self._lock:
+            cursor = self._db.execute("""UPDATE queue SET status = 'queued', worker = NULL, lease_until = NULL,
+                                         attempts = attempts - 1, updated_at = ?
+                                         WHERE id = ? AND worker = ? AND status = 'claimed'""",
+                                      (time.time(), queue_id, worker))
+            self._db.commit()
+        return cursor.rowcount == 1
+
+    def finish(self, queue_id, worker, status, result=None, error=None):
+        """Records the final status `worker` reached on a job. Returns False if its lease was lost meanwhile."""
+        with self._lock:
+            cursor = self._db.execute("""UPDATE queue SET status = ?, result = ?, error = ?, lease_until = NULL,
+                                         updated_at = ? WHERE id = ? AND worker = ? AND status = 'claimed'""",
+                                      (status, result, error, time.time(), queue_id, worker))
+            self._db.commit()
+        return cursor.rowcount == 1
+
+    def counts(self):
+        """Number of jobs by status."""
+        with self._lock:
+            self._expire_leases(time.time())
+            self._db.commit()
+            return dict(self._db.execute("SELECT status, COUNT(*) FROM queue GROUP BY status").fetchall())
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _expire_leases(self, now):
+        # Jobs of workers that went away are handed out again, unless they have had their chances
+        self._db.execute("""UPDATE queue SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END,
+                            error = CASE WHEN attempts >= ? THEN 'Lease expired too often' ELSE error END,
+                            worker = NULL, lease_until = NULL, updated_at = ?
+                            WHERE status = 'claimed' AND lease_until < ?""",
+                         (self.max_attempts, self.max_attempts, now, now))
@@ -0,0 +1,149 @@
+import math
+import threading
+import time
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = (INTERACTIVE, BATCH)
+# Longest a held-back transfer sleeps before looking again at cancellation and changed caps
+MAX_WAIT = 0.25
+
+
+def check_rate(rate):
+    """Returns `rate` if it is a usable cap in bytes per second, or None; raises ValueError otherwise."""
+    if rate is None:
+        return None
+    if isinstance(rate, bool) or not isinstance(rate, (int, float)) or not math.isfinite(rate) or rate <= 0:
+        raise ValueError(f"Invalid rate: {rate!r} (use a positive number of bytes per second, or None)")
+    return rate
+
+
+class TokenBucket:
+    """
+    A bytes-per-second budget refilling continuously, up to `burst` seconds' worth.
+
+    Transfers pay for what they have just read, which may run the bucket into
+    debt; whoever comes next waits until the debt is paid off. That way the size
+    of yt-dlp's reads need not be known in advance and the average still holds.
+    While interactive takers are waiting, batch takers hold back.
+    """
+
+    def __init__(self, rate=None, burst=1.0):
+        self.burst = burst
+        self._rate = check_rate(rate)
+        self._tokens = self._rate * burst if self._rate else 0.0
+        self._updated = time.monotonic()
+        self._waiting = {priority: 0 for priority in PRIORITIES}
+        self._cond = threading.Condition()
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def set_rate(self, rate):
+        """Changes the rate, None for unlimited. Transfers already waiting pick it up at once."""
+        rate = check_rate(rate)
+        with self._cond:
+            self._refill(time.monotonic())
+            self._rate = rate
+            self._tokens = min(self._tokens, self._rate * self.burst) if self._rate else 0.0
+            self._cond.notify_all()
+
+    def take(self, amount, priority=BATCH, cancelled=None):
+        """
+        Blocks until `amount` bytes may pass, or until `cancelled()` returns true.
+        Returns the seconds spent waiting.
+        """
+        start = time.monotonic()
+        with self._cond:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    if self._rate is None:
+                        return now - start
+                    self._refill(now)
+                    yielding = priority != INTERACTIVE and self._waiting[INTERACTIVE]
+                    if self._tokens > 0 and not yielding:
+                        self._tokens -= amount
+                        return now - start
+                    if cancelled is not None and cancelled():
+                        return now - start
+                    self._cond.wait(min(MAX_WAIT, -self._tokens / self._rate) if self._tokens <= 0 else MAX_WAIT)
+            finally:
+                self._waiting[priority] -= 1
+                self._cond.notify_all()
+
+    def _refill(self, now):
+        if self._rate is not None:
+            self._tokens = min(self._rate * self.burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+
+class BandwidthManager:
+    """
+    Divides the process's download bandwidth among jobs.
+
+    Every job draws through a BandwidthShare from up to three token buckets: its
+    own cap, the cap of its priority class and the global cap. Interactive jobs
+    go first wherever a cap is reached, so batch jobs only get what they leave;
+    without caps nothing is held back. All caps can be changed while jobs run.
+    """
+
+    def __init__(self, limit=None, class_limits=None):
+        self._buckets = {None: TokenBucket(limit)}
+        for priority in PRIORITIES:
+            self._buckets[priority] = TokenBucket((class_limits or {}).get(priority))
+
+    def limit(self, priority=None):
+        """The global cap in bytes per second, or with `priority` that class's cap; None when unlimited."""
+        return self._buckets[priority].rate
+
+    def set_limit(self, rate, priority=None):
+        """Sets the global cap, or with `priority` the cap of that class. None lifts it."""
+        self._buckets[priority].set_rate(rate)
+
+    def share(self, priority=BATCH, limit=None, cancelled=None):
+        """Opens a job's share. `cancelled` is polled while it waits, so a held-back job can still be stopped."""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}")
+        return BandwidthShare(self, priority, limit, cancelled)
+
+    def _take(self, share, amount):
+        waited = 0.0
+        for bucket in (share.bucket, self._buckets[share.priority], self._buckets[None]):
+            waited += bucket.take(amount, share.priority, share.cancelled)
+        return waited
+
+
+class BandwidthShare:
+    """One job's draw on a BandwidthManager: its priority and optional cap, both changeable while it runs."""
+
+    def __init__(self, manager, priority=BATCH, limit=None, cancelled=None):
+        self.manager = manager
+        self.priority = priority
+        self.bucket = TokenBucket(limit)
+        self.cancelled = cancelled
+        self.held_seconds = 0.0
+
+    @property
+    def limit(self):
+        return self.bucket.rate
+
+    @property
+    def limited(self):
+        """Whether any cap currently applies to this job."""
+        return any(rate is not None for rate in (self.limit, self.manager.limit(self.priority), self.manager.limit()))
+
+    def set_limit(self, rate):
+        self.bucket.set_rate(rate)
+
+    def set_priority(self, priority):
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}")
+        self.priority = priority
+
+    def consume(self, amount):
+        """Accounts for `amount` bytes just received, sleeping as long as the caps require."""
+        if amount > 0:
+            self.held_seconds += self.manager._take(self, amount)
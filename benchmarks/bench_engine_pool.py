@@ -0,0 +1,62 @@
+"""
+Microbenchmark: per-call overhead of a fresh YoutubeDL versus a pooled one.
+
+Serves a small file from a local HTTP server and extracts it repeatedly with
+yt-dlp's generic extractor, so the numbers reflect engine setup and connection
+handling rather than YouTube's response times. Run from the repository root:
+
+    python benchmarks/bench_engine_pool.py [--calls 50]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import yt_dlp
+from downloader import YoutubeDLPool
+from media_server import MediaServer
+
+
+def time_calls(calls, fn):
+    samples = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return {"mean_ms": statistics.mean(samples) * 1000, "median_ms": statistics.median(samples) * 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--calls", type=int, default=50)
+    args = parser.parse_args()
+
+    with MediaServer() as server:
+        url = server.url("clip", size=64 * 1024)
+        opts = {'quiet': True, 'noplaylist': True}
+
+        def fresh():
+            with yt_dlp.YoutubeDL(opts) as ydl:
+                ydl.extract_info(url, download=False)
+
+        pool = YoutubeDLPool()
+
+        def pooled():
+            with pool.checkout(opts) as ydl:
+                ydl.extract_info(url, download=False)
+
+        pooled()  # warm the pool, as a running app would be
+        results = {"calls": args.calls, "fresh": time_calls(args.calls, fresh), "pooled": time_calls(args.calls, pooled)}
+        pool.close()
+
+    results["speedup"] = results["fresh"]["mean_ms"] / results["pooled"]["mean_ms"]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Benchmark: process startup time of the entry points.
+
+Each command runs in a fresh interpreter so import costs are counted in full.
+`import gui` is what main.py used to pay before doing anything at all; it is
+skipped when the GUI dependencies are not installed. Run from the repository root:
+
+    python benchmarks/bench_startup.py [--runs 10]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def time_command(args, runs, stdin=None):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, *args], cwd=ROOT, input=stdin, capture_output=True, text=True)
+        samples.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            return {"error": result.stderr.strip().splitlines()[-1:]}
+    return {"mean_ms": statistics.mean(samples) * 1000, "median_ms": statistics.median(samples) * 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as output:
+        results = {
+            "runs": args.runs,
+            "python_baseline": time_command(["-c", "pass"], args.runs),
+            "main_help": time_command(["main.py", "--help"], args.runs),
+            "batch_empty_input": time_command(["main.py", "--input", "-", "--output", output], args.runs, stdin=""),
+            "import_gui": time_command(["-c", "import gui"], args.runs),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+Local stand-in for a media host, used by the offline benchmarks.
+
+Serves deterministic synthetic files at /media/<name>.<ext>. Query parameters
+shape each response:
+
+    size      file size in bytes (default 1 MiB)
+    rate      bandwidth cap per connection in bytes/s (default unlimited)
+    latency   seconds to wait before answering (default 0)
+
+With a `root` directory, real files in it are served the same way at
+/files/<name>, e.g. media that FFmpeg can actually post-process.
+
+With `max_connections`, GETs beyond that many concurrent transfers are refused
+with 429 Too Many Requests, the way CDNs push back on too many parallel ranges.
+
+HEAD and single-range GET requests are supported, so yt-dlp can resume and
+probe files the way it would against a real CDN. yt-dlp's generic extractor
+treats these URLs as direct downloads, so no real extractor is involved.
+
+    with MediaServer() as server:
+        url = server.url("clip", size=5_000_000, rate=2_000_000)
+"""
+import http.server
+import os
+import random
+import re
+import sys
+import threading
+import time
+from urllib.parse import urlencode, urlsplit, parse_qs
+
+BLOCK_SIZE = 64 * 1024
+WRITE_CHUNK = 16 * 1024
+CONTENT_TYPES = {
+    'mp4': 'video/mp4',
+    'm4a': 'audio/mp4',
+    'webm': 'video/webm',
+    'mp3': 'audio/mpeg',
+}
+_BLOCK = random.Random(0).randbytes(BLOCK_SIZE)
+_RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)$')
+
+
+def synthetic_bytes(start, end):
+    """Returns bytes [start, end) of the endless synthetic stream every file is cut from."""
+    out = bytearray()
+    while start < end:
+        offset = start % BLOCK_SIZE
+        take = min(BLOCK_SIZE - offset, end - start)
+        out += _BLOCK[offset:offset + take]
+        start += take
+    return bytes(out)
+
+
+def _file_reader(path):
+    def read(start, end):
+        with open(path, 'rb') as f:
+            f.seek(start)
+            return f.read(end - start)
+    return read
+
+
+class MediaRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _serve(self, send_body):
+        parts = urlsplit(self.path)
+        query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        match = re.fullmatch(r'/media/[\w-]+\.(\w+)', parts.path)
+        file_match = re.fullmatch(r'/files/([\w.-]+)', parts.path)
+        if match:
+            size, ext, read = int(query.get('size', 1024 * 1024)), match.group(1), synthetic_bytes
+        elif file_match and self.server.root and os.path.isfile(os.path.join(self.server.root, file_match.group(1))):
+            path = os.path.join(self.server.root, file_match.group(1))
+            size, ext, read = os.path.getsize(path), path.rsplit('.', 1)[-1], _file_reader(path)
+        else:
+            self.send_error(404)
+            return
+        rate = float(query['rate']) if 'rate' in query else self.server.default_rate
+        latency = float(query.get('latency', self.server.default_latency))
+        if latency:
+            time.sleep(latency)
+        if send_body and not self.server.open_transfer():
+            self.server.count_rejected()
+            self.send_response(429)
+            self.send_header('Retry-After', '1')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        try:
+            self._respond(size, ext, read, rate, send_body)
+        finally:
+            if send_body:
+                self.server.close_transfer()
+
+    def _respond(self, size, ext, read, rate, send_body):
+        start, end = 0, size
+        range_match = _RANGE_RE.match(self.headers.get('Range', ''))
+        if range_match and (range_match.group(1) or range_match.group(2)):
+            if range_match.group(1):
+                start = int(range_match.group(1))
+                end = min(size, int(range_match.group(2)) + 1) if range_match.group(2) else size
+            else:
+                start = max(0, size - int(range_match.group(2)))
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end - 1}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPES.get(ext, 'application/octet-stream'))
+        self.send_header('Content-Length', str(end - start))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        self.server.count_request()
+        if send_body:
+            self._send_body(read, start, end, rate)
+
+    def _send_body(self, read, start, end, rate):
+        began = time.monotonic()
+        sent = 0
+        try:
+            while start < end:
+                chunk = read(start, min(end, start + WRITE_CHUNK))
+                self.wfile.write(chunk)
+                start += len(chunk)
+                sent += len(chunk)
+                if rate:
+                    # Sleep off whatever we are ahead of the per-connection budget
+                    ahead = sent / rate - (time.monotonic() - began)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.server.count_bytes(sent)
+
+
+class MediaServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, rate=None, latency=0.0, max_connections=None, root=None):
+        super().__init__((host, port), MediaRequestHandler)
+        self.root = root
+        self.default_rate = rate
+        self.default_latency = latency
+        self.max_connections = max_connections
+        self.requests_served = 0
+        self.requests_rejected = 0
+        self.bytes_sent = 0
+        self._transfers = 0
+        self._stats_lock = threading.Lock()
+        self._thread = None
+
+    def url(self, name, size=1024 * 1024, ext="mp4", **params):
+        query = urlencode({'size': size, **params})
+        return f"http://{self.server_address[0]}:{self.server_port}/media/{name}.{ext}?{query}"
+
+    def file_url(self, filename, **params):
+        query = f"?{urlencode(params)}" if params else ""
+        return f"http://{self.server_address[0]}:{self.server_port}/files/{filename}{query}"
+
+    def handle_error(self, request, client_address):
+        # Clients dropping idle keep-alive connections is normal, not worth a traceback
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+    def open_transfer(self):
+        with self._stats_lock:
+            if self.max_connections is not None and self._transfers >= self.max_connections:
+                return False
+            self._transfers += 1
+            return True
+
+    def close_transfer(self):
+        with self._stats_lock:
+            self._transfers -= 1
+
+    def count_rejected(self):
+        with self._stats_lock:
+            self.requests_rejected += 1
+
+    def count_request(self):
+        with self._stats_lock:
+            self.requests_served += 1
+
+    def count_bytes(self, sent):
+        with self._stats_lock:
+            self.bytes_sent += sent
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Serve synthetic media for manual testing.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--rate", type=float, default=None, help="default bandwidth cap per connection, bytes/s")
+    parser.add_argument("--latency", type=float, default=0.0, help="default response latency, seconds")
+    parser.add_argument("--root", help="also serve the files in this directory at /files/<name>")
+    parser.add_argument("--max-connections", type=int, default=None, help="refuse concurrent transfers beyond this with 429")
+    args = parser.parse_args()
+    server = MediaServer(port=args.port, rate=args.rate, latency=args.latency, max_connections=args.max_connections,
+                         root=args.root)
+    print(f"Serving synthetic media on {server.url('clip')} (pid {os.getpid()})")
+    server.serve_forever()
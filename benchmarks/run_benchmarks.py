@@ -0,0 +1,421 @@
+"""
+Offline benchmark suite.
+
+Everything runs against benchmarks/media_server.py on localhost, with yt-dlp's
+generic extractor, so results do not depend on YouTube or the network. Results
+are printed and, with --output, written as JSON; --compare prints the relative
+change of every metric against an earlier results file. Run from the repository root:
+
+    python benchmarks/run_benchmarks.py --output results.json [--quick] [--compare old.json]
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import yt_dlp
+from media_server import MediaServer
+from downloader import Downloader, MetadataCache
+from scheduler import DownloadScheduler, COMPLETED
+from bandwidth import BandwidthManager, INTERACTIVE
+from history import HistoryStore
+from gui_queue import GuiUpdateQueue
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "mean_ms": statistics.mean(samples) * 1000,
+        "p50_ms": samples[len(samples) // 2] * 1000,
+        "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+    }
+
+
+class PeakRSS:
+    """
+    Samples the process's resident set size in the background and keeps the peak.
+
+    tracemalloc would see Python allocations only and slows yt-dlp's transfer loop
+    several-fold, so the OS figure is sampled instead (Linux /proc; elsewhere the
+    lifetime peak from getrusage).
+    """
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    @staticmethod
+    def current():
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, AttributeError):
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.current())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+
+def bench_batch(server, workdir, jobs, size, rate, latency, workers):
+    """Downloads `jobs` files through the scheduler and reports throughput, per-job latency and peak memory."""
+    downloader = Downloader(metadata_cache=MetadataCache(os.path.join(workdir, f"meta-{workers}.sqlite")))
+    output = os.path.join(workdir, f"batch-{workers}")
+    os.makedirs(output)
+    submitted, finished = {}, {}
+
+    def on_update(job):
+        if job.finished and job.id not in finished:
+            finished[job.id] = time.perf_counter()
+
+    scheduler = DownloadScheduler(downloader, max_workers=workers, on_update=on_update)
+    with PeakRSS() as memory:
+        start = time.perf_counter()
+        batch = []
+        for i in range(jobs):
+            url = server.url(f"batch{workers}-{i}", size=size, rate=rate, latency=latency)
+            job = scheduler.submit(url, download_path=output, quality="Best", file_format="mp4", download_subtitles=False)
+            submitted[job.id] = time.perf_counter()
+            batch.append(job)
+        scheduler.join()
+        wall = time.perf_counter() - start
+    scheduler.shutdown()
+    downloader.engine.close()
+
+    completed = [job for job in batch if job.status == COMPLETED]
+    return {
+        "workers": workers,
+        "jobs": jobs,
+        "completed": len(completed),
+        "wall_s": wall,
+        "throughput_mb_s": len(completed) * size / wall / 1e6,
+        "job_latency": summarize([finished[job.id] - submitted[job.id] for job in batch]),
+        "peak_rss_mb": memory.peak / 1e6,
+    }
+
+
+def bench_accelerated(workdir, jobs, size, rate, max_connections=None):
+    """
+    Downloads `jobs` files one after another from a host capping each connection at `rate`,
+    plainly and in accelerated mode, where the connection tuner learns across the jobs.
+    With `max_connections`, the host refuses extra connections with 429.
+    """
+    results = {}
+    with MediaServer(rate=rate, max_connections=max_connections) as server:
+        for accelerated in (False, True):
+            mode = "accelerated" if accelerated else "plain"
+            downloader = Downloader(metadata_cache=MetadataCache(os.path.join(workdir, f"meta-{mode}-{max_connections}.sqlite")))
+            output = os.path.join(workdir, f"{mode}-{max_connections}")
+            os.makedirs(output)
+            samples, connections = [], []
+            for i in range(jobs):
+                connections.append(downloader.tuner.connections(server.server_address[0]))
+                start = time.perf_counter()
+                downloader.download(server.url(f"{mode}-{i}", size=size), output, "Best", "mp4", False,
+                                    lambda d: None, accelerated=accelerated)
+                samples.append(time.perf_counter() - start)
+            downloader.engine.close()
+            results[mode] = {
+                "job": summarize(samples),
+                "throughput_mb_s": jobs * size / sum(samples) / 1e6,
+                "connections": connections if accelerated else None,
+            }
+        results["requests_rejected"] = server.requests_rejected
+    return results
+
+
+def bench_bandwidth(server, workdir, jobs, size, cap):
+    """
+    Runs `jobs` batch downloads under a global cap of `cap` bytes/s and, once they are
+    under way, one interactive download. Reports how closely the cap held and how long
+    the interactive job took against the time it would need with the whole cap to itself.
+    """
+    downloader = Downloader(metadata_cache=MetadataCache(os.path.join(workdir, "meta-bandwidth.sqlite")),
+                            bandwidth=BandwidthManager(limit=cap))
+    output = os.path.join(workdir, "bandwidth")
+    os.makedirs(output)
+    scheduler = DownloadScheduler(downloader, max_workers=jobs + 1)
+    options = dict(download_path=output, quality="Best", file_format="mp4", download_subtitles=False)
+    start = time.perf_counter()
+    batch = [scheduler.submit(server.url(f"bandwidth-batch-{i}", size=size), **options) for i in range(jobs)]
+    time.sleep(1.0)
+    interactive_start = time.perf_counter()
+    interactive = scheduler.submit(server.url("bandwidth-interactive", size=size), priority=INTERACTIVE, **options)
+    while not interactive.finished:
+        time.sleep(0.01)
+    interactive_s = time.perf_counter() - interactive_start
+    scheduler.join()
+    wall = time.perf_counter() - start
+    scheduler.shutdown()
+    downloader.engine.close()
+    return {
+        "cap_mb_s": cap / 1e6,
+        "jobs": jobs,
+        "completed": sum(1 for job in batch + [interactive] if job.status == COMPLETED),
+        "achieved_mb_s": (jobs + 1) * size / wall / 1e6,
+        "interactive_s": interactive_s,
+        "interactive_alone_s": size / cap,
+    }
+
+
+def bench_write_buffer(server, workdir, jobs, size, buffer_sizes):
+    """Downloads `jobs` unthrottled files with each fixed write buffer size (None: yt-dlp's adaptive one)."""
+    results = {}
+    for buffer_size in buffer_sizes:
+        label = str(buffer_size or "adaptive")
+        downloader = Downloader(metadata_cache=MetadataCache(os.path.join(workdir, f"meta-buffer-{label}.sqlite")),
+                                write_buffer_size=buffer_size)
+        output = os.path.join(workdir, f"buffer-{label}")
+        os.makedirs(output)
+        scheduler = DownloadScheduler(downloader, max_workers=jobs)
+        start = time.perf_counter()
+        batch = [scheduler.submit(server.url(f"buffer-{label}-{i}", size=size), download_path=output, quality="Best",
+                                  file_format="mp4", download_subtitles=False) for i in range(jobs)]
+        scheduler.join()
+        wall = time.perf_counter() - start
+        scheduler.shutdown()
+        downloader.engine.close()
+        completed = sum(1 for job in batch if job.status == COMPLETED)
+        results[label] = {"completed": completed, "wall_s": wall, "throughput_mb_s": completed * size / wall / 1e6}
+    return results
+
+
+def bench_postprocessing(workdir, jobs, seconds, rate):
+    """
+    Audio jobs that need an FFmpeg transcode (m4a to mp3), run back to back on one download
+    worker: post-processing inline after each transfer, against the scheduler's pipeline
+    where the next transfer starts while FFmpeg works. Skipped when FFmpeg is not installed.
+    """
+    if not shutil.which("ffmpeg"):
+        return {"skipped": "ffmpeg not found"}
+    media = os.path.join(workdir, "media")
+    os.makedirs(media)
+    subprocess.run(["ffmpeg", "-loglevel", "error", "-y", "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+                    "-c:a", "aac", os.path.join(media, "tone.m4a")], check=True)
+    for mode in ("inline", "pipelined"):
+        for i in range(jobs):
+            shutil.copy(os.path.join(media, "tone.m4a"), os.path.join(media, f"{mode}{i}.m4a"))
+
+    results = {}
+    with MediaServer(rate=rate, root=media) as server:
+        downloader = Downloader(metadata_cache=MetadataCache(os.path.join(workdir, "meta-postprocess.sqlite")))
+        for mode in ("inline", "pipelined"):
+            output = os.path.join(workdir, f"postprocess-{mode}")
+            os.makedirs(output)
+            urls = [server.file_url(f"{mode}{i}.m4a") for i in range(jobs)]
+            start = time.perf_counter()
+            if mode == "inline":
+                for url in urls:
+                    downloader.download(url, output, "Best", "mp3", False, lambda d: None)
+            else:
+                scheduler = DownloadScheduler(downloader, max_workers=1)
+                for url in urls:
+                    scheduler.submit(url, download_path=output, quality="Best", file_format="mp3", download_subtitles=False)
+                scheduler.join()
+                scheduler.shutdown()
+            results[mode] = {"wall_s": time.perf_counter() - start, "files": len(os.listdir(output))}
+        downloader.engine.close()
+    results["speedup"] = results["inline"]["wall_s"] / results["pipelined"]["wall_s"]
+    return results
+
+
+def bench_extraction(server, workdir, calls):
+    """Per-call cost of getting video info: fresh YoutubeDL, pooled engine, and a metadata cache hit."""
+    def timed(fn):
+        samples = []
+        for i in range(calls):
+            start = time.perf_counter()
+            fn(i)
+            samples.append(time.perf_counter() - start)
+        return summarize(samples)
+
+    def fresh(i):
+        with yt_dlp.YoutubeDL({'quiet': True, 'noplaylist': True}) as ydl:
+            ydl.extract_info(server.url(f"fresh-{i}"), download=False)
+
+    downloader = Downloader(metadata_cache=MetadataCache(os.path.join(workdir, "meta-extract.sqlite")))
+    downloader.get_video_info(server.url("warmup"))
+    results = {
+        "fresh_engine": timed(fresh),
+        "pooled_uncached": timed(lambda i: downloader.get_video_info(server.url(f"pooled-{i}"))),
+        "metadata_cache_hit": timed(lambda i: downloader.get_video_info(server.url(f"pooled-{i}"))),
+    }
+    downloader.engine.close()
+    return results
+
+
+def bench_history(workdir, sizes, writes):
+    """Cost of recording one download once the history already holds N entries, against the old JSON rewrite."""
+    results = {}
+    for n in sizes:
+        path = os.path.join(workdir, f"history-{n}.sqlite")
+        store = HistoryStore(path, legacy_json=None)
+        now = time.time()
+        rows = ((f"Video number {i}", f"/downloads/video-{i}.mp4", f"id{i:08d}", "mp4", 10_000_000, now) for i in range(n))
+        store._db.executemany(
+            "INSERT INTO history (title, path, video_id, format, size, downloaded_at) VALUES (?, ?, ?, ?, ?, ?)", rows)
+        store._db.commit()
+
+        add_samples = []
+        for i in range(writes):
+            start = time.perf_counter()
+            store.add(f"New video {i}", f"/downloads/new-{i}.mp4", video_id=f"new{i}", file_format="mp4", size=1)
+            add_samples.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        store.page(0, 50)
+        first_page = time.perf_counter() - start
+        start = time.perf_counter()
+        store.page(0, 50, "number 4242")
+        search = time.perf_counter() - start
+        store.close()
+
+        # What add_to_history used to do: rewrite the whole list as indented JSON
+        entries = [{"title": f"Video number {i}", "path": f"/downloads/video-{i}.mp4"} for i in range(n)]
+        json_path = os.path.join(workdir, f"history-{n}.json")
+        start = time.perf_counter()
+        with open(json_path, 'w') as f:
+            json.dump(entries, f, indent=4)
+        json_rewrite = time.perf_counter() - start
+        os.remove(json_path)
+        os.remove(path)
+
+        results[str(n)] = {
+            "add": summarize(add_samples),
+            "first_page_ms": first_page * 1000,
+            "search_ms": search * 1000,
+            "legacy_json_rewrite_ms": json_rewrite * 1000,
+        }
+    return results
+
+
+def bench_gui_queue(producers, events_per_second, duration, fps):
+    """Several downloads reporting progress at yt-dlp-like rates while the GUI thread drains at `fps`."""
+    queue = GuiUpdateQueue(max_fps=fps)
+    done = threading.Event()
+
+    def produce(job_id):
+        for i in range(int(events_per_second * duration)):
+            queue.put_latest(('job', job_id), None, 'render', (i,))
+            if i % 100 == 0:
+                queue.put(None, 'history', (job_id, i))
+            time.sleep(1 / events_per_second)
+
+    threads = [threading.Thread(target=produce, args=(n,)) for n in range(producers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    drains = 0
+
+    def consume():
+        nonlocal drains
+        while not done.is_set():
+            queue.drain()
+            drains += 1
+            time.sleep(queue.frame_interval_ms / 1000)
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    for thread in threads:
+        thread.join()
+    done.set()
+    consumer.join()
+    queue.drain()
+    stats = queue.stats()
+    stats.update({
+        "producers": producers,
+        "wall_s": time.perf_counter() - start,
+        "frames": drains,
+        "reduction": stats['events_received'] / max(1, stats['events_applied']),
+    })
+    return stats
+
+
+def flatten(results, prefix=""):
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from flatten(value, f"{name}.")
+        elif isinstance(value, list):
+            for i, item in enumerate(value):
+                yield from flatten(item, f"{name}[{i}].")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+def compare(baseline_path, results):
+    with open(baseline_path) as f:
+        baseline = dict(flatten(json.load(f)))
+    for name, value in flatten(results):
+        old = baseline.get(name)
+        if old:
+            print(f"{name:60} {old:14.3f} -> {value:14.3f} ({(value - old) / old:+.1%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark suite.")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", metavar="BASELINE", help="print changes against an earlier results file")
+    parser.add_argument("--quick", action="store_true", help="smaller workloads; skips the 1M-entry history")
+    args = parser.parse_args()
+
+    history_sizes = (10_000, 100_000) if args.quick else (10_000, 100_000, 1_000_000)
+    jobs, size = (6, 1_000_000) if args.quick else (16, 4_000_000)
+
+    results = {
+        "meta": {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "yt_dlp": yt_dlp.version.__version__,
+            "quick": args.quick,
+        }
+    }
+    with tempfile.TemporaryDirectory() as workdir, MediaServer() as server:
+        # A per-connection cap makes concurrency visible, as it is against real CDNs
+        results["batch"] = [bench_batch(server, workdir, jobs, size, rate=2_000_000, latency=0.05, workers=workers)
+                            for workers in (1, 4, 8)]
+        results["accelerated"] = bench_accelerated(workdir, jobs=4 if args.quick else 8, size=size, rate=1_000_000)
+        results["accelerated_throttled"] = bench_accelerated(workdir, jobs=4 if args.quick else 8, size=size,
+                                                             rate=1_000_000, max_connections=5)
+        results["bandwidth"] = bench_bandwidth(server, workdir, jobs=4, size=size, cap=size / 2)
+        results["write_buffer"] = bench_write_buffer(server, workdir, jobs=4, size=size * 4,
+                                                     buffer_sizes=(None, 1024 * 1024, 4 * 1024 * 1024))
+        results["postprocessing"] = bench_postprocessing(workdir, jobs=3 if args.quick else 5,
+                                                         seconds=120 if args.quick else 300, rate=2_000_000)
+        results["extraction"] = bench_extraction(server, workdir, calls=10 if args.quick else 30)
+        results["history"] = bench_history(workdir, history_sizes, writes=200)
+    results["gui_queue"] = bench_gui_queue(producers=8, events_per_second=200, duration=2 if args.quick else 5, fps=20)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+Talks to a download daemon (see service.py) over its HTTP API, for the GUI, the
+CLI's --daemon mode and daemons pulling from another host's shared queue. Only
+protocol.py is shared with the daemon, so clients do not load yt-dlp.
+"""
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from urllib.parse import urlencode, quote
+
+from protocol import DEFAULT_HOST, DEFAULT_PORT, HEARTBEAT_INTERVAL, TOKEN_ENV, load_token
+
+DEFAULT_URL = f"http://{DEFAULT_HOST}:{DEFAULT_PORT}"
+# How long a freshly spawned daemon gets to start answering
+SPAWN_TIMEOUT = 20.0
+
+
+class ServiceError(Exception):
+    """The daemon could not be reached or refused a request."""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class MetricsView(dict):
+    """A finished attempt's metrics record as sent by the daemon, readable like a JobMetrics."""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def to_dict(self):
+        return dict(self)
+
+
+class JobView:
+    """A daemon's job as last reported, with the attributes of a scheduler DownloadJob."""
+
+    def __init__(self, data):
+        self.__dict__.update(data)
+        self.metrics = MetricsView(data['metrics']) if data.get('metrics') else None
+
+
+class ServiceClient:
+    """
+    Mirrors the daemon's API; every call raises ServiceError when it fails.
+
+    claim, renew, release and finish match SharedJobQueue, so a client can stand
+    in for the queue another daemon hosts.
+    """
+
+    def __init__(self, base_url=DEFAULT_URL, token=None, timeout=10):
+        self.base_url = base_url.rstrip('/')
+        self.token = token
+        self.timeout = timeout
+
+    def available(self):
+        try:
+            self._request("GET", "/status", timeout=2)
+            return True
+        except ServiceError:
+            return False
+
+    def status(self):
+        return self._request("GET", "/status")
+
+    def jobs(self):
+        return [JobView(job) for job in self._request("GET", "/jobs")['jobs']]
+
+    def job(self, job_id):
+        return JobView(self._request("GET", f"/jobs/{job_id}"))
+
+    def submit(self, url, **options):
+        """Queues a video, or a playlist to be expanded by the daemon. Returns the job."""
+        return JobView(self._request("POST", "/jobs", {"url": url, "options": options})['jobs'][0])
+
+    def submit_many(self, urls, **options):
+        return [JobView(job) for job in self._request("POST", "/jobs", {"urls": urls, "options": options})['jobs']]
+
+    def cancel(self, job_id):
+        return self._request("POST", f"/jobs/{job_id}/cancel")['cancelled']
+
+    def retry(self, job_id):
+        return self._request("POST", f"/jobs/{job_id}/retry")['retried']
+
+    def set_priority(self, job_id, priority):
+        return JobView(self._request("PATCH", f"/jobs/{job_id}", {"priority": priority}))
+
+    def set_rate_limit(self, job_id, rate):
+        return JobView(self._request("PATCH", f"/jobs/{job_id}", {"rate_limit": rate}))
+
+    def settings(self):
+        return self._request("GET", "/settings")
+
+    def update_settings(self, **settings):
+        """E.g. `update_settings(max_workers=5, max_bandwidth=None)`; None lifts a cap."""
+        return self._request("PUT", "/settings", settings)
+
+    def info(self, url):
+        return self._request("GET", "/info", query={"url": url}, timeout=max(self.timeout, 60))
+
+    def search(self, query, start=0, count=10):
+        return self._request("GET", "/search", query={"q": query, "start": start, "count": count},
+                             timeout=max(self.timeout, 60))['results']
+
+    def search_iter(self, query, page_size=10):
+        """Yields results page by page, like Downloader.search_iter."""
+        start = 0
+        while True:
+            results = self.search(query, start, page_size)
+            yield from results
+            if len(results) < page_size:
+                return
+            start += page_size
+
+    def unfinished(self):
+        return self._request("GET", "/unfinished")['jobs']
+
+    def resume_unfinished(self):
+        return [JobView(job) for job in self._request("POST", "/unfinished/resume")['jobs']]
+
+    def discard_unfinished(self):
+        self._request("POST", "/unfinished/discard")
+
+    def enqueue_shared(self, url, **options):
+        return self._request("POST", "/queue", {"url": url, "options": options})['queue_ids'][0]
+
+    def queue_counts(self):
+        return self._request("GET", "/queue")
+
+    def claim(self, worker):
+        return self._request("POST", "/queue/claim", {"worker": worker})['item']
+
+    def renew(self, queue_id, worker):
+        return self._request("POST", f"/queue/{queue_id}/renew", {"worker": worker})['renewed']
+
+    def release(self, queue_id, worker):
+        return self._request("POST", f"/queue/{queue_id}/release", {"worker": worker})['released']
+
+    def finish(self, queue_id, worker, status, result=None, error=None):
+        body = {"worker": worker, "status": status, "result": result, "error": error}
+        return self._request("POST", f"/queue/{queue_id}/finish", body)['finished']
+
+    def events(self):
+        """
+        Yields the daemon's events as dicts: first a snapshot of all jobs, then job
+        and status updates. Ends when the connection drops.
+        """
+        request = self._build("GET", "/events")
+        try:
+            # The daemon sends at least a heartbeat this often, anything longer means it is gone
+            with urllib.request.urlopen(request, timeout=HEARTBEAT_INTERVAL * 2) as response:
+                for line in response:
+                    if line.strip():
+                        yield json.loads(line)
+        except (OSError, ValueError) as e:
+            raise ServiceError(f"Event stream from {self.base_url} ended: {e}")
+
+    def _build(self, method, path, body=None, query=None):
+        url = f"{self.base_url}{quote(path)}"
+        if query:
+            url += f"?{urlencode(query)}"
+        if body is None and method != "GET":
+            # The daemon only takes JSON bodies, even empty ones
+            body = {}
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        request = urllib.request.Request(url, data=data, method=method)
+        if data is not None:
+            request.add_header('Content-Type', 'application/json')
+        if self.token:
+            request.add_header('Authorization', f"Bearer {self.token}")
+        return request
+
+    def _request(self, method, path, body=None, query=None, timeout=None):
+        request = self._build(method, path, body, query)
+        try:
+            with urllib.request.urlopen(request, timeout=timeout or self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read()).get('error') or e.reason
+            except ValueError:
+                message = e.reason
+            raise ServiceError(f"{method} {path}: {message}", status=e.code)
+        except (OSError, ValueError) as e:
+            raise ServiceError(f"Could not reach the download daemon at {self.base_url}: {e}")
+
+
+def ensure_daemon(client, daemon_args=()):
+    """
+    Returns once the daemon behind `client` answers, starting one in the background
+    first if none does. The daemon outlives the process that started it. A client
+    without a token is given this user's, which the spawned daemon then requires.
+    """
+    if not client.token:
+        client.token = load_token()
+    if client.available():
+        return
+    main = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    host_port = client.base_url.split('://', 1)[-1]
+    command = [sys.executable, main, "--serve", "--listen", host_port, *daemon_args]
+    env = dict(os.environ)
+    if client.token:
+        env[TOKEN_ENV] = client.token
+    logging.info(f"Starting the download daemon: {' '.join(command)}")
+    subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                     env=env, start_new_session=True)
+    deadline = time.monotonic() + SPAWN_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(0.2)
+        if client.available():
+            return
+    raise ServiceError(f"The download daemon did not start on {client.base_url}")
@@ -1,82 +1,659 @@
 import yt_dlp
+from yt_dlp.extractor import gen_extractor_classes, get_info_extractor
+from yt_dlp.postprocessor import get_postprocessor
+from yt_dlp.utils import PagedList, sanitize_filename
+import contextlib
+import itertools
 import logging
 import re
 import os
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 
-def search_youtube(query, max_results=10):
-    """Searches YouTube and returns a list of videos."""
-    try:
-        ydl_opts = {
-            'quiet': True,
-            'extract_flat': True,
-            'force_generic_extractor': True,
-        }
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            result = ydl.extract_info(f"ytsearch{max_results}:{query}", download=False)
-            return result.get('entries', [])
-    except Exception as e:
-        logging.error(f"Youtube failed: {e}")
-        return []
+from metrics import MetricsRecorder
+from acceleration import ConnectionTuner, accelerate_format, stream_host, THROTTLE_HOOK_PARAM
+from formats import plan_formats
+from bandwidth import BandwidthManager, BATCH
+from storage import check_free_space, preallocate, move_into_place
+from subtitles import SubtitleCache, select_subtitles, fetch_subtitle
+
+SEARCH_MAX_RESULTS = 500
+# Accelerated mode: largest byte range per request, and the least a job must move to teach the tuner anything
+ACCELERATED_CHUNK_SIZE = 10 * 1024 * 1024
+MIN_TUNING_BYTES = 2 * 1024 * 1024
+# Fixed read size while a bandwidth cap applies, so one read never runs a bucket far into debt
+CAPPED_READ_SIZE = 256 * 1024
+# Downloads land next to their final place, on the same volume, so moving them there is one atomic rename.
+# The name is stable per video and target format, so an interrupted .part file is picked up again and jobs
+# for the same video in different formats do not share files. Two jobs for the same video and format would,
+# so callers must not run them at once; the scheduler attaches the second to the first.
+TEMP_TEMPLATE = '%(id)s.tmp-{file_format}.%(ext)s'
+# ydl param through which fetch collects the post-processing it leaves to finish
+DEFERRED_POSTPROCESSING_PARAM = 'deferred_postprocessing'
+# Format plans name exact format ids, so the compiled selectors are capped rather than kept forever
+MAX_FORMAT_SELECTORS = 256
+# How many levels of nested playlists (channel -> tab -> playlist) are followed
+MAX_PLAYLIST_DEPTH = 3
+YOUTUBE_ID_RE = re.compile(r'(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/|live/)|youtu\.be/)([0-9A-Za-z_-]{11})')
+
+def is_playlist_url(url, ie_key=None):
+    """
+    Tells, without a request, whether a URL names a playlist or channel rather than a
+    single video. Watch URLs that also carry a playlist count as the video alone.
+    `ie_key` names the extractor when it is already known, e.g. from a flat entry.
+    """
+    if YOUTUBE_ID_RE.search(url):
+        return False
+    if ie_key:
+        candidates = [get_info_extractor(ie_key)]
+    else:
+        candidates = (ie for ie in gen_extractor_classes() if ie.ie_key() != 'Generic')
+    for ie in candidates:
+        if ie.suitable(url):
+            # YouTube's tab extractor serves channels, playlists and feeds alike
+            return ie.ie_key() == 'YoutubeTab' or ie.is_single_video(url) is False
+    return False
+
+def _iter_entries(entries):
+    """Iterates a playlist's entries without keeping them, whether a generator, a list or a PagedList."""
+    if isinstance(entries, PagedList):
+        for page in itertools.count():
+            items = entries.getpage(page)
+            if not items:
+                return
+            yield from items
+    else:
+        yield from entries or []
+
+class SearchCache:
+    """In-memory results of recent searches, kept for `ttl` seconds for the `max_queries` latest queries."""
+
+    def __init__(self, ttl=15 * 60, max_queries=32):
+        self.ttl = ttl
+        self.max_queries = max_queries
+        self._queries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, query):
+        """Returns `(entries, complete)` for a cached query, or None."""
+        with self._lock:
+            cached = self._queries.get(query)
+            if cached is None:
+                return None
+            if time.time() - cached['stored_at'] > self.ttl:
+                del self._queries[query]
+                return None
+            self._queries.move_to_end(query)
+            return list(cached['entries']), cached['complete']
+
+    def append(self, query, entry, position):
+        """Stores the result at `position` for `query`, unless an earlier stream already has."""
+        with self._lock:
+            cached = self._queries.get(query)
+            if cached is None or position == 0:
+                cached = self._queries[query] = {'entries': [], 'complete': False, 'stored_at': time.time()}
+            if position == len(cached['entries']):
+                cached['entries'].append(entry)
+            self._queries.move_to_end(query)
+            while len(self._queries) > self.max_queries:
+                self._queries.popitem(last=False)
+
+    def mark_complete(self, query):
+        with self._lock:
+            if query in self._queries:
+                self._queries[query]['complete'] = True
+
+class PipelinedYoutubeDL(yt_dlp.YoutubeDL):
+    """
+    YoutubeDL that can hand post-processing off instead of running it inline.
+
+    While the `DEFERRED_POSTPROCESSING_PARAM` param holds a list, every
+    downloaded file's `(filename, info, files_to_move)` is appended to it in
+    place of running the postprocessors; `Downloader.finish` runs them later.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Compiled selectors read the params of the instance that built them, so each instance keeps its own
+        self.compiled_format_selectors = {}
+
+    def post_process(self, filename, info, files_to_move=None):
+        deferred = self.params.get(DEFERRED_POSTPROCESSING_PARAM)
+        if deferred is None:
+            return super().post_process(filename, info, files_to_move)
+        info['filepath'] = filename
+        deferred.append((filename, info, files_to_move))
+        return info
+
+class YoutubeDLPool:
+    """
+    A small pool of warm YoutubeDL instances, checked out one operation at a time.
+
+    Instances keep their extractors and HTTP connections between calls and share
+    a single cookie jar. Per-call options are layered over `base_opts` on checkout
+    and rolled back on return, so they must be ones yt-dlp reads at call time:
+    plain params such as `outtmpl`, `format`, `noplaylist` or `merge_output_format`,
+    plus `progress_hooks`, `postprocessor_hooks` and `postprocessors`.
+    """
+
+    def __init__(self, base_opts=None, size=8):
+        self.base_opts = {'quiet': True, 'noprogress': True, **(base_opts or {})}
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+        self._cookiejar = None
+
+    @contextlib.contextmanager
+    def checkout(self, opts=None):
+        ydl = self._acquire()
+        saved = (ydl.params, ydl.format_selector, ydl._progress_hooks, ydl._postprocessor_hooks, ydl._pps)
+        try:
+            self._apply(ydl, dict(opts or {}))
+            yield ydl
+        finally:
+            ydl.params, ydl.format_selector, ydl._progress_hooks, ydl._postprocessor_hooks, ydl._pps = saved
+            self._release(ydl)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for ydl in idle:
+            ydl.close()
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        ydl = PipelinedYoutubeDL(dict(self.base_opts))
+        with self._lock:
+            if self._cookiejar is None:
+                self._cookiejar = ydl.cookiejar
+            else:
+                # Overrides the lazily-built jar before any request is made
+                ydl.__dict__['cookiejar'] = self._cookiejar
+        return ydl
+
+    def _release(self, ydl):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(ydl)
+                return
+        ydl.close()
+
+    def _apply(self, ydl, opts):
+        progress_hooks = opts.pop('progress_hooks', [])
+        postprocessor_hooks = opts.pop('postprocessor_hooks', [])
+        postprocessors = opts.pop('postprocessors', [])
+
+        ydl.params = {**ydl.params, **opts}
+        if 'outtmpl' in opts:
+            ydl.params['outtmpl'] = opts['outtmpl'] if isinstance(opts['outtmpl'], dict) else {'default': opts['outtmpl']}
+            ydl._parse_outtmpl()
+        if 'format' in opts:
+            ydl.format_selector = self._format_selector(ydl, opts['format'])
+
+        ydl._progress_hooks = [*ydl._progress_hooks, *progress_hooks]
+        ydl._postprocessor_hooks = [*ydl._postprocessor_hooks, *postprocessor_hooks]
+        ydl._pps = {when: list(pps) for when, pps in ydl._pps.items()}
+        for pp_def in postprocessors:
+            pp_def = dict(pp_def)
+            when = pp_def.pop('when', 'post_process')
+            ydl.add_post_processor(get_postprocessor(pp_def.pop('key'))(ydl, **pp_def), when=when)
+
+    def _format_selector(self, ydl, format_spec):
+        """
+        Compiles a format spec once per instance. A compiled selector reads its instance's
+        params (merge_output_format, check_formats) when it runs, which are the current
+        checkout's, so it must never be handed to another instance.
+        """
+        if format_spec in (None, '-') or callable(format_spec):
+            return format_spec
+        # Read while compiling rather than when selecting
+        key = (format_spec, ydl.params.get('allow_multiple_video_streams'), ydl.params.get('allow_multiple_audio_streams'))
+        selectors = ydl.compiled_format_selectors
+        selector = selectors.get(key)
+        if selector is None:
+            selector = ydl.build_format_selector(format_spec)
+            if len(selectors) >= MAX_FORMAT_SELECTORS:
+                selectors.pop(next(iter(selectors)))
+            selectors[key] = selector
+        return selector
+
+class PendingDownload:
+    """A fetched download whose post-processing and rename are still to be done by `Downloader.finish`."""
+
+    def __init__(self, url, download_path, file_format, ydl_opts, metrics):
+        self.url = url
+        self.download_path = download_path
+        self.file_format = file_format
+        self.ydl_opts = ydl_opts
+        self.metrics = metrics
+        self.info = None
+        self.deferred = []
+        # (track, future) for each subtitle track being fetched alongside the media
+        self.subtitles = []
+
+    @property
+    def needs_postprocessing(self):
+        """Whether anything heavier than moving files is waiting, i.e. a merge, fixup or conversion."""
+        return bool(self.ydl_opts.get('postprocessors')) or any(
+            info.get('__postprocessors') for _, info, _ in self.deferred)
+
+class MetadataCache:
+    """
+    On-disk cache of extracted video info, keyed by video id or normalized URL.
+
+    Entries expire after `ttl` seconds (stream URLs in the info go stale) and the
+    least recently used ones are evicted once the compressed payloads exceed `max_bytes`.
+    """
+
+    def __init__(self, path="metadata_cache.sqlite", ttl=3 * 3600, max_bytes=64 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS metadata (
+            key TEXT PRIMARY KEY, info BLOB NOT NULL, size INTEGER NOT NULL,
+            stored_at REAL NOT NULL, accessed_at REAL NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS metadata_accessed ON metadata (accessed_at)")
+        self._db.commit()
+
+    @staticmethod
+    def key(url):
+        """Maps the different spellings of a video URL onto one cache key."""
+        match = YOUTUBE_ID_RE.search(url)
+        if match:
+            return f"youtube:{match.group(1)}"
+        parts = urlsplit(url.strip())
+        query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+        return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip('/'), query, ''))
+
+    def get(self, url):
+        """Returns a fresh copy of the cached info for `url`, or None if missing or expired."""
+        key, now = self.key(url), time.time()
+        with self._lock:
+            row = self._db.execute("SELECT info, stored_at FROM metadata WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                self._db.execute("DELETE FROM metadata WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+            self._db.execute("UPDATE metadata SET accessed_at = ? WHERE key = ?", (now, key))
+            self._db.commit()
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, url, info):
+        blob = zlib.compress(json.dumps(info).encode('utf-8'))
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?)",
+                             (self.key(url), blob, len(blob), now, now))
+            self._evict(now)
+            self._db.commit()
+
+    def invalidate(self, url):
+        with self._lock:
+            self._db.execute("DELETE FROM metadata WHERE key = ?", (self.key(url),))
+            self._db.commit()
+
+    def _evict(self, now):
+        self._db.execute("DELETE FROM metadata WHERE stored_at < ?", (now - self.ttl,))
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM metadata").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute("SELECT key, size FROM metadata ORDER BY accessed_at").fetchall():
+            self._db.execute("DELETE FROM metadata WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
 
 class Downloader:
-    def get_video_info(self, url):
-        """Fetches video information without downloading."""
-        ydl_opts = {'noplaylist': True}
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
+    """
+    `write_buffer_size` fixes the size of each read from the network and write to
+    disk, in bytes. By default yt-dlp adapts it per transfer, starting small; large
+    fixed writes (a few MiB) suit fast NVMe drives and network-mounted folders,
+    where every write costs a round trip.
+
+    Subtitle tracks are fetched on a pool of `subtitle_workers` threads while the
+    media downloads, through `subtitle_cache`.
+    """
+
+    def __init__(self, metadata_cache=None, engine=None, search_cache=None, metrics=None, tuner=None, bandwidth=None,
+                 write_buffer_size=None, subtitle_cache=None, subtitle_workers=4):
+        self.metadata_cache = metadata_cache if metadata_cache is not None else MetadataCache()
+        self.engine = engine if engine is not None else YoutubeDLPool()
+        self.search_cache = search_cache if search_cache is not None else SearchCache()
+        self.metrics = metrics if metrics is not None else MetricsRecorder()
+        self.tuner = tuner if tuner is not None else ConnectionTuner()
+        self.bandwidth = bandwidth if bandwidth is not None else BandwidthManager()
+        self.write_buffer_size = write_buffer_size
+        self.subtitle_cache = subtitle_cache if subtitle_cache is not None else SubtitleCache()
+        self._subtitle_pool = ThreadPoolExecutor(max_workers=subtitle_workers, thread_name_prefix="subtitles")
+
+    def search_iter(self, query):
+        """
+        Yields search results one at a time, fetching result pages only as they are consumed.
+
+        Results already seen for `query` within the cache TTL are replayed without network access.
+        Close the generator to stop a search early and return its engine to the pool.
+        """
+        cached, complete = self.search_cache.get(query) or ([], False)
+        yield from cached
+        if complete:
+            return
+        try:
+            with self.engine.checkout() as ydl:
+                # process=False keeps 'entries' as the extractor's lazy generator of result pages
+                result = ydl.extract_info(f"ytsearch{SEARCH_MAX_RESULTS}:{query}", download=False, process=False)
+                for position, entry in enumerate(result.get('entries') or []):
+                    if not entry.get('thumbnail') and entry.get('thumbnails'):
+                        entry['thumbnail'] = entry['thumbnails'][-1].get('url')
+                    self.search_cache.append(query, entry, position)
+                    if position >= len(cached):
+                        yield entry
+            self.search_cache.mark_complete(query)
+        except Exception as e:
+            logging.error(f"Youtube failed: {e}")
+
+    def playlist_iter(self, url):
+        """
+        Yields the videos of a playlist or channel as flat entries (`url`, `id`, `title`,
+        `playlist_count`), fetching the listing page by page only as entries are consumed.
+
+        Nothing is extracted per video, so the first entry arrives after one page request
+        and memory stays flat however long the channel is. Nested playlists such as a
+        channel's tabs are followed; a video listed twice is yielded once.
+        Close the generator to stop early and return its engine to the pool.
+        """
+        ydl_opts = {'extract_flat': 'in_playlist', 'lazy_playlist': True, 'noplaylist': False}
+        with self.engine.checkout(ydl_opts) as ydl:
+            # Only ids are kept, a few dozen bytes per video
+            yield from self._walk_playlist(ydl, url, seen=set(), depth=0)
+
+    def _walk_playlist(self, ydl, url, seen, depth):
+        # process=False keeps 'entries' as the extractor's lazy generator of result pages
+        result = ydl.extract_info(url, download=False, process=False)
+        yield from self._walk_result(ydl, url, result, seen, depth)
+
+    def _walk_result(self, ydl, url, result, seen, depth):
+        if result.get('_type') in ('url', 'url_transparent'):
+            if depth < MAX_PLAYLIST_DEPTH:
+                yield from self._walk_playlist(ydl, result['url'], seen, depth + 1)
+            return
+        if result.get('_type') != 'playlist':
+            # The URL resolved to a single video after all
+            yield {'url': result.get('webpage_url') or url, 'id': result.get('id'),
+                   'title': result.get('title'), 'playlist_count': 1}
+            return
+        for entry in _iter_entries(result.get('entries')):
+            if not entry:
+                continue
+            entry_url = entry.get('url') or entry.get('webpage_url')
+            if entry.get('_type') == 'playlist' or (entry_url and is_playlist_url(entry_url, entry.get('ie_key'))):
+                if depth >= MAX_PLAYLIST_DEPTH:
+                    continue
+                if entry.get('_type') == 'playlist':
+                    yield from self._walk_result(ydl, entry_url, entry, seen, depth + 1)
+                else:
+                    yield from self._walk_playlist(ydl, entry_url, seen, depth + 1)
+                continue
+            key = entry.get('id') or entry_url
+            if not entry_url or key in seen:
+                continue
+            seen.add(key)
+            yield {'url': entry_url, 'id': entry.get('id'), 'title': entry.get('title'),
+                   'playlist_count': result.get('playlist_count')}
+
+    def get_video_info(self, url, metrics=None):
+        """
+        Fetches video information without downloading, going through the metadata cache.
+
+        With `metrics` (a JobMetrics), the time taken is recorded as the job's extraction phase.
+        """
+        with metrics.phase('extraction') if metrics else contextlib.nullcontext():
+            info = self.metadata_cache.get(url)
+            if metrics:
+                metrics.cache_hit = info is not None
+            if info is not None:
+                return info
+            ydl_opts = {'noplaylist': True}
+            with self.engine.checkout(ydl_opts) as ydl:
+                info = ydl.sanitize_info(ydl.extract_info(url, download=False), remove_private_keys=True)
+            self.metadata_cache.put(url, info)
             return info
 
     def _get_sanitized_filename(self, info, ext):
         """Generates a sanitized filename from video info."""
-        title = info.get('title', 'video')
-        # Remove characters that are invalid in filenames on most OSes
-        sanitized_title = re.sub(r'[\\/*?:"<>|]', "", title)
+        title = info.get('title') or info.get('id') or 'video'
+        # Remove characters that are invalid in filenames on most OSes, and trailing dots Windows drops
+        sanitized_title = re.sub(r'[\\/*?:"<>|\x00-\x1f]', "", title).strip().rstrip('. ')
+        # Leave room within the usual 255-byte limit for a " (n)" suffix and the extension
+        sanitized_title = sanitized_title.encode('utf-8')[:200].decode('utf-8', 'ignore') or info.get('id') or 'video'
         return f"{sanitized_title}.{ext}"
 
-    def download(self, url, download_path, quality, file_format, download_subtitles, progress_hook):
-        """Downloads the video, renames it, and returns the final path."""
-        # Use a simple, temporary name during download
-        temp_template = os.path.join(download_path, '%(id)s.%(ext)s')
-        
+    def download(self, url, download_path, quality, file_format, download_subtitles, progress_hook, info=None, metrics=None,
+                 accelerated=False, postprocessor_hook=None, priority=BATCH, rate_limit=None, bandwidth=None,
+                 subtitle_languages=None, auto_subtitles=False):
+        """
+        Downloads the video, post-processes and renames it, and returns the final path.
+
+        Pass `info` from `get_video_info` to skip extracting the video a second time. With
+        `accelerated`, fragments and byte ranges of the chosen streams are fetched over several
+        connections, as many as `self.tuner` currently finds worthwhile for the host serving them. Phase
+        timings go into `metrics` when the caller tracks the job (see `DownloadScheduler`);
+        otherwise the download is recorded and emitted to `self.metrics` sinks as a job of its own.
+
+        Transfers draw on `self.bandwidth` with `priority` (interactive or batch) and an optional
+        `rate_limit` in bytes per second, or through `bandwidth`, a BandwidthShare the caller
+        keeps to change them while the download runs.
+
+        With `download_subtitles`, one track is saved next to the video: the first of
+        `subtitle_languages` (default: English) the video has, else its own language;
+        auto-generated captions count only with `auto_subtitles`.
+        """
+        owns_metrics = metrics is None
+        if owns_metrics:
+            metrics = self.metrics.start(url)
+        try:
+            pending = self.fetch(url, download_path, quality, file_format, download_subtitles, progress_hook, info=info,
+                                 metrics=metrics, accelerated=accelerated, postprocessor_hook=postprocessor_hook,
+                                 priority=priority, rate_limit=rate_limit, bandwidth=bandwidth,
+                                 subtitle_languages=subtitle_languages, auto_subtitles=auto_subtitles)
+            path = self.finish(pending)
+        except Exception as e:
+            if owns_metrics:
+                self.metrics.finish(metrics, 'failed', str(e))
+            raise
+        if owns_metrics:
+            self.metrics.finish(metrics, 'completed')
+        return path
+
+    def fetch(self, url, download_path, quality, file_format, download_subtitles, progress_hook, info=None, metrics=None,
+              accelerated=False, postprocessor_hook=None, priority=BATCH, rate_limit=None, bandwidth=None,
+              subtitle_languages=None, auto_subtitles=False):
+        """
+        The network half of `download`: transfers the streams and returns a PendingDownload
+        whose post-processing (FFmpeg merge, audio extraction) and rename `finish` does.
+        Keeping the two apart lets CPU-bound FFmpeg work run while other transfers proceed.
+        """
+        if metrics is None:
+            metrics = self.metrics.start(url)
+        if info is None:
+            info = self.get_video_info(url, metrics=metrics)
+        metrics.title = info.get('title')
+        metrics.video_id = info.get('id')
+
+        share = bandwidth if bandwidth is not None else self.bandwidth.share(priority, rate_limit)
+        preallocated = set()
+
+        def measure_progress(d):
+            new_bytes = metrics.on_progress(d)
+            self.metrics.add_bytes(new_bytes)
+            # Claim the whole file's space as soon as its exact size is known
+            tmpfilename = d.get('tmpfilename')
+            if d['status'] == 'downloading' and d.get('total_bytes') and tmpfilename and tmpfilename not in preallocated:
+                preallocated.add(tmpfilename)
+                preallocate(tmpfilename, d['total_bytes'])
+            # Sleeping here holds back the thread that read the bytes, whichever downloader it is
+            share.consume(new_bytes)
+
         ydl_opts = {
-            'outtmpl': temp_template,
-            'progress_hooks': [progress_hook],
-            'writesubtitles': download_subtitles,
-            'allsubtitles': download_subtitles,
+            'outtmpl': os.path.join(download_path, TEMP_TEMPLATE.format(file_format=file_format)),
+            'continuedl': True,
+            'progress_hooks': [measure_progress, progress_hook],
+            'postprocessor_hooks': [metrics.on_postprocessor] + ([postprocessor_hook] if postprocessor_hook else []),
         }
 
-        if file_format in ['mp3', 'wav', 'm4a']:
-            ydl_opts['format'] = 'bestaudio/best'
-            ydl_opts['postprocessors'] = [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': file_format,
-            }]
-        else: # Video download
-            height = quality.split('p')[0]
-            ydl_opts['format'] = f'bestvideo[height<={height}]+bestaudio/best'
-            ydl_opts['merge_output_format'] = file_format
-
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            
-            # Determine the temporary path yt-dlp created
-            temp_path = ydl.prepare_filename(info).replace('.webm', f'.{file_format}').replace('.m4a', f'.{file_format}')
-
-            # Construct the new, sanitized path and rename the file
-            final_filename = self._get_sanitized_filename(info, file_format)
-            final_path = os.path.join(download_path, final_filename)
-            
-            # Ensure we don't try to rename a file that doesn't exist
-            if os.path.exists(temp_path):
-                os.rename(temp_path, final_path)
-                return final_path
-            else:
-                # Handle cases where the extension is different after post-processing
-                base_temp_path = os.path.join(download_path, info['id'])
-                possible_temp_path = f"{base_temp_path}.{file_format}"
-                if os.path.exists(possible_temp_path):
-                    os.rename(possible_temp_path, final_path)
-                    return final_path
-        
-        # Fallback if renaming logic fails
-        return None
\ No newline at end of file
+        # Copy or rename streams already in the target codec and container; transcode only when none is
+        plan = plan_formats(info, file_format, quality)
+        metrics.format_path = plan.path
+        metrics.format_plan = plan.description
+        logging.info(f"Format plan for {url}: {plan.path}, {plan.description}")
+        ydl_opts.update(plan.ydl_opts())
+        if plan.space_needed:
+            # Better to fail now than after minutes of transfer
+            check_free_space(download_path, plan.space_needed)
+
+        if share.limited:
+            ydl_opts.update({'buffersize': min(self.write_buffer_size or CAPPED_READ_SIZE, CAPPED_READ_SIZE),
+                             'noresizebuffer': True})
+        elif self.write_buffer_size:
+            ydl_opts.update({'buffersize': self.write_buffer_size, 'noresizebuffer': True})
+
+        # Format selection replaces these with the tuner's figure for the host the streams come from
+        tuning = {'host': urlsplit(url).hostname or "", 'connections': self.tuner.initial if accelerated else 1}
+        throttled = []
+        if accelerated:
+            ydl_opts.update({
+                'concurrent_fragment_downloads': tuning['connections'],
+                'http_chunk_size': ACCELERATED_CHUNK_SIZE,
+                # Refused connections are retried with backoff rather than failing the job
+                'fragment_retries': 10,
+                'retry_sleep_functions': {'fragment': lambda n: min(0.25 * 2 ** n, 8)},
+                THROTTLE_HOOK_PARAM: lambda: throttled.append(True),
+            })
+
+        pending = PendingDownload(url, download_path, file_format, ydl_opts, metrics)
+        if download_subtitles:
+            self._start_subtitles(pending, info, file_format, subtitle_languages, auto_subtitles)
+        with self.engine.checkout({**ydl_opts, DEFERRED_POSTPROCESSING_PARAM: pending.deferred}) as ydl:
+            ydl.format_selector = self._wrap_format_selector(ydl, metrics, accelerated, tuning)
+            try:
+                pending.info = self._process(ydl, url, info, metrics)
+            except BaseException:
+                self._discard_subtitles(pending)
+                raise
+            finally:
+                # Throughput a bandwidth cap held down says nothing about the host
+                held_back = share.held_seconds > 0.1 * metrics.phases.get('transfer', 0.0)
+                if accelerated and not held_back and (throttled or metrics.bytes_downloaded >= MIN_TUNING_BYTES):
+                    self.tuner.record(tuning['host'], tuning['connections'], metrics.throughput,
+                                      throttled=bool(throttled))
+        return pending
+
+    def finish(self, pending):
+        """Runs the post-processing `fetch` deferred, then renames the result. Returns the final path."""
+        opts = {**pending.ydl_opts, 'progress_hooks': []}
+        try:
+            with self.engine.checkout(opts) as ydl:
+                for filename, info, files_to_move in pending.deferred:
+                    # yt-dlp strips the fields a download shares with its video once processing returns
+                    full_info = {**pending.info, **info}
+                    full_info.pop('requested_downloads', None)
+                    # The merger and fixups were bound to the engine that downloaded; rebuild them on this one
+                    full_info['__postprocessors'] = [type(pp)(ydl) for pp in info.get('__postprocessors') or []]
+                    processed = ydl.post_process(filename, full_info, files_to_move)
+                    info.clear()
+                    info.update(processed)
+            with pending.metrics.phase('rename'):
+                return self._rename_output(pending)
+        except BaseException:
+            self._discard_subtitles(pending)
+            raise
+
+    def _start_subtitles(self, pending, info, file_format, languages, auto_captions):
+        """Starts fetching the chosen subtitle track, which then runs while the media downloads."""
+        track = select_subtitles(info, languages, auto_captions)
+        if track is None:
+            logging.info(f"No subtitles in {languages or 'the default languages'} for {pending.url}")
+            return
+        temp_name = f"{sanitize_filename(info.get('id') or 'video')}.tmp-{file_format}.{track['lang']}.{track['ext']}"
+        path = os.path.join(pending.download_path, temp_name)
+        future = self._subtitle_pool.submit(fetch_subtitle, self.engine, self.subtitle_cache, info, track, path)
+        pending.subtitles.append((track, future))
+
+    def _discard_subtitles(self, pending):
+        """Removes the subtitle files of a download that failed, once they are written."""
+        def remove(future):
+            if not future.exception():
+                try:
+                    os.remove(future.result())
+                except OSError:
+                    pass
+        for _, future in pending.subtitles:
+            future.add_done_callback(remove)
+
+    def _wrap_format_selector(self, ydl, metrics, accelerated, tuning):
+        """
+        Times format selection and, in accelerated mode, switches the chosen streams to
+        parallel ranges over as many connections as the tuner gives the host serving them,
+        which it records in `tuning`.
+        """
+        selector = ydl.format_selector
+        if not callable(selector):
+            return selector
+
+        def select(ctx):
+            with metrics.phase('format_selection'):
+                formats = list(selector(ctx))
+            if not accelerated:
+                return formats
+            host = stream_host(formats[0]) if formats else None
+            if host:
+                tuning['host'] = host
+                # The downloaders read this when they start, after selection; the params are this checkout's own copy
+                tuning['connections'] = ydl.params['concurrent_fragment_downloads'] = self.tuner.connections(host)
+            return [accelerate_format(f) for f in formats]
+        return select
+
+    def _process(self, ydl, url, info, metrics):
+        """Downloads from the given info and returns the processed info."""
+        try:
+            return ydl.process_ie_result(info, download=True)
+        except yt_dlp.utils.DownloadError as e:
+            # Stream URLs in cached info can expire; extract afresh once before giving up
+            logging.warning(f"Download from cached info failed for {url}, re-extracting: {e}")
+            self.metadata_cache.invalidate(url)
+            with metrics.phase('extraction'):
+                info = ydl.extract_info(url, download=False, process=False)
+            return ydl.process_ie_result(info, download=True)
+
+    def _rename_output(self, pending):
+        """
+        Moves the file post-processing ended with, as yt-dlp reports it, from its temporary
+        name to the sanitized title, and its subtitles alongside. Returns the final path.
+        """
+        downloads = [info for _, info, _ in pending.deferred] or pending.info.get('requested_downloads') or [pending.info]
+        temp_path = downloads[-1].get('filepath')
+        if not temp_path or not os.path.exists(temp_path):
+            raise FileNotFoundError(f"yt-dlp reported no output file for {pending.url}")
+        # The extension is whatever the file really is, which is the target format unless a fallback kicked in
+        ext = os.path.splitext(temp_path)[1].lstrip('.') or pending.file_format
+        final_path = move_into_place(temp_path, pending.download_path, self._get_sanitized_filename(pending.info, ext))
+        stem = os.path.splitext(os.path.basename(final_path))[0]
+        for track, future in pending.subtitles:
+            try:
+                path = future.result()
+            except Exception as e:
+                # Missing subtitles do not fail the download
+                logging.warning(f"Subtitles ({track['lang']}) for {pending.url} failed: {e}")
+                continue
+            move_into_place(path, pending.download_path, f"{stem}.{track['lang']}.{track['ext']}")
+        return final_path
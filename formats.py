@@ -0,0 +1,209 @@
+DIRECT = "direct"        # the chosen stream is already the target file; it is only renamed
+REMUX = "remux"          # streams are copied into the target container, nothing is re-encoded
+TRANSCODE = "transcode"  # no stream fits the target, FFmpeg has to re-encode
+AUTO = "auto"            # the info carries no usable format list, yt-dlp picks as before
+
+AUDIO_FORMATS = ('mp3', 'wav', 'm4a')
+
+# Codecs each audio target already is, by the prefix yt-dlp reports (e.g. "mp4a.40.2")
+AUDIO_CODECS = {
+    'm4a': ('mp4a', 'aac'),
+    'mp3': ('mp3',),
+    'wav': ('pcm',),
+}
+
+# Per video container: the codecs it is usually delivered with, and all that can be copied into it.
+# None means any codec goes (Matroska).
+VIDEO_CONTAINERS = {
+    'mp4': {
+        'preferred': (('avc1', 'avc3', 'h264'), ('mp4a', 'aac')),
+        'copyable': (('avc1', 'avc3', 'h264', 'hev1', 'hvc1', 'hevc', 'av01', 'vp09', 'vp9'),
+                     ('mp4a', 'aac', 'opus', 'mp3', 'ac-3', 'ec-3', 'flac', 'alac')),
+    },
+    'webm': {
+        'preferred': (('vp09', 'vp9', 'vp8', 'av01'), ('opus', 'vorbis')),
+        'copyable': (('vp09', 'vp9', 'vp8', 'av01'), ('opus', 'vorbis')),
+    },
+    'mkv': {
+        'preferred': (None, None),
+        'copyable': (None, None),
+    },
+}
+
+
+class FormatPlan:
+    """How one download reaches its target format: what to fetch and which FFmpeg work follows."""
+
+    def __init__(self, format_spec, path, description, postprocessors=(), merge_output_format=None, filesize=None):
+        self.format_spec = format_spec
+        self.path = path
+        self.description = description
+        self.postprocessors = list(postprocessors)
+        self.merge_output_format = merge_output_format
+        # Bytes the chosen streams come to, from filesize or filesize_approx; None when any is unknown
+        self.filesize = filesize
+
+    @property
+    def space_needed(self):
+        """Disk space the job peaks at: FFmpeg writes its output while the downloaded streams still exist."""
+        if self.filesize is None:
+            return None
+        return self.filesize if self.path == DIRECT else 2 * self.filesize
+
+    def ydl_opts(self):
+        opts = {'format': self.format_spec}
+        if self.postprocessors:
+            opts['postprocessors'] = self.postprocessors
+        if self.merge_output_format:
+            opts['merge_output_format'] = self.merge_output_format
+        return opts
+
+    def __repr__(self):
+        return f"FormatPlan({self.description!r})"
+
+
+def plan_formats(info, file_format, quality=None):
+    """
+    Picks the streams from `info['formats']` that reach `file_format` with the
+    least FFmpeg work: a stream already in the target codec and container is
+    downloaded as is, streams in codecs the container can hold are copied into
+    it, and only when neither exists is anything re-encoded. Never trades away
+    resolution for it; the codec preference applies among the best allowed height.
+    """
+    formats = [f for f in info.get('formats') or [] if f.get('format_id')]
+    if file_format in AUDIO_FORMATS:
+        plan = _plan_audio(formats, file_format) if formats else None
+        return plan or _legacy_plan(file_format, quality)
+    height = (quality or '').split('p')[0]
+    plan = _plan_video(formats, file_format, int(height) if height.isdigit() else None) if formats else None
+    return plan or _legacy_plan(file_format, quality)
+
+
+def _legacy_plan(file_format, quality):
+    if file_format in AUDIO_FORMATS:
+        return FormatPlan('bestaudio/best', AUTO, f"best audio -> {file_format}",
+                          postprocessors=[{'key': 'FFmpegExtractAudio', 'preferredcodec': file_format}])
+    return FormatPlan(_fallback_spec(file_format, quality), AUTO, f"best video+audio -> {file_format}",
+                      merge_output_format=file_format)
+
+
+def _fallback_spec(file_format, quality):
+    """What yt-dlp picks when the planned format ids are gone, e.g. after a re-extraction."""
+    if file_format in AUDIO_FORMATS:
+        return 'bestaudio/best'
+    height = (quality or '').split('p')[0]
+    if height.isdigit():
+        return f'bestvideo[height<={height}]+bestaudio/best'
+    return 'bestvideo+bestaudio/best'
+
+
+def _codec(value):
+    """Reduces "avc1.640028" to "avc1"; None when the extractor did not say."""
+    if not value:
+        return None
+    return value.split('.')[0].lower()
+
+
+def _matches(codec, codecs):
+    return codecs is None or (codec is not None and codec.startswith(codecs))
+
+
+def _has_audio(f):
+    return f.get('acodec') != 'none'
+
+
+def _has_video(f):
+    return f.get('vcodec') != 'none'
+
+
+def _bitrate(f, key):
+    return f.get(key) or f.get('tbr') or 0
+
+
+def _filesize(streams):
+    sizes = [f.get('filesize') or f.get('filesize_approx') for f in streams]
+    return sum(sizes) if all(sizes) else None
+
+
+def _describe(streams, target):
+    ids = '+'.join(f['format_id'] for f in streams)
+    codecs = '+'.join(codec for f in streams for codec in (_codec(f.get('vcodec')), _codec(f.get('acodec')))
+                      if codec and codec != 'none')
+    return f"{ids} ({codecs or 'unknown codec'}) -> {target}"
+
+
+def _plan_audio(formats, target):
+    candidates = [f for f in formats if _has_audio(f)]
+    if not candidates:
+        return None
+
+    def level(f):
+        codec = _codec(f.get('acodec'))
+        if codec is None:
+            # Nothing to go by but the extension
+            return 2 if f.get('ext') == target and not _has_video(f) else 0
+        if not _matches(codec, AUDIO_CODECS[target]):
+            return 0
+        return 2 if f.get('ext') == target and not _has_video(f) else 1
+
+    # Audio-only streams first, they are smaller than the same audio muxed with video
+    best = max(candidates, key=lambda f: (level(f), not _has_video(f), _bitrate(f, 'abr')))
+    spec = f"{best['format_id']}/{_fallback_spec(target, None)}"
+    if level(best) == 2:
+        return FormatPlan(spec, DIRECT, _describe([best], target), filesize=_filesize([best]))
+    # Extracting audio that is already in the target codec is a stream copy in yt-dlp
+    path = REMUX if level(best) == 1 else TRANSCODE
+    return FormatPlan(spec, path, _describe([best], target),
+                      postprocessors=[{'key': 'FFmpegExtractAudio', 'preferredcodec': target}],
+                      filesize=_filesize([best]))
+
+
+def _plan_video(formats, target, max_height):
+    container = VIDEO_CONTAINERS.get(target)
+    videos = [f for f in formats if _has_video(f) and (max_height is None or (f.get('height') or 0) <= max_height)]
+    if container is None or not videos:
+        return None
+    best_height = max(f.get('height') or 0 for f in videos)
+    videos = [f for f in videos if (f.get('height') or 0) == best_height]
+    audios = [f for f in formats if _has_audio(f) and not _has_video(f)]
+    preferred_v, preferred_a = container['preferred']
+    copyable_v, copyable_a = container['copyable']
+
+    def fits(streams, vcodecs, acodecs):
+        # Unknown codecs are taken on trust when the stream is already in the target container
+        return all(
+            (not _has_video(f) or _matches(_codec(f.get('vcodec')), vcodecs)
+             or (f.get('vcodec') is None and f.get('ext') == target))
+            and (not _has_audio(f) or _matches(_codec(f.get('acodec')), acodecs)
+                 or (f.get('acodec') is None and f.get('ext') == target))
+            for f in streams)
+
+    options = []
+    if audios:
+        audio = max(audios, key=lambda f: (fits([f], preferred_v, preferred_a), fits([f], copyable_v, copyable_a),
+                                           _bitrate(f, 'abr')))
+        options += [[f, audio] for f in videos if not _has_audio(f)]
+    options += [[f] for f in videos if _has_audio(f) or not audios]
+    if not options:
+        return None
+
+    def rank(streams):
+        copyable = fits(streams, copyable_v, copyable_a)
+        direct = len(streams) == 1 and streams[0].get('ext') == target and copyable
+        return (copyable, fits(streams, preferred_v, preferred_a), direct, sum(_bitrate(f, 'tbr') for f in streams))
+
+    streams = max(options, key=rank)
+    spec = f"{'+'.join(f['format_id'] for f in streams)}/{_fallback_spec(target, str(max_height or ''))}"
+    copyable, _, direct, _ = rank(streams)
+    if direct:
+        return FormatPlan(spec, DIRECT, _describe(streams, target), merge_output_format=target,
+                          filesize=_filesize(streams))
+    if copyable:
+        # A pair is merged by stream copy; a single stream in another container is remuxed
+        postprocessors = [] if len(streams) > 1 else [{'key': 'FFmpegVideoRemuxer', 'preferedformat': target}]
+        return FormatPlan(spec, REMUX, _describe(streams, target), postprocessors=postprocessors,
+                          merge_output_format=target, filesize=_filesize(streams))
+    # Merge into Matroska, which takes any codec, then re-encode into the target
+    return FormatPlan(spec, TRANSCODE, _describe(streams, target),
+                      postprocessors=[{'key': 'FFmpegVideoConvertor', 'preferedformat': target}],
+                      merge_output_format='mkv', filesize=_filesize(streams))
@@ -1,21 +1,42 @@
 import customtkinter as ctk
-from downloader import Downloader, search_youtube
+from downloader import is_playlist_url
+from formats import TRANSCODE
+from bandwidth import INTERACTIVE, BATCH
+from protocol import QUEUED, RUNNING, POSTPROCESSING, EXPANDING, COMPLETED, FAILED, CANCELLED, SKIPPED
+from client import ServiceClient, ServiceError, JobView, ensure_daemon
+from thumbnails import ThumbnailCache
+from history import HistoryStore
+from gui_queue import GuiUpdateQueue
 from tkinter import filedialog, messagebox
-from PIL import Image
-import requests
-from io import BytesIO
-import json
 import os
-import pyperclip
 import logging
-import subprocess
 import sys
 import threading
-from queue import Queue
+from collections import OrderedDict
+from itertools import islice
 from functools import partial
 
 class YouTubeDownloaderApp(ctk.CTk):
-    def __init__(self):
+    """
+    The window is a client of the download daemon (see service.py): downloads run
+    there and keep going when the window closes. Jobs are mirrored from the daemon's
+    event stream, and every action is a call to its API.
+    """
+    DEFAULT_CONCURRENCY = 3
+    PER_HOST_LIMIT = 4
+    RECONNECT_DELAY = 2.0
+    # Height of one History row in pixels, from which the number of row widgets is worked out
+    HISTORY_ROW_HEIGHT = 48
+    # Cards the Download Queue shows at most; finished ones make room first, the rest is in the History tab
+    MAX_JOB_ROWS = 100
+    GUI_MAX_FPS = 20
+    SEARCH_PAGE_SIZE = 10
+    # Choices for the global bandwidth cap, in bytes per second
+    BANDWIDTH_CAPS = {"Unlimited": None, "1 MB/s": 1024 ** 2, "2 MB/s": 2 * 1024 ** 2, "5 MB/s": 5 * 1024 ** 2,
+                      "10 MB/s": 10 * 1024 ** 2, "25 MB/s": 25 * 1024 ** 2}
+    PLAYLIST_QUALITIES = ["2160p", "1440p", "1080p", "720p", "480p", "360p", "Best"]
+
+    def __init__(self, client):
         super().__init__()
 
         self.title("YouTube Multi-Tool Downloader")
@@ -24,42 +45,130 @@ class YouTubeDownloaderApp(ctk.CTk):
         ctk.set_appearance_mode("dark")
         ctk.set_default_color_theme("blue")
 
-        self.downloader = Downloader()
+        self.client = client
         self.download_path = ""
+        self.video_url = None
         self.video_info = None
-        self.history_file = "download_history.json"
-        self.download_history = self.load_history()
-        self.thumbnail_cache = {}
-
-        # --- RE-ENGINEERED: Master thread-safe queue for all GUI updates ---
-        self.gui_queue = Queue()
+        self.history = HistoryStore()
+        self.history_query = ""
+        self.history_offset = 0
+        self.history_total = 0
+        self.history_rows = []
+        self.thumbnails = ThumbnailCache()
+        self.job_rows = {}
+        self.search_results_iter = None
+        self.search_generation = 0
+        self.search_result_count = 0
+        self.search_placeholder = None
+        self._search_lock = threading.Lock()
+        # The daemon's jobs as last reported, written by the event thread only; finished ones beyond
+        # MAX_JOB_ROWS are dropped, oldest first
+        self.jobs = {}
+        self._finished_job_ids = OrderedDict()
+        self.service_status = {}
+        self._closing = threading.Event()
+
+        # --- RE-ENGINEERED: Master thread-safe queue for all GUI updates, drained once per frame ---
+        self.gui_queue = GuiUpdateQueue(max_fps=self.GUI_MAX_FPS)
 
         self.protocol("WM_DELETE_WINDOW", self.on_closing)
         self.create_widgets()
         self.bind_all("<MouseWheel>", self.on_mouse_wheel)
         
         self.process_gui_queue()
+        threading.Thread(target=self.follow_service, daemon=True).start()
+        self.after(500, self.offer_resume)
 
     def on_closing(self):
-        """Cleanly closes the application."""
+        """Closes the window; the daemon finishes the downloads on its own."""
+        self._closing.set()
+        self.thumbnails.shutdown()
+        self.history.close()
+        logging.debug(f"GUI queue stats: {self.gui_queue.stats()}")
         self.destroy()
 
     def process_gui_queue(self):
         """Safely process all updates for the GUI from the main thread."""
-        try:
-            while not self.gui_queue.empty():
-                widget, method_name, args, kwargs = self.gui_queue.get_nowait()
-                if widget and widget.winfo_exists():
+        for widget, method_name, args, kwargs in self.gui_queue.drain():
+            try:
+                # Modules such as messagebox are queued too; only real widgets can have been destroyed
+                if widget and (not hasattr(widget, 'winfo_exists') or widget.winfo_exists()):
                     method = getattr(widget, method_name)
                     method(*args, **kwargs)
-        except Exception as e:
-            logging.error(f"Error processing GUI queue: {e}")
-        
-        self.after(100, self.process_gui_queue)
+            except Exception as e:
+                logging.error(f"Error processing GUI queue: {e}")
+
+        self.after(self.gui_queue.frame_interval_ms, self.process_gui_queue)
 
     def queue_gui_update(self, widget, method_name, *args, **kwargs):
-        """Puts a widget update task into the thread-safe queue."""
-        self.gui_queue.put((widget, method_name, args, kwargs))
+        """Puts a widget update task into the thread-safe queue. These are never dropped."""
+        self.gui_queue.put(widget, method_name, args, kwargs)
+
+    def queue_gui_latest(self, key, widget, method_name, *args, **kwargs):
+        """Queues an update that supersedes any pending one with the same key, e.g. progress."""
+        self.gui_queue.put_latest(key, widget, method_name, args, kwargs)
+
+    def call_service(self, method, *args, **kwargs):
+        """Runs a daemon call off the GUI thread, reporting failures in a dialog."""
+        def call():
+            try:
+                method(*args, **kwargs)
+            except ServiceError as e:
+                self.queue_gui_update(messagebox, 'showerror', "Error", str(e))
+                logging.error(f"Daemon call failed: {e}")
+        threading.Thread(target=call, daemon=True).start()
+
+    def follow_service(self):
+        """Mirrors the daemon's jobs from its event stream, reconnecting (and restarting it) when the stream ends."""
+        while not self._closing.is_set():
+            try:
+                for event in self.client.events():
+                    if self._closing.is_set(): return
+                    self.on_service_event(event)
+            except ServiceError as e:
+                logging.error(f"Lost the download daemon: {e}")
+            if self._closing.wait(self.RECONNECT_DELAY): return
+            self.queue_gui_latest('batch_status', self.status_label, 'configure', text="Reconnecting to the download daemon...")
+            try:
+                ensure_daemon(self.client)
+            except ServiceError as e:
+                logging.error(f"Could not restart the download daemon: {e}")
+
+    def on_service_event(self, event):
+        if event['event'] == "snapshot":
+            # Jobs finished before this window connected are in the history already
+            for data in event['jobs']:
+                job = JobView(data)
+                self.jobs[job.id] = job
+                self.queue_gui_latest(('job', job.id), self, '_render_job', job)
+            self.service_status = event['status']
+            self.queue_gui_update(self, 'apply_settings', event['status']['settings'])
+            self.queue_gui_latest('batch_status', self, 'update_batch_status')
+        elif event['event'] == "job":
+            job = JobView(event['job'])
+            previous = self.jobs.get(job.id)
+            self.jobs[job.id] = job
+            self._track_finished(job)
+            self.on_job_update(job, previous)
+        elif event['event'] == "status":
+            self.service_status = event['status']
+            self.queue_gui_latest('batch_status', self, 'update_batch_status')
+
+    def _track_finished(self, job):
+        if not job.finished:
+            self._finished_job_ids.pop(job.id, None)
+            return
+        self._finished_job_ids[job.id] = None
+        self._finished_job_ids.move_to_end(job.id)
+        while len(self._finished_job_ids) > self.MAX_JOB_ROWS:
+            self.jobs.pop(self._finished_job_ids.popitem(last=False)[0], None)
+
+    def apply_settings(self, settings):
+        """Shows the daemon's current settings, which another client may have changed."""
+        self.concurrency_menu.set(str(settings['max_workers']))
+        caps = {rate: label for label, rate in self.BANDWIDTH_CAPS.items()}
+        if settings['max_bandwidth'] in caps:
+            self.bandwidth_menu.set(caps[settings['max_bandwidth']])
 
     def create_widgets(self):
         self.tabs = ctk.CTkTabview(self, anchor="nw")
@@ -79,8 +188,10 @@ class YouTubeDownloaderApp(ctk.CTk):
         active_tab = self.tabs.get()
         if active_tab == "Search":
             self.search_results_frame._parent_canvas.yview_scroll(int(-1*(event.delta/120)), "units")
+            if self.search_results_frame._parent_canvas.yview()[1] >= 0.9:
+                self.start_load_more_search()
         elif active_tab == "History":
-            self.history_frame._parent_canvas.yview_scroll(int(-1*(event.delta/120)), "units")
+            self.scroll_history(int(-1*(event.delta/120)))
 
     def create_downloader_tab(self):
         self.downloader_tab.grid_columnconfigure(0, weight=1)
@@ -126,8 +237,21 @@ class YouTubeDownloaderApp(ctk.CTk):
         self.quality_menu = ctk.CTkOptionMenu(main_frame, values=["Best"])
         self.quality_menu.pack(pady=5)
 
-        self.subtitle_checkbox = ctk.CTkCheckBox(main_frame, text="Download Subtitles")
-        self.subtitle_checkbox.pack(pady=10)
+        subtitle_frame = ctk.CTkFrame(main_frame, fg_color="transparent")
+        subtitle_frame.pack(pady=10)
+        self.subtitle_checkbox = ctk.CTkCheckBox(subtitle_frame, text="Download Subtitles")
+        self.subtitle_checkbox.pack(side="left", padx=5)
+        self.subtitle_languages_entry = ctk.CTkEntry(subtitle_frame, width=110, placeholder_text="en, de, ...")
+        self.subtitle_languages_entry.pack(side="left", padx=5)
+        self.auto_subtitles_checkbox = ctk.CTkCheckBox(subtitle_frame, text="Auto-generated")
+        self.auto_subtitles_checkbox.pack(side="left", padx=5)
+
+        options_frame = ctk.CTkFrame(main_frame, fg_color="transparent")
+        options_frame.pack(pady=(0, 10))
+        self.accelerated_checkbox = ctk.CTkCheckBox(options_frame, text="Accelerated (parallel connections)")
+        self.accelerated_checkbox.pack(side="left", padx=5)
+        self.ignore_archive_checkbox = ctk.CTkCheckBox(options_frame, text="Download again")
+        self.ignore_archive_checkbox.pack(side="left", padx=5)
 
         self.folder_button = ctk.CTkButton(main_frame, text="Select Folder", command=self.select_folder)
         self.folder_button.pack(pady=5)
@@ -135,15 +259,30 @@ class YouTubeDownloaderApp(ctk.CTk):
         self.folder_label = ctk.CTkLabel(main_frame, text="No folder selected")
         self.folder_label.pack(pady=5)
 
-        self.download_button = ctk.CTkButton(main_frame, text="Download", command=self.start_download_thread, state="disabled")
+        concurrency_frame = ctk.CTkFrame(main_frame, fg_color="transparent")
+        concurrency_frame.pack(pady=5)
+        ctk.CTkLabel(concurrency_frame, text="Parallel downloads:").pack(side="left", padx=5)
+        self.concurrency_menu = ctk.CTkOptionMenu(concurrency_frame, values=[str(n) for n in range(1, 9)], width=70,
+                                                  command=lambda v: self.call_service(self.client.update_settings, max_workers=int(v)))
+        self.concurrency_menu.set(str(self.DEFAULT_CONCURRENCY))
+        self.concurrency_menu.pack(side="left", padx=5)
+
+        ctk.CTkLabel(concurrency_frame, text="Bandwidth cap:").pack(side="left", padx=5)
+        self.bandwidth_menu = ctk.CTkOptionMenu(concurrency_frame, values=list(self.BANDWIDTH_CAPS), width=110,
+                                                command=lambda v: self.call_service(self.client.update_settings,
+                                                                                    max_bandwidth=self.BANDWIDTH_CAPS[v]))
+        self.bandwidth_menu.set("Unlimited")
+        self.bandwidth_menu.pack(side="left", padx=5)
+
+        self.download_button = ctk.CTkButton(main_frame, text="Download", command=self.download_video, state="disabled")
         self.download_button.pack(pady=10)
 
-        self.progress_bar = ctk.CTkProgressBar(main_frame)
-        self.progress_bar.set(0)
-        self.progress_bar.pack(pady=10, fill="x", padx=20)
-
         self.status_label = ctk.CTkLabel(main_frame, text="", wraplength=700)
-        self.status_label.pack(pady=5, padx=10, expand=True, fill="x")
+        self.status_label.pack(pady=5, padx=10, fill="x")
+
+        self.jobs_frame = ctk.CTkScrollableFrame(main_frame, label_text="Download Queue")
+        self.jobs_frame.pack(expand=True, fill="both", padx=10, pady=(0, 10))
+        self.jobs_frame.grid_columnconfigure(0, weight=1)
 
     def create_search_tab(self):
         search_frame = ctk.CTkFrame(self.search_tab)
@@ -157,11 +296,32 @@ class YouTubeDownloaderApp(ctk.CTk):
         search_button.pack(side="left", padx=5)
         
         self.search_results_frame = ctk.CTkScrollableFrame(self.search_tab, label_text="Search Results")
-        self.search_results_frame.pack(expand=True, fill="both", padx=10, pady=10)
+        self.search_results_frame.pack(expand=True, fill="both", padx=10, pady=(10, 5))
+
+        self.search_more_button = ctk.CTkButton(self.search_tab, text="Load more", state="disabled",
+                                                command=self.start_load_more_search)
+        self.search_more_button.pack(pady=(0, 10))
 
     def create_history_tab(self):
-        self.history_frame = ctk.CTkScrollableFrame(self.history_tab, label_text="Download History")
-        self.history_frame.pack(expand=True, fill="both", padx=10, pady=10)
+        search_frame = ctk.CTkFrame(self.history_tab)
+        search_frame.pack(pady=(10, 0), padx=10, fill="x")
+
+        self.history_search_entry = ctk.CTkEntry(search_frame, placeholder_text="Search history...")
+        self.history_search_entry.pack(side="left", expand=True, fill="x", padx=5, pady=5)
+        self.history_search_entry.bind("<Return>", lambda e: self.update_history_display())
+
+        self.history_count_label = ctk.CTkLabel(search_frame, text="", text_color="gray")
+        self.history_count_label.pack(side="left", padx=10)
+
+        # Only the rows that fit are built; scrolling rebinds them to other entries instead of adding more
+        history_list = ctk.CTkFrame(self.history_tab)
+        history_list.pack(expand=True, fill="both", padx=10, pady=10)
+        ctk.CTkLabel(history_list, text="Download History").pack(side="top", pady=(5, 0))
+        self.history_scrollbar = ctk.CTkScrollbar(history_list, command=self.on_history_scroll)
+        self.history_scrollbar.pack(side="right", fill="y", padx=(0, 5), pady=5)
+        self.history_frame = ctk.CTkFrame(history_list, fg_color="transparent")
+        self.history_frame.pack(side="left", expand=True, fill="both")
+        self.history_frame.bind("<Configure>", self.on_history_resize)
         self.update_history_display()
 
     def on_resize(self, event):
@@ -176,25 +336,48 @@ class YouTubeDownloaderApp(ctk.CTk):
         threading.Thread(target=self.fetch_video_details, daemon=True).start()
 
     def start_search_thread(self):
-        threading.Thread(target=self.perform_search, daemon=True).start()
+        query = self.search_entry.get()
+        if not query: return
+        self.search_generation += 1
+        self._clear_search_results()
+        threading.Thread(target=self.perform_search, args=(query, self.search_generation), daemon=True).start()
 
-    def start_download_thread(self):
-        self.queue_gui_update(self.download_button, 'configure', state="disabled", text="Downloading...")
-        self.queue_gui_update(self.progress_bar, 'set', 0)
-        threading.Thread(target=self.download_video, daemon=True).start()
+    def start_load_more_search(self):
+        if self.search_results_iter is None or self.search_more_button.cget("state") == "disabled": return
+        self.search_more_button.configure(state="disabled", text="Loading...")
+        threading.Thread(target=self.load_more_search_results, args=(self.search_generation,), daemon=True).start()
 
-    def fetch_thumbnail_threaded(self, url, size, thumb_label):
-        ctk_img = self.get_thumbnail_from_url(url, size)
+    def on_thumbnail_ready(self, thumb_label, ctk_img):
         if ctk_img:
             self.queue_gui_update(thumb_label, 'configure', image=ctk_img, text="")
 
-    def perform_search(self):
-        query = self.search_entry.get()
-        if not query: return
-
-        self.queue_gui_update(self, '_clear_search_results')
-        results = search_youtube(query)
-        self.queue_gui_update(self, '_populate_search_results', results)
+    def perform_search(self, query, generation):
+        with self._search_lock:
+            if generation != self.search_generation: return
+            if self.search_results_iter is not None:
+                self.search_results_iter.close()
+            self.search_results_iter = self.client.search_iter(query, self.SEARCH_PAGE_SIZE)
+            self.search_result_count = 0
+            self._pull_search_page(generation)
+
+    def load_more_search_results(self, generation):
+        # A page that is still loading will pick up where it is; don't queue a second one
+        if not self._search_lock.acquire(blocking=False): return
+        try:
+            if generation == self.search_generation:
+                self._pull_search_page(generation)
+        finally:
+            self._search_lock.release()
+
+    def _pull_search_page(self, generation):
+        """Streams the next page of results into the Search tab, one card per entry as it arrives."""
+        added = 0
+        for video in islice(self.search_results_iter, self.SEARCH_PAGE_SIZE):
+            if generation != self.search_generation: return
+            self.queue_gui_update(self, '_append_search_result', video, generation)
+            added += 1
+        self.search_result_count += added
+        self.queue_gui_update(self, '_finish_search_page', generation, added < self.SEARCH_PAGE_SIZE)
 
     def fetch_video_details(self):
         urls = self.url_entry.get("1.0", "end-1c").splitlines()
@@ -203,12 +386,27 @@ class YouTubeDownloaderApp(ctk.CTk):
             self.queue_gui_update(self.fetch_button, 'configure', state="normal")
             return
 
+        if is_playlist_url(urls[0]):
+            # Listing a whole channel up front is what the lazy expansion avoids; offer the usual heights instead
+            self.video_url = None
+            self.video_info = None
+            self.queue_gui_update(self.title_label, 'configure', text="Title: Playlist or channel, videos are listed as they download")
+            self.queue_gui_update(self.author_label, 'configure', text="Author: -")
+            self.queue_gui_update(self, 'update_format_options', self.download_type.get())
+            self.queue_gui_update(self.quality_menu, 'configure', values=self.PLAYLIST_QUALITIES)
+            self.queue_gui_update(self.quality_menu, 'set', "Best")
+            self.queue_gui_update(self.download_button, 'configure', state="normal")
+            self.queue_gui_update(self.fetch_button, 'configure', state="normal")
+            return
+
         try:
-            self.video_info = self.downloader.get_video_info(urls[0])
-            thumb = self.get_thumbnail_from_url(self.video_info.get('thumbnail'), (320, 180))
+            video_info = self.client.info(urls[0])
+            self.video_url = urls[0]
+            self.video_info = video_info
+            thumb = self.get_thumbnail_from_url(video_info.get('thumbnail'), (320, 180))
             
-            self.queue_gui_update(self.title_label, 'configure', text=f"Title: {self.video_info['title']}")
-            self.queue_gui_update(self.author_label, 'configure', text=f"Author: {self.video_info['uploader']}")
+            self.queue_gui_update(self.title_label, 'configure', text=f"Title: {video_info['title']}")
+            self.queue_gui_update(self.author_label, 'configure', text=f"Author: {video_info['uploader']}")
             self.queue_gui_update(self.thumbnail_label, 'configure', image=thumb, text="")
             self.queue_gui_update(self, 'update_format_options', self.download_type.get())
             self.queue_gui_update(self, 'update_quality_options')
@@ -220,61 +418,185 @@ class YouTubeDownloaderApp(ctk.CTk):
             self.queue_gui_update(self.fetch_button, 'configure', state="normal")
 
     def download_video(self):
+        """Submits every pasted URL to the daemon; playlists and channels are expanded as they download."""
         if not self.download_path:
-            self.queue_gui_update(messagebox, 'showerror', "Error", "Please select a download folder.")
-            self.queue_gui_update(self.download_button, 'configure', state="normal", text="Download")
+            messagebox.showerror("Error", "Please select a download folder.")
             return
 
         urls = self.url_entry.get("1.0", "end-1c").splitlines()
         urls = [url.strip() for url in urls if url.strip()]
-
-        for url in urls:
-            try:
-                info = self.downloader.get_video_info(url)
-                final_path = self.downloader.download(url, self.download_path, self.quality_menu.get(),
-                                                    self.format_menu.get(), self.subtitle_checkbox.get(),
-                                                    self.progress_callback)
-                if final_path:
-                    self.queue_gui_update(self, 'add_to_history', info['title'], final_path)
-                self.queue_gui_update(messagebox, 'showinfo', "Success", f"Download completed for: {info['title']}")
-            except Exception as e:
-                self.queue_gui_update(messagebox, 'showerror', "Error", f"Download failed for {url}: {e}")
-                logging.error(f"Download failed for {url}: {e}", exc_info=True)
-        
-        self.queue_gui_update(self.download_button, 'configure', state="normal", text="Download")
+        if not urls: return
+
+        options = dict(download_path=self.download_path, quality=self.quality_menu.get(),
+                       file_format=self.format_menu.get(), download_subtitles=self.subtitle_checkbox.get(),
+                       subtitle_languages=self.subtitle_languages_entry.get().strip() or None,
+                       auto_subtitles=bool(self.auto_subtitles_checkbox.get()),
+                       accelerated=bool(self.accelerated_checkbox.get()),
+                       ignore_archive=bool(self.ignore_archive_checkbox.get()))
+
+        def submit():
+            # Telling a playlist from a video walks yt-dlp's extractors, so it happens off the GUI thread too.
+            # A single video is someone waiting for it; it goes ahead of batches under the bandwidth cap
+            priority = INTERACTIVE if len(urls) == 1 and not is_playlist_url(urls[0]) else BATCH
+            self.client.submit_many(urls, **options, priority=priority)
+        self.call_service(submit)
+
+    def offer_resume(self):
+        """Offers to continue the downloads that were still queued or running when the daemon last stopped."""
+        def list_unfinished():
+            unfinished = self.client.unfinished()
+            if unfinished:
+                self.queue_gui_update(self, 'ask_resume', len(unfinished))
+        self.call_service(list_unfinished)
+
+    def ask_resume(self, count):
+        if messagebox.askyesno("Resume downloads", f"{count} download(s) from the last session did not finish. Resume them?"):
+            self.call_service(self.client.resume_unfinished)
+        else:
+            self.call_service(self.client.discard_unfinished)
+
+    def on_job_update(self, job, previous=None):
+        """Called from the event thread; hands the job over to the GUI thread."""
+        self.queue_gui_latest(('job', job.id), self, '_render_job', job)
+        self.queue_gui_latest('batch_status', self, 'update_batch_status')
+        # The daemon recorded it in the history; only the list on screen needs the new row
+        if job.status == COMPLETED and job.history and (previous is None or previous.status != COMPLETED):
+            self.queue_gui_update(self, 'show_history_entry', job.history)
+
+    def _render_job(self, job):
+        row = self.job_rows.get(job.id)
+        if row is None:
+            if len(self.job_rows) >= self.MAX_JOB_ROWS and not self._free_job_row(job):
+                # A queued job beyond the cap gets its card once it starts
+                return
+            row = self._create_job_row(job)
+        row['finished'] = job.finished
+        row['queued'] = job.status == QUEUED
+        row['title'].configure(text=job.title)
+        row['progress'].set(job.progress)
+        row['status'].configure(text=self.format_job_status(job))
+        row['cancel'].configure(state="disabled" if job.finished else "normal")
+        row['retry'].configure(state="normal" if job.status in (FAILED, CANCELLED) else "disabled")
+
+    def _free_job_row(self, job):
+        """Removes the oldest finished card, or for a job that is not queued the newest queued one."""
+        job_id = next((job_id for job_id, row in self.job_rows.items() if row['finished']), None)
+        if job_id is None and job.status != QUEUED:
+            job_id = next((job_id for job_id, row in reversed(self.job_rows.items()) if row['queued']), None)
+        if job_id is None:
+            return False
+        self.job_rows.pop(job_id)['card'].destroy()
+        return True
+
+    def _create_job_row(self, job):
+        card = ctk.CTkFrame(self.jobs_frame)
+        card.pack(fill="x", pady=3, padx=5)
+        card.grid_columnconfigure(0, weight=1)
+        row = {
+            'card': card,
+            'finished': job.finished,
+            'queued': job.status == QUEUED,
+            'title': ctk.CTkLabel(card, text=job.title, anchor="w"),
+            'progress': ctk.CTkProgressBar(card),
+            'status': ctk.CTkLabel(card, text="", anchor="w", text_color="gray"),
+            'cancel': ctk.CTkButton(card, text="Cancel", width=60, command=partial(self.call_service, self.client.cancel, job.id)),
+            'retry': ctk.CTkButton(card, text="Retry", width=60, command=partial(self.call_service, self.client.retry, job.id)),
+        }
+        row['title'].grid(row=0, column=0, sticky="ew", padx=10, pady=(5, 0))
+        row['progress'].grid(row=1, column=0, sticky="ew", padx=10)
+        row['status'].grid(row=2, column=0, sticky="ew", padx=10, pady=(0, 5))
+        row['cancel'].grid(row=0, column=1, rowspan=3, padx=5)
+        row['retry'].grid(row=0, column=2, rowspan=3, padx=(0, 10))
+        self.job_rows[job.id] = row
+        return row
+
+    def format_job_status(self, job):
+        if job.playlist:
+            return self.format_playlist_status(job)
+        if job.status == RUNNING:
+            d = job.progress_info
+            if d.get('status') == 'downloading':
+                total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate') or 0
+                return f"{int(job.progress*100)}% | {self.format_size(d.get('speed'))}/s | ETA: {self.format_eta(d.get('eta'))} | {self.format_size(d.get('downloaded_bytes'))}/{self.format_size(total_bytes)}"
+            if d.get('status') == 'finished':
+                return "Download finished, processing..."
+            return "Fetching info..."
+        if job.status == POSTPROCESSING:
+            d = job.progress_info
+            if d.get('postprocessor') and d.get('status') != 'finished':
+                return f"Processing ({d['postprocessor']})..."
+            return "Waiting for processing..."
+        if job.status == FAILED:
+            return f"Failed: {job.error}"
+        if job.status == COMPLETED:
+            if job.metrics and job.metrics.format_path == TRANSCODE:
+                # Make it visible that no stream came in the requested format
+                return f"Completed (transcoded {job.metrics.format_plan})"
+            return "Completed"
+        if job.status == SKIPPED:
+            return "Already downloaded, skipped"
+        return job.status.capitalize()
+
+    def format_playlist_status(self, job):
+        counts = job.progress_info
+        found = (f"{counts.get('discovered', 0)} found, {counts.get('queued', 0)} queued, "
+                 f"{counts.get('skipped', 0)} already queued or downloaded")
+        if job.status == EXPANDING:
+            return f"Listing playlist: {found}..."
+        if job.status == FAILED:
+            return f"Failed: {job.error}"
+        return f"Playlist {job.status}: {found}"
+
+    def update_batch_status(self):
+        # The daemon's counts cover every job, including those no longer listed here
+        counts = {status: self.service_status.get('jobs', {}).get(status, 0)
+                  for status in (QUEUED, RUNNING, POSTPROCESSING, COMPLETED, FAILED, SKIPPED)}
+        listing = self.service_status.get('listing', 0)
+        status = (f"{counts[RUNNING]} downloading | {counts[POSTPROCESSING]} processing | {counts[QUEUED]} queued | "
+                  f"{counts[COMPLETED]} completed | {counts[SKIPPED]} skipped | {counts[FAILED]} failed")
+        if listing:
+            status += f" | {listing} playlist(s) listing"
+        if counts[RUNNING]:
+            status += f" | {self.format_size(self.service_status.get('throughput'))}/s total"
+        self.status_label.configure(text=status)
 
     def _clear_search_results(self):
         for widget in self.search_results_frame.winfo_children():
             widget.destroy()
-        ctk.CTkLabel(self.search_results_frame, text="Searching...").pack(pady=20)
+        self.search_placeholder = ctk.CTkLabel(self.search_results_frame, text="Searching...")
+        self.search_placeholder.pack(pady=20)
+        self.search_more_button.configure(state="disabled", text="Load more")
 
-    def _populate_search_results(self, results):
-        for widget in self.search_results_frame.winfo_children():
-            widget.destroy()
-        
-        if not results:
-            ctk.CTkLabel(self.search_results_frame, text="No results found.").pack()
-            return
+    def _append_search_result(self, video, generation):
+        if generation != self.search_generation: return
+        if self.search_placeholder is not None:
+            self.search_placeholder.destroy()
+            self.search_placeholder = None
 
-        for video in results:
-            video_url = f"https://www.youtube.com/watch?v={video.get('id')}"
-            
-            result_card = ctk.CTkFrame(self.search_results_frame)
-            result_card.pack(fill="x", pady=5, padx=5)
-            result_card.grid_columnconfigure(1, weight=1)
+        video_url = f"https://www.youtube.com/watch?v={video.get('id')}"
+        
+        result_card = ctk.CTkFrame(self.search_results_frame)
+        result_card.pack(fill="x", pady=5, padx=5)
+        result_card.grid_columnconfigure(1, weight=1)
 
-            thumb_label = ctk.CTkLabel(result_card, text="Loading...")
-            thumb_label.grid(row=0, column=0, rowspan=2, padx=10, pady=10, sticky="ns")
+        thumb_label = ctk.CTkLabel(result_card, text="Loading...")
+        thumb_label.grid(row=0, column=0, rowspan=2, padx=10, pady=10, sticky="ns")
 
-            threading.Thread(target=self.fetch_thumbnail_threaded, args=(video.get('thumbnail'), (120, 90), thumb_label), daemon=True).start()
-            
-            ctk.CTkLabel(result_card, text=video.get('title', 'No Title'), anchor="w", font=ctk.CTkFont(weight="bold")).grid(row=0, column=1, sticky="ew", padx=5)
-            ctk.CTkLabel(result_card, text=video.get('channel', 'No Channel'), anchor="w", text_color="gray").grid(row=1, column=1, sticky="ew", padx=5)
-            
-            # --- FIX: Use functools.partial to correctly capture the URL ---
-            select_command = partial(self.select_video_from_search, video_url)
-            ctk.CTkButton(result_card, text="Select", width=60, command=select_command).grid(row=0, column=2, rowspan=2, padx=10)
+        future = self.thumbnails.fetch_async(video.get('thumbnail'), (120, 90), partial(self.on_thumbnail_ready, thumb_label))
+        result_card.bind("<Destroy>", lambda e, f=future: f.cancel())
+        
+        ctk.CTkLabel(result_card, text=video.get('title', 'No Title'), anchor="w", font=ctk.CTkFont(weight="bold")).grid(row=0, column=1, sticky="ew", padx=5)
+        ctk.CTkLabel(result_card, text=video.get('channel', 'No Channel'), anchor="w", text_color="gray").grid(row=1, column=1, sticky="ew", padx=5)
+        
+        # --- FIX: Use functools.partial to correctly capture the URL ---
+        select_command = partial(self.select_video_from_search, video_url)
+        ctk.CTkButton(result_card, text="Select", width=60, command=select_command).grid(row=0, column=2, rowspan=2, padx=10)
 
+    def _finish_search_page(self, generation, exhausted):
+        if generation != self.search_generation: return
+        if self.search_result_count == 0 and self.search_placeholder is not None:
+            self.search_placeholder.configure(text="No results found.")
+        self.search_more_button.configure(state="disabled" if exhausted else "normal", text="Load more")
 
     def select_video_from_search(self, url):
         self.tabs.set("Downloader")
@@ -283,19 +605,76 @@ class YouTubeDownloaderApp(ctk.CTk):
         self.start_fetch_thread()
 
     def update_history_display(self):
-        for widget in self.history_frame.winfo_children():
-            widget.destroy()
-        for item in self.download_history:
-            history_card = ctk.CTkFrame(self.history_frame)
-            history_card.pack(fill="x", pady=5, padx=5)
-            history_card.grid_columnconfigure(0, weight=1)
-            ctk.CTkLabel(history_card, text=item['title'], anchor="w").grid(row=0, column=0, sticky="ew", padx=10, pady=5)
-            btn_frame = ctk.CTkFrame(history_card)
-            btn_frame.grid(row=0, column=1, padx=5, pady=5)
-            ctk.CTkButton(btn_frame, text="Open", width=60, command=partial(self.open_path, item['path'])).pack(side="left", padx=5)
-            ctk.CTkButton(btn_frame, text="Folder", width=60, command=partial(self.open_path, os.path.dirname(item['path']))).pack(side="left", padx=5)
+        """Resets the History tab to the top of the entries matching the search box."""
+        self.history_query = self.history_search_entry.get().strip()
+        self.history_total = self.history.count(self.history_query)
+        self.history_offset = 0
+        self.render_history()
+
+    def on_history_resize(self, event):
+        """Keeps exactly as many row widgets as fit the list's height."""
+        visible = max(1, event.height // self.HISTORY_ROW_HEIGHT)
+        if visible == len(self.history_rows): return
+        while len(self.history_rows) < visible:
+            self.history_rows.append(self._create_history_row())
+        for row in self.history_rows[visible:]:
+            row['frame'].destroy()
+        del self.history_rows[visible:]
+        self.render_history()
+
+    def on_history_scroll(self, *args):
+        """Handles the scrollbar's "moveto <fraction>" and "scroll <n> units|pages" commands."""
+        if args[0] == "moveto":
+            self.history_offset = int(float(args[1]) * self.history_total)
+            self.render_history()
+        elif args[0] == "scroll":
+            self.scroll_history(int(args[1]) * (len(self.history_rows) if args[2] == "pages" else 1))
+
+    def scroll_history(self, rows):
+        self.history_offset += rows
+        self.render_history()
+
+    def render_history(self):
+        """Binds the row widgets to the entries at the current offset, reading just those from the store."""
+        visible = len(self.history_rows)
+        self.history_offset = max(0, min(self.history_offset, self.history_total - visible))
+        entries = self.history.page(self.history_offset, visible, self.history_query) if visible else []
+        for row, item in zip(self.history_rows, entries):
+            row['title'].configure(text=item['title'])
+            row['open'].configure(command=partial(self.open_path, item['path']))
+            row['folder'].configure(command=partial(self.open_path, os.path.dirname(item['path'])))
+            row['frame'].pack(fill="x", pady=5, padx=5)
+        for row in self.history_rows[len(entries):]:
+            row['frame'].pack_forget()
+        if self.history_total:
+            self.history_scrollbar.set(self.history_offset / self.history_total,
+                                       min(1.0, (self.history_offset + visible) / self.history_total))
+        else:
+            self.history_scrollbar.set(0.0, 1.0)
+        self.update_history_count(len(entries))
+
+    def update_history_count(self, shown):
+        if not shown:
+            self.history_count_label.configure(text=f"0 of {self.history_total}")
+            return
+        first = self.history_offset + 1
+        self.history_count_label.configure(text=f"{first}-{first + shown - 1} of {self.history_total}")
+
+    def _create_history_row(self):
+        history_card = ctk.CTkFrame(self.history_frame)
+        history_card.grid_columnconfigure(0, weight=1)
+        title = ctk.CTkLabel(history_card, text="", anchor="w")
+        title.grid(row=0, column=0, sticky="ew", padx=10, pady=5)
+        btn_frame = ctk.CTkFrame(history_card)
+        btn_frame.grid(row=0, column=1, padx=5, pady=5)
+        open_button = ctk.CTkButton(btn_frame, text="Open", width=60)
+        open_button.pack(side="left", padx=5)
+        folder_button = ctk.CTkButton(btn_frame, text="Folder", width=60)
+        folder_button.pack(side="left", padx=5)
+        return {'frame': history_card, 'title': title, 'open': open_button, 'folder': folder_button}
 
     def open_path(self, path):
+        import subprocess
         try:
             if sys.platform == "win32": os.startfile(path)
             elif sys.platform == "darwin": subprocess.Popen(["open", path])
@@ -304,16 +683,7 @@ class YouTubeDownloaderApp(ctk.CTk):
             messagebox.showerror("Error", f"Could not open path: {e}")
 
     def get_thumbnail_from_url(self, url, size):
-        if not url: return None
-        if url in self.thumbnail_cache: return self.thumbnail_cache[url]
-        try:
-            response = requests.get(url, timeout=5)
-            img = Image.open(BytesIO(response.content))
-            img.thumbnail(size)
-            ctk_img = ctk.CTkImage(light_image=img, dark_image=img, size=(img.width, img.height))
-            self.thumbnail_cache[url] = ctk_img
-            return ctk_img
-        except Exception: return None
+        return self.thumbnails.get(url, size)
             
     def update_format_options(self, value="Video"):
         if value == "Video":
@@ -326,13 +696,15 @@ class YouTubeDownloaderApp(ctk.CTk):
             self.quality_menu.configure(state="disabled")
 
     def update_quality_options(self):
-        if not self.video_info: return
-        qualities = [f for f in self.video_info['formats'] if f.get('height') and f.get('vcodec') != 'none']
+        video_info = self.video_info
+        if not self.video_url or not video_info: return
+        qualities = [f for f in video_info.get('formats', []) if f.get('height') and f.get('vcodec') != 'none']
         quality_options = sorted(list(set([f"{f['height']}p" for f in qualities])), key=lambda x: int(x[:-1]))
         self.quality_menu.configure(values=quality_options or ["Best"])
         self.quality_menu.set(quality_options[-1] if quality_options else "Best")
 
     def paste_from_clipboard(self):
+        import pyperclip
         self.url_entry.delete("1.0", "end")
         self.url_entry.insert("1.0", pyperclip.paste())
 
@@ -341,18 +713,6 @@ class YouTubeDownloaderApp(ctk.CTk):
         if self.download_path:
             self.folder_label.configure(text=self.download_path)
 
-    def progress_callback(self, d):
-        if d['status'] == 'downloading':
-            total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate', 0)
-            if total_bytes > 0:
-                percentage = d['downloaded_bytes'] / total_bytes
-                text = f"{int(percentage*100)}% | {self.format_size(d.get('speed'))}/s | ETA: {self.format_eta(d.get('eta'))} | {self.format_size(d.get('downloaded_bytes'))}/{self.format_size(total_bytes)}"
-                self.queue_gui_update(self.progress_bar, 'set', percentage)
-                self.queue_gui_update(self.status_label, 'configure', text=text)
-        elif d['status'] == 'finished':
-            self.queue_gui_update(self.progress_bar, 'set', 1)
-            self.queue_gui_update(self.status_label, 'configure', text="Download finished")
-    
     def format_size(self, size):
         if not size: return "0 B"
         for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
@@ -365,23 +725,25 @@ class YouTubeDownloaderApp(ctk.CTk):
         h, r = divmod(seconds, 3600)
         m, s = divmod(r, 60)
         return f"{int(h):02}:{int(m):02}:{int(s):02}"
-        
-    def load_history(self):
-        if not os.path.exists(self.history_file): return []
-        if os.path.getsize(self.history_file) == 0: return []
-        with open(self.history_file, 'r') as f:
-            try: return json.load(f)
-            except json.JSONDecodeError: return []
-
-    def save_history(self):
-        with open(self.history_file, 'w') as f:
-            json.dump(self.download_history, f, indent=4)
-
-    def add_to_history(self, title, path):
-        self.download_history.insert(0, {"title": title, "path": path})
-        self.save_history()
-        self.update_history_display()
 
-def create_gui():
-    app = YouTubeDownloaderApp()
+    def show_history_entry(self, entry):
+        """Counts a download the daemon just recorded in; the rows are rebound only if the top is on screen."""
+        if self.history_query: return
+        self.history_total += 1
+        if self.history_offset:
+            # Keep the same entries on screen now that one more sits above them
+            self.history_offset += 1
+        self.render_history()
+
+def create_gui(service_url, token=None):
+    """Opens the window on the daemon at `service_url`, starting the daemon first if it is not running."""
+    client = ServiceClient(service_url, token=token)
+    try:
+        ensure_daemon(client, daemon_args=("--concurrency", str(YouTubeDownloaderApp.DEFAULT_CONCURRENCY),
+                                           "--per-host-limit", str(YouTubeDownloaderApp.PER_HOST_LIMIT)))
+    except ServiceError as e:
+        logging.error(f"Could not start the download daemon: {e}")
+        messagebox.showerror("Error", str(e))
+        return
+    app = YouTubeDownloaderApp(client)
     app.mainloop()
\ No newline at end of file
@@ -0,0 +1,52 @@
+import threading
+from collections import OrderedDict
+from itertools import count
+
+
+class GuiUpdateQueue:
+    """
+    Thread-safe queue of GUI calls that the Tk thread drains once per frame.
+
+    `put` events are delivered in order and never dropped. `put_latest` events
+    are coalesced by key: a newer call replaces a pending one in place, so a
+    widget is updated at most once per frame with its latest value while keeping
+    its position relative to the ordered events.
+    """
+
+    def __init__(self, max_fps=20):
+        self.max_fps = max_fps
+        self.events_received = 0
+        self.events_applied = 0
+        self._pending = OrderedDict()
+        self._sequence = count()
+        self._lock = threading.Lock()
+
+    @property
+    def frame_interval_ms(self):
+        return max(1, int(1000 / self.max_fps))
+
+    def put(self, widget, method_name, args=(), kwargs=None):
+        with self._lock:
+            self.events_received += 1
+            self._pending[('event', next(self._sequence))] = (widget, method_name, args, kwargs or {})
+
+    def put_latest(self, key, widget, method_name, args=(), kwargs=None):
+        with self._lock:
+            self.events_received += 1
+            self._pending[('latest', key)] = (widget, method_name, args, kwargs or {})
+
+    def drain(self):
+        """Takes every pending call, in delivery order, and counts them as applied."""
+        with self._lock:
+            pending, self._pending = self._pending, OrderedDict()
+            self.events_applied += len(pending)
+        return list(pending.values())
+
+    def stats(self):
+        with self._lock:
+            received, applied, pending = self.events_received, self.events_applied, len(self._pending)
+        return {
+            'events_received': received,
+            'events_applied': applied,
+            'events_coalesced': received - applied - pending,
+        }
@@ -0,0 +1,112 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+class HistoryStore:
+    """
+    Download history kept in SQLite, so recording a download is a single insert.
+
+    Entries are read back newest first, a page at a time. A legacy
+    `download_history.json` is imported on first use and renamed out of the way.
+    """
+
+    def __init__(self, path="download_history.sqlite", legacy_json="download_history.json"):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            path TEXT NOT NULL,
+            video_id TEXT,
+            format TEXT,
+            size INTEGER,
+            downloaded_at REAL NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS history_video_id ON history (video_id)")
+        self._has_fts = self._create_search_index()
+        self._db.commit()
+        if legacy_json and os.path.exists(legacy_json):
+            self._migrate_json(legacy_json)
+
+    def add(self, title, path, video_id=None, file_format=None, size=None):
+        """Records a finished download and returns it as an entry dict."""
+        if size is None:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                size = None
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO history (title, path, video_id, format, size, downloaded_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (title, path, video_id, file_format, size, time.time()))
+            self._db.commit()
+            row = self._db.execute("SELECT * FROM history WHERE id = ?", (cursor.lastrowid,)).fetchone()
+        return dict(row)
+
+    def page(self, offset=0, limit=50, query=None):
+        """Returns up to `limit` entries, newest first, optionally filtered by a title search."""
+        sql, params = self._select(query)
+        with self._lock:
+            rows = self._db.execute(f"{sql} ORDER BY id DESC LIMIT ? OFFSET ?", (*params, limit, offset)).fetchall()
+        return [dict(row) for row in rows]
+
+    def count(self, query=None):
+        sql, params = self._select(query, columns="COUNT(*)")
+        with self._lock:
+            return self._db.execute(sql, params).fetchone()[0]
+
+    def find_by_video_id(self, video_id):
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM history WHERE video_id = ? ORDER BY id DESC", (video_id,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _select(self, query, columns="*"):
+        if not query:
+            return f"SELECT {columns} FROM history", ()
+        if self._has_fts:
+            # Quote each word so user input is never parsed as FTS syntax; the last one matches as a prefix
+            terms = ['"{}"'.format(word.replace('"', '""')) for word in query.split()]
+            terms[-1] += '*'
+            return (f"SELECT {columns} FROM history WHERE id IN "
+                    f"(SELECT rowid FROM history_search WHERE history_search MATCH ?)", (" ".join(terms),))
+        return f"SELECT {columns} FROM history WHERE title LIKE ?", (f"%{query}%",)
+
+    def _create_search_index(self):
+        """Keeps a full-text index of titles in sync via triggers, when SQLite is built with FTS5."""
+        try:
+            self._db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS history_search USING fts5("
+                             "title, content='history', content_rowid='id')")
+        except sqlite3.OperationalError:
+            return False
+        self._db.execute("""CREATE TRIGGER IF NOT EXISTS history_search_insert AFTER INSERT ON history BEGIN
+            INSERT INTO history_search (rowid, title) VALUES (new.id, new.title); END""")
+        self._db.execute("""CREATE TRIGGER IF NOT EXISTS history_search_delete AFTER DELETE ON history BEGIN
+            INSERT INTO history_search (history_search, rowid, title) VALUES ('delete', old.id, old.title); END""")
+        return True
+
+    def _migrate_json(self, legacy_json):
+        try:
+            with open(legacy_json, 'r') as f:
+                entries = json.load(f) if os.path.getsize(legacy_json) else []
+        except (OSError, json.JSONDecodeError) as e:
+            logging.error(f"Could not read legacy history {legacy_json}: {e}")
+            return
+        # The JSON list is newest first; insert oldest first so ids keep the same order
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT INTO history (title, path, downloaded_at) VALUES (?, ?, ?)",
+                [(item['title'], item['path'], now) for item in reversed(entries)
+                 if 'title' in item and 'path' in item])
+            self._db.commit()
+        os.replace(legacy_json, f"{legacy_json}.migrated")
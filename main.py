@@ -1,5 +1,20 @@
+import argparse
+import json
 import logging
-from gui import create_gui
+import os
+import re
+import sys
+import threading
+import time
+
+# Everything heavy (yt_dlp, customtkinter, PIL, requests) is imported inside the
+# code path that needs it, so --help and headless runs never pay for the GUI.
+
+EXIT_OK = 0
+EXIT_FAILURES = 1
+EXIT_USAGE = 2
+EXIT_INTERRUPTED = 130
+DEFAULT_LISTEN = "127.0.0.1:8686"
 
 def setup_logging():
     """Configures logging to save errors to a file."""
@@ -10,12 +25,345 @@ def setup_logging():
         filemode='a'
     )
 
-def main():
+def parse_rate(value):
+    """Parses a rate such as 500K, 2.5M or 1G (bytes per second, 1024-based) for argparse; sizes read the same."""
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)\s*([KMG]?)i?B?(?:/s)?', value.strip(), re.IGNORECASE)
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid value: {value!r} (use e.g. 500K, 2.5M)")
+    rate = int(float(match.group(1)) * 1024 ** " KMG".index(match.group(2).upper() or " "))
+    if rate <= 0:
+        raise argparse.ArgumentTypeError(f"invalid value: {value!r} (must be more than zero)")
+    return rate
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="YouTube Multi-Tool Downloader. Starts the GUI unless --input or --resume is given, "
+                    "in which case the URLs are downloaded headlessly and progress is written "
+                    "to stdout as JSON lines. With --serve it runs as the download daemon the GUI "
+                    "and --daemon clients talk to.")
+    parser.add_argument("-i", "--input", metavar="FILE",
+                        help="download the URLs listed in FILE, one per line ('-' reads stdin)")
+    parser.add_argument("-o", "--output", default=".", metavar="DIR", help="download folder (default: current directory)")
+    parser.add_argument("-f", "--format", default="mp4", choices=["mp4", "mkv", "webm", "mp3", "m4a", "wav"],
+                        help="output format (default: mp4)")
+    parser.add_argument("-q", "--quality", default="Best", help="maximum video height such as 720p (default: Best)")
+    parser.add_argument("-j", "--concurrency", type=int, default=3, help="parallel downloads (default: 3)")
+    parser.add_argument("--per-host-limit", type=int, default=None, help="parallel downloads per host")
+    parser.add_argument("--postprocess-workers", type=int, default=None,
+                        help="parallel FFmpeg post-processing jobs (default: one per CPU)")
+    parser.add_argument("--subtitles", action="store_true", help="download subtitles as well")
+    parser.add_argument("--sub-langs", metavar="LANGS",
+                        help="subtitle languages in order of preference, e.g. en,de; the first the video has is "
+                             "saved, else its own language (default: en)")
+    parser.add_argument("--auto-subs", action="store_true",
+                        help="fall back on auto-generated captions where no uploaded subtitles match")
+    parser.add_argument("--accelerated", action="store_true",
+                        help="fetch fragments and byte ranges over several connections, tuned per host")
+    parser.add_argument("--max-bandwidth", type=parse_rate, metavar="RATE",
+                        help="cap the combined download rate of all jobs, e.g. 5M (bytes per second)")
+    parser.add_argument("--rate-limit", type=parse_rate, metavar="RATE", help="cap the download rate of each job")
+    parser.add_argument("--write-buffer", type=parse_rate, metavar="SIZE",
+                        help="read and write downloads in fixed blocks of SIZE, e.g. 4M for NVMe or network "
+                             "folders (default: adapted per transfer)")
+    parser.add_argument("--priority", choices=["interactive", "batch"], default="batch",
+                        help="bandwidth class of these jobs; interactive ones go first under a cap (default: batch)")
+    parser.add_argument("--resume", action="store_true",
+                        help="also continue the jobs an earlier run left queued or running")
+    parser.add_argument("--no-archive", action="store_true",
+                        help="download videos even if the download archive has them in this format")
+    parser.add_argument("--progress-interval", type=float, default=1.0, metavar="SECONDS",
+                        help="minimum time between progress lines for one job (default: 1)")
+    parser.add_argument("--metrics-jsonl", metavar="FILE",
+                        help="append per-job phase timings, bytes and throughput to FILE as JSON lines")
+    parser.add_argument("--metrics-prom", metavar="FILE",
+                        help="keep FILE updated with job metrics in the Prometheus text format")
+    daemon = parser.add_argument_group("daemon")
+    daemon.add_argument("--serve", action="store_true", help="run the download daemon until interrupted")
+    daemon.add_argument("--listen", default=DEFAULT_LISTEN, metavar="HOST:PORT",
+                        help=f"address the daemon serves its API on (default: {DEFAULT_LISTEN})")
+    daemon.add_argument("--token", default=os.environ.get("YTDL_DAEMON_TOKEN"),
+                        help="require (with --serve) or send (with --daemon) this bearer token; "
+                             "defaults to $YTDL_DAEMON_TOKEN, then to a per-user token kept in ~/.ytdl_daemon_token")
+    daemon.add_argument("--shared-queue", nargs="?", const="shared_queue.sqlite", metavar="FILE",
+                        help="with --serve, host a queue in FILE that daemons on other hosts pull jobs from "
+                             "(default file: shared_queue.sqlite)")
+    daemon.add_argument("--pull-from", action="append", metavar="URL",
+                        help="with --serve, also run jobs from the shared queue of the daemon at URL; repeatable")
+    daemon.add_argument("--pull-token", help="token for the --pull-from daemons (default: --token)")
+    daemon.add_argument("--shared-output", metavar="DIR",
+                        help="with --serve, save the shared-queue jobs this daemon runs in DIR instead of the "
+                             "folder named by the submitting host")
+    daemon.add_argument("--daemon", nargs="?", const=f"http://{DEFAULT_LISTEN}", metavar="URL",
+                        help="hand --input to the daemon at URL (default: the local one) and follow it from there")
+    daemon.add_argument("--shared", action="store_true",
+                        help="with --daemon, add the URLs to that daemon's shared queue instead and return at once")
+    return parser.parse_args(argv)
+
+def read_urls(source):
+    stream = sys.stdin if source == "-" else open(source, "r", encoding="utf-8")
+    with stream:
+        lines = [line.strip() for line in stream]
+    return [line for line in lines if line and not line.startswith("#")]
+
+class JsonLinesReporter:
+    """Writes job events to a stream as JSON lines, throttling progress per job."""
+
+    def __init__(self, stream, progress_interval):
+        self.stream = stream
+        self.progress_interval = progress_interval
+        self._last_progress = {}
+        self._last_status = {}
+        self._lock = threading.Lock()
+
+    def emit(self, event, **fields):
+        line = json.dumps({"event": event, "time": round(time.time(), 3), **fields})
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+    def on_update(self, job):
+        now = time.monotonic()
+        status_changed = self._last_status.get(job.id) != job.status
+        if not status_changed and now - self._last_progress.get(job.id, 0) < self.progress_interval:
+            return
+        self._last_status[job.id] = job.status
+        self._last_progress[job.id] = now
+        if job.playlist:
+            counts = job.progress_info
+            self.emit("playlist", id=job.id, url=job.url, status=job.status, discovered=counts.get('discovered'),
+                      queued=counts.get('queued'), skipped=counts.get('skipped'), error=job.error)
+        elif job.finished:
+            record = job.metrics.to_dict() if job.metrics else {}
+            self.emit("result", id=job.id, url=job.url, title=job.title, status=job.status,
+                      path=job.result, error=job.error, attempts=job.attempts,
+                      format_path=record.get("format_path"), format_plan=record.get("format_plan"),
+                      phases=record.get("phases"), throughput=record.get("throughput_bytes_per_second"))
+        else:
+            d = job.progress_info
+            self.emit("status" if status_changed else "progress", id=job.id, url=job.url, status=job.status, progress=round(job.progress, 4),
+                      downloaded_bytes=d.get('downloaded_bytes'), speed=d.get('speed'), eta=d.get('eta'),
+                      postprocessor=d.get('postprocessor'))
+
+def read_input(args):
+    """The URLs of args.input, or None after reporting why they cannot be used."""
+    try:
+        urls = read_urls(args.input) if args.input else []
+    except OSError as e:
+        print(f"error: cannot read {args.input}: {e}", file=sys.stderr)
+        return None
+    if not os.path.isdir(args.output):
+        print(f"error: output folder does not exist: {args.output}", file=sys.stderr)
+        return None
+    return urls
+
+def job_options(args):
+    return dict(download_path=args.output, quality=args.quality, file_format=args.format,
+                download_subtitles=args.subtitles, subtitle_languages=args.sub_langs, auto_subtitles=args.auto_subs,
+                accelerated=args.accelerated, priority=args.priority, rate_limit=args.rate_limit,
+                ignore_archive=args.no_archive)
+
+def build_downloader(args):
+    from downloader import Downloader
+    from metrics import MetricsRecorder, JsonLinesSink, PrometheusTextfileSink
+    from bandwidth import BandwidthManager
+    metrics = MetricsRecorder()
+    if args.metrics_jsonl:
+        metrics.add_sink(JsonLinesSink(args.metrics_jsonl))
+    if args.metrics_prom:
+        metrics.add_sink(PrometheusTextfileSink(args.metrics_prom))
+    return Downloader(metrics=metrics, bandwidth=BandwidthManager(limit=args.max_bandwidth),
+                      write_buffer_size=args.write_buffer)
+
+def summarize(jobs, video_counts=None):
+    """
+    Counts for the summary line; a playlist that could not be listed counts as a failure.
+    `video_counts` (jobs by status) stands in for the videos among `jobs` when not all of them are at hand.
+    """
+    from protocol import COMPLETED, SKIPPED
+    if video_counts is None:
+        video_counts = {}
+        for job in jobs:
+            if not job.playlist:
+                video_counts[job.status] = video_counts.get(job.status, 0) + 1
+    playlists = [job for job in jobs if job.playlist]
+    total = sum(video_counts.values())
+    completed = video_counts.get(COMPLETED, 0)
+    skipped = video_counts.get(SKIPPED, 0)
+    failed = total - completed - skipped + sum(1 for job in playlists if job.status != COMPLETED)
+    return dict(total=total, completed=completed, skipped=skipped, failed=failed, playlists=len(playlists))
+
+def run_batch(args):
+    """Downloads every URL from args.input without a display. Returns the process exit code."""
+    urls = read_input(args)
+    if urls is None:
+        return EXIT_USAGE
+
+    reporter = JsonLinesReporter(sys.stdout, args.progress_interval)
+    if not urls and not args.resume:
+        reporter.emit("summary", total=0, completed=0, skipped=0, failed=0)
+        return EXIT_OK
+
+    from downloader import is_playlist_url
+    from scheduler import DownloadScheduler
+    from archive import DownloadArchive, JobJournal
+    downloader = build_downloader(args)
+    scheduler = DownloadScheduler(downloader, max_workers=max(1, args.concurrency),
+                                  per_host_limit=args.per_host_limit, on_update=reporter.on_update,
+                                  archive=DownloadArchive(), journal=JobJournal(),
+                                  postprocess_workers=args.postprocess_workers)
+    # The scheduler drops old finished jobs, so the summary counts videos through it and keeps the playlists here
+    playlists = [job for job in scheduler.resume_unfinished() if job.playlist] if args.resume else []
+    for url in urls:
+        # Playlists and channels are listed lazily; their videos join the queue as they are found
+        if is_playlist_url(url):
+            playlists.append(scheduler.submit_playlist(url, **job_options(args)))
+        else:
+            scheduler.submit(url, **job_options(args))
+    try:
+        scheduler.join()
+    except KeyboardInterrupt:
+        scheduler.shutdown(cancel_running=True)
+        scheduler.join(timeout=10)
+        reporter.emit("summary", total=sum(scheduler.counts().values()), interrupted=True)
+        return EXIT_INTERRUPTED
+    scheduler.shutdown()
+
+    summary = summarize(playlists, scheduler.counts())
+    totals = downloader.metrics.totals()
+    reporter.emit("summary", **summary, downloaded_bytes=totals["bytes_downloaded"], phase_seconds=totals["phases"])
+    return EXIT_OK if summary["failed"] == 0 else EXIT_FAILURES
+
+def run_remote(args):
+    """
+    Hands the URLs from args.input to a daemon and reports on them like run_batch.
+    Interrupting only stops following them; the daemon carries on. Returns the process exit code.
+    """
+    urls = read_input(args)
+    if urls is None:
+        return EXIT_USAGE
+    from client import ServiceClient, ServiceError, JobView
+    from protocol import load_token
+    client = ServiceClient(args.daemon, token=args.token or load_token())
+    reporter = JsonLinesReporter(sys.stdout, args.progress_interval)
+    # The daemon resolves paths against its own working directory
+    options = {**job_options(args), 'download_path': os.path.abspath(args.output)}
+    try:
+        if args.shared:
+            for url in urls:
+                reporter.emit("queued", url=url, queue_id=client.enqueue_shared(url, **options))
+            return EXIT_OK
+        jobs = client.resume_unfinished() if args.resume else []
+        if urls:
+            jobs += client.submit_many(urls, **options)
+    except ServiceError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return EXIT_FAILURES
+    watched = {job.id: job for job in jobs}
+
+    def follow(job):
+        if job.id not in watched and job.parent_id not in watched:
+            return
+        previous = watched.get(job.id)
+        watched[job.id] = job
+        # The snapshot after a reconnect repeats jobs already reported as finished
+        if not (previous and previous.finished and previous.status == job.status):
+            reporter.on_update(job)
+
+    try:
+        while watched:
+            for event in client.events():
+                if event['event'] == "snapshot":
+                    updates = event['jobs']
+                else:
+                    updates = [event['job']] if event['event'] == "job" else []
+                for data in updates:
+                    follow(JobView(data))
+                if all(job.finished for job in watched.values()):
+                    break
+            # Updates of different jobs can arrive out of order, so make sure no playlist video went unseen
+            for job in client.jobs():
+                follow(job)
+            if all(job.finished for job in watched.values()):
+                break
+    except ServiceError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return EXIT_FAILURES
+    except KeyboardInterrupt:
+        reporter.emit("summary", **summarize(watched.values()), interrupted=True)
+        return EXIT_INTERRUPTED
+    summary = summarize(watched.values())
+    downloaded = sum(job.metrics.bytes_downloaded or 0 for job in watched.values() if job.metrics)
+    reporter.emit("summary", **summary, downloaded_bytes=downloaded)
+    return EXIT_OK if summary["failed"] == 0 else EXIT_FAILURES
+
+def run_daemon(args):
+    """Runs the download daemon until interrupted or terminated. Returns the process exit code."""
+    import signal
+    from service import DownloadService, ServiceServer, QueueWorker
+    from protocol import load_token
+    from archive import DownloadArchive, JobJournal, SharedJobQueue
+    from history import HistoryStore
+    from client import ServiceClient
+
+    host, _, port = args.listen.rpartition(":")
+    if not host or not port.isdigit():
+        print(f"error: --listen needs HOST:PORT, not {args.listen}", file=sys.stderr)
+        return EXIT_USAGE
+    shared_output = os.path.abspath(args.shared_output) if args.shared_output else None
+    if shared_output is not None and not os.path.isdir(shared_output):
+        print(f"error: --shared-output folder does not exist: {args.shared_output}", file=sys.stderr)
+        return EXIT_USAGE
+    shared_queue = SharedJobQueue(args.shared_queue) if args.shared_queue else None
+    service = DownloadService(build_downloader(args), max_workers=max(1, args.concurrency),
+                              per_host_limit=args.per_host_limit, postprocess_workers=args.postprocess_workers,
+                              archive=None if args.no_archive else DownloadArchive(), journal=JobJournal(),
+                              history=HistoryStore(), shared_queue=shared_queue)
+    try:
+        server = ServiceServer(service, host, int(port), token=args.token or load_token())
+    except OSError as e:
+        print(f"error: cannot listen on {args.listen}: {e}", file=sys.stderr)
+        service.close()
+        return EXIT_FAILURES
+    workers = []
+    if shared_queue is not None:
+        # The host of the queue works through it too
+        workers.append(QueueWorker(service, shared_queue, download_path=shared_output).start())
+    for url in args.pull_from or []:
+        client = ServiceClient(url, token=args.pull_token or args.token)
+        workers.append(QueueWorker(service, client, download_path=shared_output).start())
+    if args.resume:
+        service.scheduler.resume_unfinished()
+
+    def terminate(signum, frame):
+        raise KeyboardInterrupt()
+
+    signal.signal(signal.SIGTERM, terminate)
+    JsonLinesReporter(sys.stdout, 0).emit("listening", url=f"http://{host}:{server.server_port}", pid=os.getpid())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            worker.stop()
+        server.server_close()
+        service.close()
+    return EXIT_OK
+
+def main(argv=None):
     """
     The main entry point of the application.
     """
+    args = parse_args(argv)
     setup_logging()
-    create_gui()
+    if args.serve:
+        sys.exit(run_daemon(args))
+    if args.daemon and (args.input or args.resume):
+        sys.exit(run_remote(args))
+    if args.input or args.resume:
+        sys.exit(run_batch(args))
+    from gui import create_gui
+    create_gui(args.daemon or f"http://{args.listen}", token=args.token)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
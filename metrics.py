@@ -0,0 +1,271 @@
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+
+class JobMetrics:
+    """
+    Where the time of one download job went: seconds per phase, bytes moved and
+    the throughput achieved while transferring. Filled in as the job runs.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.title = None
+        self.video_id = None
+        self.status = None
+        self.error = None
+        self.cache_hit = None
+        # How the target format is reached (see formats.py): "direct", "remux", "transcode" or "auto"
+        self.format_path = None
+        self.format_plan = None
+        self.started_at = time.time()
+        self.finished_at = None
+        self.phases = {}
+        self.postprocessors = {}
+        self.bytes_downloaded = 0
+        self._lock = threading.Lock()
+        self._transfers = {}
+        self._postprocessor_starts = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    @property
+    def throughput(self):
+        """Bytes per second over the time spent transferring, or None before any transfer."""
+        transfer = self.phases.get("transfer")
+        return self.bytes_downloaded / transfer if transfer else None
+
+    def on_progress(self, d):
+        """
+        Feeds a yt-dlp progress dict in. Returns the number of new bytes it reports,
+        so callers can account for them globally as well.
+        """
+        filename = d.get('filename') or d.get('tmpfilename')
+        now = time.perf_counter()
+        with self._lock:
+            transfer = self._transfers.get(filename)
+            if transfer is None:
+                if d['status'] != 'downloading':
+                    # Already on disk (or failed at once): nothing was transferred
+                    return 0
+                transfer = self._transfers[filename] = {'started': now, 'bytes': 0}
+            downloaded = d.get('downloaded_bytes') or 0
+            new_bytes = max(0, downloaded - transfer['bytes'])
+            transfer['bytes'] = max(transfer['bytes'], downloaded)
+            self.bytes_downloaded += new_bytes
+            if d['status'] in ('finished', 'error'):
+                del self._transfers[filename]
+                self.phases['transfer'] = self.phases.get('transfer', 0.0) + now - transfer['started']
+        return new_bytes
+
+    def on_postprocessor(self, d):
+        """Feeds a yt-dlp postprocessor hook dict in and times each postprocessor run."""
+        name = d.get('postprocessor')
+        now = time.perf_counter()
+        with self._lock:
+            if d['status'] == 'started':
+                self._postprocessor_starts[name] = now
+            elif name in self._postprocessor_starts:
+                seconds = now - self._postprocessor_starts.pop(name)
+                self.postprocessors[name] = self.postprocessors.get(name, 0.0) + seconds
+                self.phases['postprocessing'] = self.phases.get('postprocessing', 0.0) + seconds
+
+    def to_dict(self):
+        with self._lock:
+            phases = {name: round(seconds, 6) for name, seconds in self.phases.items()}
+            postprocessors = {name: round(seconds, 6) for name, seconds in self.postprocessors.items()}
+        end = self.finished_at or time.time()
+        throughput = self.throughput
+        return {
+            "url": self.url,
+            "title": self.title,
+            "video_id": self.video_id,
+            "status": self.status,
+            "error": self.error,
+            "cache_hit": self.cache_hit,
+            "format_path": self.format_path,
+            "format_plan": self.format_plan,
+            "started_at": round(self.started_at, 3),
+            "finished_at": round(self.finished_at, 3) if self.finished_at else None,
+            "total_seconds": round(end - self.started_at, 6),
+            "phases": phases,
+            "postprocessors": postprocessors,
+            "bytes_downloaded": self.bytes_downloaded,
+            "throughput_bytes_per_second": round(throughput, 1) if throughput else None,
+        }
+
+
+class MetricsRecorder:
+    """
+    Collects the JobMetrics of every job and hands each finished one to the sinks.
+
+    A sink is any callable taking the job's record dict (see `JobMetrics.to_dict`),
+    so in-process hooks, `JsonLinesSink` and `PrometheusTextfileSink` plug in the
+    same way. Sinks run on the thread that finished the job and must not block.
+    Bytes are also counted as they arrive, for a live aggregate throughput.
+    """
+
+    def __init__(self, sinks=(), throughput_window=5.0):
+        self.throughput_window = throughput_window
+        self._sinks = list(sinks)
+        self._lock = threading.Lock()
+        self._samples = deque()
+        self._totals = {"jobs": defaultdict(int), "bytes_downloaded": 0, "phases": defaultdict(float)}
+
+    def add_sink(self, sink):
+        with self._lock:
+            self._sinks.append(sink)
+
+    def remove_sink(self, sink):
+        with self._lock:
+            if sink in self._sinks:
+                self._sinks.remove(sink)
+
+    def start(self, url):
+        return JobMetrics(url)
+
+    def add_bytes(self, count):
+        if count <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._samples.append((now, count))
+            self._trim(now)
+
+    def throughput(self):
+        """Bytes per second received across all jobs over the last `throughput_window` seconds."""
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            return sum(count for _, count in self._samples) / self.throughput_window
+
+    def finish(self, metrics, status, error=None):
+        """Closes a job's metrics and emits its record to every sink. Returns the record."""
+        metrics.status = status
+        metrics.error = error
+        metrics.finished_at = time.time()
+        record = metrics.to_dict()
+        with self._lock:
+            self._totals["jobs"][status] += 1
+            self._totals["bytes_downloaded"] += record["bytes_downloaded"]
+            for name, seconds in record["phases"].items():
+                self._totals["phases"][name] += seconds
+            sinks = list(self._sinks)
+        logging.debug(f"Job metrics: {record}")
+        for sink in sinks:
+            try:
+                sink(record)
+            except Exception as e:
+                logging.error(f"Metrics sink {sink!r} failed: {e}")
+        return record
+
+    def totals(self):
+        """Job counts by status, bytes and summed phase seconds of every finished job so far."""
+        with self._lock:
+            return {
+                "jobs": dict(self._totals["jobs"]),
+                "bytes_downloaded": self._totals["bytes_downloaded"],
+                "phases": {name: round(seconds, 3) for name, seconds in self._totals["phases"].items()},
+            }
+
+    def _trim(self, now):
+        while self._samples and now - self._samples[0][0] > self.throughput_window:
+            self._samples.popleft()
+
+
+class JsonLinesSink:
+    """Appends one JSON object per finished job to a file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        line = json.dumps(record)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class PrometheusTextfileSink:
+    """
+    Keeps running totals of the finished jobs and rewrites them to `path` in the
+    Prometheus text exposition format, e.g. for node_exporter's textfile collector.
+    The file is replaced atomically so a scrape never sees half of it.
+    """
+
+    def __init__(self, path, prefix="ytdownloader"):
+        self.path = path
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._jobs = defaultdict(int)
+        self._format_paths = defaultdict(int)
+        self._bytes = 0
+        self._phases = defaultdict(lambda: [0.0, 0])
+        self._postprocessors = defaultdict(lambda: [0.0, 0])
+        self._job_seconds = [0.0, 0]
+
+    def __call__(self, record):
+        with self._lock:
+            self._jobs[record["status"]] += 1
+            if record.get("format_path"):
+                self._format_paths[record["format_path"]] += 1
+            self._bytes += record["bytes_downloaded"]
+            self._job_seconds[0] += record["total_seconds"]
+            self._job_seconds[1] += 1
+            for name, seconds in record["phases"].items():
+                self._phases[name][0] += seconds
+                self._phases[name][1] += 1
+            for name, seconds in record["postprocessors"].items():
+                self._postprocessors[name][0] += seconds
+                self._postprocessors[name][1] += 1
+            text = self.render()
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(temp_path, self.path)
+
+    def render(self):
+        p = self.prefix
+        lines = [
+            f"# HELP {p}_jobs_total Download jobs finished, by final status.",
+            f"# TYPE {p}_jobs_total counter",
+            *(f'{p}_jobs_total{{status="{status}"}} {count}' for status, count in sorted(self._jobs.items())),
+            f"# HELP {p}_format_path_total Jobs by how their target format was reached (direct, remux, transcode, auto).",
+            f"# TYPE {p}_format_path_total counter",
+            *(f'{p}_format_path_total{{path="{path}"}} {count}' for path, count in sorted(self._format_paths.items())),
+            f"# HELP {p}_downloaded_bytes_total Bytes transferred by finished jobs.",
+            f"# TYPE {p}_downloaded_bytes_total counter",
+            f"{p}_downloaded_bytes_total {self._bytes}",
+            f"# HELP {p}_job_seconds Wall time of finished jobs.",
+            f"# TYPE {p}_job_seconds summary",
+            f"{p}_job_seconds_sum {self._job_seconds[0]:.6f}",
+            f"{p}_job_seconds_count {self._job_seconds[1]}",
+            f"# HELP {p}_phase_seconds Time spent in each phase of a job.",
+            f"# TYPE {p}_phase_seconds summary",
+        ]
+        for name, (seconds, count) in sorted(self._phases.items()):
+            lines.append(f'{p}_phase_seconds_sum{{phase="{name}"}} {seconds:.6f}')
+            lines.append(f'{p}_phase_seconds_count{{phase="{name}"}} {count}')
+        lines += [
+            f"# HELP {p}_postprocessor_seconds Time spent in each yt-dlp postprocessor (FFmpeg merge, audio extraction...).",
+            f"# TYPE {p}_postprocessor_seconds summary",
+        ]
+        for name, (seconds, count) in sorted(self._postprocessors.items()):
+            lines.append(f'{p}_postprocessor_seconds_sum{{postprocessor="{name}"}} {seconds:.6f}')
+            lines.append(f'{p}_postprocessor_seconds_count{{postprocessor="{name}"}} {count}')
+        return "\n".join(lines) + "\n"
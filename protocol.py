@@ -0,0 +1,48 @@
+"""
+What the download daemon (service.py) and its clients (client.py) share: where the
+daemon listens, how they authenticate and the job states its API reports. Nothing
+here imports yt-dlp, so a client starts without loading it.
+"""
+import os
+import secrets
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8686
+# Where a spawned daemon finds its token, so it does not show up in the process list
+TOKEN_ENV = "YTDL_DAEMON_TOKEN"
+# The token a daemon and its local clients use when none is given; readable by its owner only
+TOKEN_FILE = os.path.join(os.path.expanduser("~"), ".ytdl_daemon_token")
+# An idle event stream sends a heartbeat this often, so both ends notice a dead peer
+HEARTBEAT_INTERVAL = 15.0
+
+QUEUED = "queued"
+RUNNING = "running"
+POSTPROCESSING = "postprocessing"
+EXPANDING = "expanding"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+SKIPPED = "skipped"
+
+FINISHED_STATES = (COMPLETED, FAILED, CANCELLED, SKIPPED)
+UNFINISHED_STATES = (QUEUED, RUNNING, POSTPROCESSING, EXPANDING)
+
+
+def load_token(path=TOKEN_FILE):
+    """Returns this user's daemon token, creating it on first use."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            token = f.read().strip()
+        if token:
+            return token
+    except FileNotFoundError:
+        pass
+    token = secrets.token_urlsafe(32)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        # Another process created it first; use theirs
+        return load_token(path)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(token)
+    return token
@@ -0,0 +1,615 @@
+import itertools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, defaultdict, deque
+from urllib.parse import urlparse
+
+from yt_dlp.utils import DownloadCancelled
+
+from archive import archive_id_for_info
+from bandwidth import BATCH, INTERACTIVE, PRIORITIES, check_rate
+from protocol import (QUEUED, RUNNING, POSTPROCESSING, EXPANDING, COMPLETED, FAILED, CANCELLED, SKIPPED,
+                      FINISHED_STATES, UNFINISHED_STATES)
+
+# Videos a playlist expansion keeps queued per worker before it lists further
+EXPANSION_LOOKAHEAD = 4
+# Finished jobs kept in `jobs` for retry and inspection; older ones live on in the journal and history only
+KEEP_FINISHED_JOBS = 200
+# Job options the scheduler acts on itself; the rest go to Downloader.fetch
+SCHEDULER_OPTIONS = ('ignore_archive',)
+
+
+def _without_info(d):
+    """A hook dict minus its info dict, which a finished job would otherwise keep alive with all its formats."""
+    return {key: value for key, value in d.items() if key != 'info_dict'}
+
+
+class JobCancelled(DownloadCancelled):
+    """Raised from a job's progress hook to abort it mid-transfer."""
+    msg = 'The download job was cancelled'
+
+
+class DownloadJob:
+    """A single URL submitted to the scheduler, together with its live state."""
+    _ids = itertools.count(1)
+
+    def __init__(self, url, options):
+        self.id = next(self._ids)
+        self.url = url
+        self.host = urlparse(url).hostname or ""
+        self.options = options
+        self.title = url
+        self.video_id = None
+        self.status = QUEUED
+        self.progress = 0.0
+        self.progress_info = {}
+        self.result = None
+        self.error = None
+        self.attempts = 0
+        self.journal_id = None
+        self.metrics = None
+        # The BandwidthShare of the current attempt, through which its caps change while it runs
+        self.bandwidth = None
+        # A playlist job only lists its videos and queues each as a job of its own
+        self.playlist = False
+        # For a video queued by a playlist job, that job's id
+        self.parent_id = None
+        self._journaled_status = QUEUED
+        # The (video, format, folder) whose temp file this job writes, while it holds it
+        self._file_key = None
+        self._cancel_event = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    def _reset(self):
+        self.status = QUEUED
+        self.progress = 0.0
+        self.progress_info = {}
+        self.result = None
+        self.error = None
+        self._cancel_event.clear()
+
+
+class DownloadScheduler:
+    """
+    Runs download jobs on a bounded pool of worker threads.
+
+    At most `max_workers` jobs run at once and, when `per_host_limit` is set,
+    at most that many of them talk to the same host. `on_update(job)` is
+    called from worker threads whenever a job changes state or reports progress.
+
+    With an `archive`, videos already downloaded in the job's format are
+    skipped before any extraction, unless the job has `ignore_archive` set.
+    With a `journal`, every state change is persisted so that
+    `resume_unfinished` can requeue what a previous process left behind.
+    Each attempt's phase timings are kept in `job.metrics` and emitted through
+    the downloader's MetricsRecorder when the attempt ends.
+
+    Downloading and post-processing are separate stages: once a job's data is
+    on disk, its FFmpeg work (merge, audio extraction) moves to a pool of
+    `postprocess_workers` threads, one per CPU by default, and the download
+    worker goes on to the next job.
+
+    Playlist and channel URLs go through `submit_playlist`, which lists them
+    page by page on a thread of their own and queues the videos as they come.
+    Only the `keep_finished` most recently finished jobs stay in `jobs`, so a
+    channel of thousands of videos does not pile up in memory; `counts` still
+    includes the rest.
+
+    Two jobs for the same video, format and folder would write the same temp
+    file, so only one of them downloads: a job that finds its file taken is
+    attached to the job holding it and finishes with that job's outcome. If
+    that job is cancelled, the jobs attached to it are queued again instead.
+
+    Queued interactive jobs start before queued batch jobs. Jobs draw on the
+    downloader's BandwidthManager with the `priority` and `rate_limit` options
+    they were submitted with; `set_priority` and `set_rate_limit` change them
+    while the job runs.
+    """
+
+    def __init__(self, downloader, max_workers=3, per_host_limit=None, on_update=None, archive=None, journal=None,
+                 postprocess_workers=None, keep_finished=KEEP_FINISHED_JOBS):
+        self.downloader = downloader
+        self.archive = archive
+        self.journal = journal
+        self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+        self.on_update = on_update
+        self.jobs = {}
+        self.keep_finished = keep_finished
+        # Ids of finished jobs still in `jobs`, oldest first, and the statuses of those dropped from it
+        self._finished_ids = OrderedDict()
+        self._dropped_counts = defaultdict(int)
+        self._pending = deque()
+        # File key -> the job writing it, and job id -> the jobs attached to it
+        self._active_files = {}
+        self._attached = defaultdict(list)
+        self._active_hosts = defaultdict(int)
+        self._running = 0
+        self._postprocessing = 0
+        self._expanding = 0
+        self._workers = 0
+        self._shutdown = False
+        self._cond = threading.Condition()
+        self._postprocess_pool = ThreadPoolExecutor(max_workers=postprocess_workers or os.cpu_count() or 1,
+                                                    thread_name_prefix="postprocess")
+        if self.journal is not None:
+            self.journal.prune(FINISHED_STATES)
+        self._spawn_workers()
+
+    def submit(self, url, **options):
+        """Queues a URL for download and returns its job."""
+        job = DownloadJob(url, options)
+        self._enqueue(job)
+        return job
+
+    def submit_playlist(self, url, **options):
+        """
+        Expands a playlist or channel URL in the background and returns the job tracking it.
+
+        Its videos are queued as they are listed, with `options`, so the first download
+        starts after one page of the listing. Listing pauses while `EXPANSION_LOOKAHEAD`
+        videos per worker are waiting, so a long channel is never held in memory whole.
+        """
+        job = DownloadJob(url, options)
+        job.playlist = True
+        if self.journal is not None:
+            job.journal_id = self.journal.add(url, options, EXPANDING)
+            job._journaled_status = EXPANDING
+        with self._cond:
+            self.jobs[job.id] = job
+        self._start_expansion(job)
+        return job
+
+    def resume_unfinished(self):
+        """Requeues the jobs a previous process journaled as unfinished, and returns them. Safe to call repeatedly."""
+        if self.journal is None:
+            return []
+        jobs = []
+        for journal_id, url, options in self._unfinished([s for s in UNFINISHED_STATES if s != EXPANDING]):
+            job = DownloadJob(url, options)
+            job.journal_id = journal_id
+            jobs.append(job)
+        with self._cond:
+            for job in jobs:
+                self.jobs[job.id] = job
+                self._pending.append(job)
+            self._cond.notify_all()
+        for job in jobs:
+            self._notify(job)
+        # Interrupted listings start over; videos already queued or downloaded are not queued again
+        for journal_id, url, options in self._unfinished((EXPANDING,)):
+            job = DownloadJob(url, options)
+            job.playlist = True
+            job.journal_id = journal_id
+            job._journaled_status = EXPANDING
+            with self._cond:
+                self.jobs[job.id] = job
+            self._start_expansion(job)
+            jobs.append(job)
+        return jobs
+
+    def discard_unfinished(self):
+        """Marks a previous process's unfinished jobs as cancelled instead of resuming them."""
+        if self.journal is None:
+            return
+        for journal_id, _, _ in self._unfinished(UNFINISHED_STATES):
+            self.journal.update(journal_id, CANCELLED)
+
+    def _unfinished(self, statuses):
+        # Jobs this scheduler already runs are unfinished in the journal too
+        with self._cond:
+            active = {job.journal_id for job in self.jobs.values()}
+        return [row for row in self.journal.unfinished(statuses) if row[0] not in active]
+
+    def cancel(self, job_id):
+        """
+        Cancels a queued job immediately, a running one at its next progress tick,
+        and one waiting for post-processing before FFmpeg starts on it. Cancelling
+        a playlist stops its listing; the videos it already queued stay queued.
+        """
+        job = self.jobs.get(job_id)
+        if not job or job.finished:
+            return False
+        with self._cond:
+            job._cancel_event.set()
+            self._cond.notify_all()
+            if job in self._pending:
+                self._pending.remove(job)
+                job.status = CANCELLED
+            attached = self._detach(job)
+            if attached:
+                job.status = CANCELLED
+        if attached:
+            self._finish(job)
+        elif job.status == CANCELLED:
+            self._notify(job)
+        return True
+
+    def retry(self, job_id):
+        """Requeues a failed or cancelled job."""
+        job = self.jobs.get(job_id)
+        if not job or job.status not in (FAILED, CANCELLED):
+            return False
+        if job.playlist:
+            with self._cond:
+                job._reset()
+                self._finished_ids.pop(job.id, None)
+            self._start_expansion(job)
+            return True
+        with self._cond:
+            job._reset()
+            self._finished_ids.pop(job.id, None)
+            self._pending.append(job)
+            self._cond.notify_all()
+        self._notify(job)
+        return True
+
+    def set_rate_limit(self, job_id, rate):
+        """Caps one job's bandwidth in bytes per second (None lifts it), at once if it is downloading."""
+        rate = check_rate(rate)
+        job = self.jobs.get(job_id)
+        if not job or job.finished:
+            return False
+        job.options['rate_limit'] = rate
+        if job.bandwidth is not None:
+            job.bandwidth.set_limit(rate)
+        return True
+
+    def set_priority(self, job_id, priority):
+        """Moves a job to the interactive or batch class, at once if it is downloading."""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}")
+        job = self.jobs.get(job_id)
+        if not job or job.finished:
+            return False
+        if job.bandwidth is not None:
+            job.bandwidth.set_priority(priority)
+        job.options['priority'] = priority
+        return True
+
+    def set_max_workers(self, max_workers):
+        """Changes the pool size; surplus workers exit after their current job."""
+        with self._cond:
+            self.max_workers = max(1, max_workers)
+            self._cond.notify_all()
+        self._spawn_workers()
+
+    def counts(self):
+        """Video jobs (not playlist listings) by status, including finished ones no longer in `jobs`."""
+        with self._cond:
+            counts = defaultdict(int, self._dropped_counts)
+            for job in self.jobs.values():
+                if not job.playlist:
+                    counts[job.status] += 1
+        return dict(counts)
+
+    def idle_slots(self):
+        """How many more jobs the workers could start right now."""
+        with self._cond:
+            return max(0, self.max_workers - self._running - len(self._pending))
+
+    def join(self, timeout=None):
+        """Blocks until no jobs are queued, running or post-processing, and no playlist is being listed."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not (self._pending or self._running or self._postprocessing
+                                                    or self._expanding), timeout)
+
+    def shutdown(self, cancel_running=False):
+        """
+        Stops the workers. Queued jobs are cancelled; jobs still waiting for
+        post-processing stay journaled as unfinished.
+        """
+        with self._cond:
+            self._shutdown = True
+            while self._pending:
+                self._pending.popleft().status = CANCELLED
+            if cancel_running:
+                for job in self.jobs.values():
+                    job._cancel_event.set()
+            self._cond.notify_all()
+        self._postprocess_pool.shutdown(wait=False, cancel_futures=cancel_running)
+
+    def _enqueue(self, job):
+        if self.journal is not None:
+            job.journal_id = self.journal.add(job.url, job.options, QUEUED)
+        with self._cond:
+            self.jobs[job.id] = job
+            self._pending.append(job)
+            self._cond.notify_all()
+        self._notify(job)
+
+    def _start_expansion(self, job):
+        with self._cond:
+            self._expanding += 1
+            job.status = EXPANDING
+        threading.Thread(target=self._expand, args=(job,), daemon=True).start()
+
+    def _expand(self, job):
+        """Lists a playlist job's videos and queues each one not already queued or downloaded."""
+        job.attempts += 1
+        job.progress_info = {'discovered': 0, 'queued': 0, 'skipped': 0}
+        self._notify(job)
+        with self._cond:
+            known = {other.url for other in self.jobs.values() if not other.playlist and not other.finished}
+        entries = self.downloader.playlist_iter(job.url)
+        try:
+            # Wait for room before asking for the next entry, so no page is fetched ahead of need
+            while self._wait_for_room(job):
+                entry = next(entries, None)
+                if entry is None:
+                    job.status = COMPLETED
+                    job.progress = 1.0
+                    break
+                counts = job.progress_info = dict(job.progress_info)
+                counts['discovered'] += 1
+                if entry.get('playlist_count'):
+                    job.progress = min(1.0, counts['discovered'] / entry['playlist_count'])
+                if entry['url'] in known or self._archived(job, url=entry['url']):
+                    counts['skipped'] += 1
+                else:
+                    known.add(entry['url'])
+                    video = DownloadJob(entry['url'], dict(job.options))
+                    video.title = entry.get('title') or entry['url']
+                    video.video_id = entry.get('id')
+                    video.parent_id = job.id
+                    self._enqueue(video)
+                    counts['queued'] += 1
+                self._notify(job)
+            else:
+                # Stopped by cancel or shutdown; a shutdown leaves the listing journaled for resume
+                job.status = CANCELLED
+        except Exception as e:
+            self._fail(job, e, stage="Playlist expansion")
+        finally:
+            entries.close()
+            with self._cond:
+                self._expanding -= 1
+                self._cond.notify_all()
+        self._notify(job)
+
+    def _wait_for_room(self, job):
+        """Blocks while enough videos are queued. Returns False once the job is cancelled or the scheduler stops."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._shutdown or job._cancel_event.is_set()
+                                or len(self._pending) < self.max_workers * EXPANSION_LOOKAHEAD)
+            return not (self._shutdown or job._cancel_event.is_set())
+
+    def _spawn_workers(self):
+        with self._cond:
+            missing = self.max_workers - self._workers
+            self._workers += max(0, missing)
+        for _ in range(missing):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def _next_job(self):
+        """
+        Pops the oldest queued job whose host still has a free connection slot,
+        taking interactive jobs before batch ones.
+        """
+        for interactive_only in (True, False):
+            for job in self._pending:
+                if interactive_only and job.options.get('priority', BATCH) != INTERACTIVE:
+                    continue
+                if self.per_host_limit is None or self._active_hosts[job.host] < self.per_host_limit:
+                    self._pending.remove(job)
+                    return job
+        return None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                job = None
+                while not self._shutdown and self._workers <= self.max_workers:
+                    job = self._next_job()
+                    if job:
+                        break
+                    self._cond.wait()
+                if job is None:
+                    self._workers -= 1
+                    return
+                self._running += 1
+                self._active_hosts[job.host] += 1
+                job.status = RUNNING
+            try:
+                self._run(job)
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    self._active_hosts[job.host] -= 1
+                    self._cond.notify_all()
+
+    def _run(self, job):
+        job.attempts += 1
+        job.metrics = self.downloader.metrics.start(job.url)
+        job.bandwidth = self.downloader.bandwidth.share(job.options.get('priority', BATCH), job.options.get('rate_limit'),
+                                                        cancelled=job._cancel_event.is_set)
+        self._notify(job)
+        if self._archived(job, url=job.url):
+            job.status = SKIPPED
+            self._finish(job)
+            return
+
+        def progress_hook(d):
+            if job._cancel_event.is_set():
+                raise JobCancelled()
+            if d['status'] == 'downloading':
+                total_bytes = d.get('total_bytes') or d.get('total_bytes_estimate') or 0
+                if total_bytes > 0:
+                    job.progress = d['downloaded_bytes'] / total_bytes
+            elif d['status'] == 'finished':
+                job.progress = 1.0
+            job.progress_info = _without_info(d)
+            self._notify(job)
+
+        def postprocessor_hook(d):
+            job.progress_info = _without_info(d)
+            self._notify(job)
+
+        try:
+            info = self.downloader.get_video_info(job.url, metrics=job.metrics)
+            job.title = info.get('title') or job.url
+            job.video_id = info.get('id')
+            if job._cancel_event.is_set():
+                raise JobCancelled()
+            if self._archived(job, info=info):
+                job.status = SKIPPED
+                self._finish(job)
+                return
+            if not self._claim_file(job, info):
+                return
+            self._notify(job)
+            pending = self.downloader.fetch(job.url, progress_hook=progress_hook, info=info, metrics=job.metrics,
+                                            postprocessor_hook=postprocessor_hook, bandwidth=job.bandwidth,
+                                            **{key: value for key, value in job.options.items()
+                                               if key not in SCHEDULER_OPTIONS})
+        except Exception as e:
+            self._fail(job, e)
+            self._finish(job)
+            return
+        self._hand_off(job, info, pending)
+
+    def _archived(self, job, url=None, info=None):
+        """Whether the archive has the video at `url` (or of `info`) in the job's format and the job may skip it."""
+        if self.archive is None or job.options.get('ignore_archive'):
+            return False
+        if info is not None:
+            return self.archive.contains_info(info, job.options.get('file_format'))
+        return self.archive.contains_url(url, job.options.get('file_format'))
+
+    def _claim_file(self, job, info):
+        """
+        Reserves the temp file `job` is about to write. Returns False when another
+        job holds it, in which case `job` is attached to that one and this worker
+        is done with it.
+        """
+        video_id = archive_id_for_info(info) or info.get('id')
+        if video_id is None:
+            return True
+        key = (video_id, job.options.get('file_format'), os.path.realpath(job.options.get('download_path') or '.'))
+        with self._cond:
+            owner = self._active_files.get(key)
+            if owner is None:
+                self._active_files[key] = job
+                job._file_key = key
+                return True
+            self._attached[owner.id].append(job)
+            job.progress_info = {'attached_to': owner.id}
+        logging.info(f"{job.url} is already being downloaded by job {owner.id}; waiting for it")
+        self._notify(job)
+        return False
+
+    def _detach(self, job):
+        """Takes `job` off the job it is attached to, if any. Call with the lock held."""
+        for attached in self._attached.values():
+            if job in attached:
+                attached.remove(job)
+                return True
+        return False
+
+    def _release_file(self, job):
+        """Frees the temp file `job` held and settles the jobs attached to it."""
+        with self._cond:
+            if job._file_key is not None and self._active_files.get(job._file_key) is job:
+                del self._active_files[job._file_key]
+            job._file_key = None
+            attached = self._attached.pop(job.id, [])
+            requeue = job.status == CANCELLED and not self._shutdown
+            for other in attached:
+                if requeue and not other._cancel_event.is_set():
+                    other._reset()
+                    self._pending.append(other)
+            self._cond.notify_all()
+        for other in attached:
+            if other.status == QUEUED:
+                self._notify(other)
+                continue
+            if other._cancel_event.is_set():
+                other.status = CANCELLED
+            else:
+                other.status, other.result, other.error = job.status, job.result, job.error
+                other.progress = job.progress
+            self._finish(other)
+
+    def _hand_off(self, job, info, pending):
+        """Queues a fetched job for post-processing; a plain rename is done right here instead."""
+        job.status = POSTPROCESSING
+        with self._cond:
+            self._postprocessing += 1
+        self._notify(job)
+        if pending.needs_postprocessing:
+            try:
+                self._postprocess_pool.submit(self._postprocess, job, info, pending, time.perf_counter())
+                return
+            except RuntimeError:
+                # The pool was shut down meanwhile; finish on this thread rather than drop the job
+                pass
+        self._postprocess(job, info, pending, time.perf_counter())
+
+    def _postprocess(self, job, info, pending, queued_at):
+        try:
+            job.metrics.add_time('postprocess_queue', time.perf_counter() - queued_at)
+            try:
+                if job._cancel_event.is_set():
+                    raise JobCancelled()
+                job.result = self.downloader.finish(pending)
+                job.status = COMPLETED
+                if self.archive is not None:
+                    self.archive.add(info, job.result, job.options.get('file_format'))
+            except Exception as e:
+                self._fail(job, e, stage="Post-processing")
+            self._finish(job)
+        finally:
+            with self._cond:
+                self._postprocessing -= 1
+                self._cond.notify_all()
+
+    def _fail(self, job, error, stage="Download"):
+        if job._cancel_event.is_set():
+            job.status = CANCELLED
+            return
+        job.status = FAILED
+        job.error = str(error) if stage == "Download" else f"{stage} failed: {error}"
+        logging.error(f"{stage} failed for {job.url}: {error}", exc_info=True)
+
+    def _finish(self, job):
+        """Emits the attempt's metrics to the downloader's sinks, then reports the final state."""
+        job.metrics.title = job.metrics.title or job.title
+        job.metrics.video_id = job.metrics.video_id or job.video_id
+        self.downloader.metrics.finish(job.metrics, job.status, job.error)
+        self._notify(job)
+        self._release_file(job)
+
+    def _notify(self, job):
+        # Jobs cancelled by shutdown stay journaled as unfinished so the next process resumes them
+        if (self.journal is not None and job.journal_id is not None and job._journaled_status != job.status
+                and not (self._shutdown and job.status == CANCELLED)):
+            job._journaled_status = job.status
+            try:
+                self.journal.update(job.journal_id, job.status)
+            except Exception as e:
+                logging.error(f"Could not journal job {job.url}: {e}")
+        if self.on_update:
+            try:
+                self.on_update(job)
+            except Exception as e:
+                logging.error(f"Job update callback failed: {e}")
+        if job.finished:
+            self._retire(job)
+
+    def _retire(self, job):
+        """Notes a finished job, dropping the oldest finished ones beyond `keep_finished` from `jobs`."""
+        with self._cond:
+            if not job.finished:
+                return
+            self._finished_ids[job.id] = None
+            self._finished_ids.move_to_end(job.id)
+            while len(self._finished_ids) > self.keep_finished:
+                old = self.jobs.pop(self._finished_ids.popitem(last=False)[0], None)
+                if old is not None and not old.playlist:
+                    self._dropped_counts[old.status] += 1
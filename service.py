@@ -0,0 +1,726 @@
+"""
+The download daemon: one long-lived Downloader and scheduler that the GUI, the
+CLI and other daemons talk to over a small JSON-over-HTTP API.
+
+    GET    /status                  job counts, aggregate throughput, settings
+    GET    /jobs                    live jobs and the most recently finished ones
+    POST   /jobs                    {"url" | "urls", "options"}: queue downloads (playlists are expanded)
+    GET    /jobs/<id>
+    PATCH  /jobs/<id>               {"priority", "rate_limit"}: change a job while it runs
+    POST   /jobs/<id>/cancel
+    POST   /jobs/<id>/retry
+    GET    /events                  newline-delimited JSON: a snapshot of live jobs, then job and status updates
+    GET    /settings, PUT /settings {"max_workers", "max_bandwidth", "batch_bandwidth", "interactive_bandwidth"}
+    GET    /info?url=               video info, through the metadata cache
+    GET    /search?q=&start=&count=
+    GET    /unfinished              jobs a previous run left unfinished
+    POST   /unfinished/resume, POST /unfinished/discard
+
+A daemon started with a SharedJobQueue also serves it, so daemons on other hosts
+can pull from it (see QueueWorker):
+
+    POST   /queue                   {"url" | "urls", "options"}: add to the shared queue
+    GET    /queue                   job counts by status
+    POST   /queue/claim             {"worker"}: lease the next job
+    POST   /queue/<id>/renew, /queue/<id>/release, /queue/<id>/finish   {"worker", ...}
+
+With a token, every request must carry `Authorization: Bearer <token>`. Only
+plain HTTP clients are served: requests carrying an Origin (that is, sent by a
+web page) are refused, request bodies must be application/json, and a daemon
+listening on a loopback address only answers to a loopback Host, which keeps
+web pages out through DNS rebinding as well.
+"""
+import http.server
+import ipaddress
+import json
+import logging
+import os
+import re
+import secrets
+import socket
+import sys
+import threading
+import time
+from collections import OrderedDict
+from itertools import islice
+from urllib.parse import urlsplit, parse_qs
+
+from downloader import Downloader, is_playlist_url
+from scheduler import DownloadScheduler
+from protocol import (DEFAULT_HOST, DEFAULT_PORT, HEARTBEAT_INTERVAL, COMPLETED, CANCELLED, EXPANDING, FAILED,
+                      UNFINISHED_STATES)
+from bandwidth import INTERACTIVE, BATCH, PRIORITIES, check_rate
+
+# Options a submitted job may carry besides the required download_path, with their defaults
+JOB_OPTIONS = {'quality': "Best", 'file_format': "mp4", 'download_subtitles': False, 'subtitle_languages': None,
+               'auto_subtitles': False, 'accelerated': False, 'priority': BATCH, 'rate_limit': None,
+               'ignore_archive': False}
+# The parts of yt-dlp's progress dicts clients show; the rest stays in the daemon
+PROGRESS_FIELDS = ('status', 'downloaded_bytes', 'total_bytes', 'total_bytes_estimate', 'speed', 'eta',
+                   'postprocessor', 'discovered', 'queued', 'skipped')
+# The bandwidth settings and the priority class each caps; None is the global cap
+BANDWIDTH_SETTINGS = {"max_bandwidth": None, "batch_bandwidth": BATCH, "interactive_bandwidth": INTERACTIVE}
+STATUS_INTERVAL = 1.0
+MAX_BODY_SIZE = 1024 * 1024
+# A search is continued from where its last page ended for this long after that page was asked for
+SEARCH_SESSION_TTL = 10 * 60
+MAX_SEARCH_SESSIONS = 32
+
+
+def is_loopback(host):
+    """Whether `host` (a name or address, as in a Host header or --listen) is this machine."""
+    host = (host or "").strip('[]').lower()
+    if host == "localhost" or host.endswith(".localhost"):
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def job_to_dict(job, history_entry=None):
+    return {
+        "id": job.id,
+        "url": job.url,
+        "title": job.title,
+        "video_id": job.video_id,
+        "status": job.status,
+        "finished": job.finished,
+        "progress": round(job.progress, 4),
+        "progress_info": {key: job.progress_info[key] for key in PROGRESS_FIELDS if key in job.progress_info},
+        "result": job.result,
+        "error": job.error,
+        "attempts": job.attempts,
+        "options": job.options,
+        "playlist": job.playlist,
+        "parent_id": job.parent_id,
+        "metrics": job.metrics.to_dict() if job.metrics else None,
+        "history": history_entry,
+    }
+
+
+class Subscription:
+    """
+    The updates waiting for one event-stream client. Only the latest state of each
+    job is kept, so a slow reader skips intermediate progress instead of falling behind.
+    """
+
+    def __init__(self):
+        self._events = OrderedDict()
+        self._cond = threading.Condition()
+        self.closed = False
+
+    def put(self, key, event):
+        with self._cond:
+            self._events.pop(key, None)
+            self._events[key] = event
+            self._cond.notify()
+
+    def get(self, timeout):
+        """Waits up to `timeout` seconds for updates and returns all that are pending."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._events or self.closed, timeout)
+            events = list(self._events.values())
+            self._events.clear()
+            return events
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class SearchSession:
+    """
+    One query's live search_iter and the results it yielded so far, so each page
+    of "load more" continues the listing instead of starting it over.
+    """
+
+    def __init__(self, results_iter):
+        self.results = []
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self._iter = results_iter
+        self._exhausted = False
+
+    def page(self, start, count):
+        with self.lock:
+            self.last_used = time.monotonic()
+            wanted = start + count - len(self.results)
+            if wanted > 0 and not self._exhausted:
+                fetched = list(islice(self._iter, wanted))
+                self.results.extend(fetched)
+                self._exhausted = len(fetched) < wanted
+            return self.results[start:start + count]
+
+    def close(self):
+        with self.lock:
+            # Returns the engine the listing holds to the pool
+            self._iter.close()
+
+
+class DownloadService:
+    """
+    What the daemon runs: a Downloader with its warm engines and caches, and the
+    scheduler around it. Clients come and go; jobs keep running without them, and
+    with a `history` finished downloads are recorded here, so nothing depends on a
+    window staying open. `archive` and `journal` are handed to the scheduler.
+    """
+
+    def __init__(self, downloader=None, max_workers=3, per_host_limit=None, postprocess_workers=None,
+                 archive=None, journal=None, history=None, shared_queue=None):
+        self.downloader = downloader if downloader is not None else Downloader()
+        self.archive = archive
+        self.journal = journal
+        self.history = history
+        # Set when this daemon hosts the queue other daemons pull from
+        self.shared_queue = shared_queue
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._listeners = []
+        # History entry of each completed job, for its "history_id"; trimmed like the scheduler's finished jobs
+        self._history_entries = OrderedDict()
+        self._searches = OrderedDict()
+        self._closed = threading.Event()
+        self.scheduler = DownloadScheduler(self.downloader, max_workers=max_workers, per_host_limit=per_host_limit,
+                                           on_update=self._on_update, archive=self.archive, journal=self.journal,
+                                           postprocess_workers=postprocess_workers)
+        threading.Thread(target=self._publish_status, daemon=True).start()
+
+    def submit(self, url, **options):
+        """Queues a video, or expands a playlist or channel into the queue. Returns the job."""
+        options = self._check_options(options)
+        if is_playlist_url(url):
+            return self.scheduler.submit_playlist(url, **options)
+        return self.scheduler.submit(url, **options)
+
+    def enqueue_shared(self, url, **options):
+        """
+        Adds a video to the shared queue, for whichever daemon claims it. A playlist is
+        listed in the background and each of its videos queued on its own, so they
+        spread across hosts. Returns the queue id, or None for a playlist.
+        """
+        if self.shared_queue is None:
+            raise LookupError("This daemon does not host a shared queue")
+        options = self._check_options(options)
+        if not is_playlist_url(url):
+            return self.shared_queue.put(url, options)
+        threading.Thread(target=self._expand_into_queue, args=(url, options), daemon=True).start()
+        return None
+
+    def job(self, job_id):
+        return self.scheduler.jobs.get(job_id)
+
+    def jobs(self):
+        return list(self.scheduler.jobs.values())
+
+    def live_jobs(self):
+        """Jobs still queued, running or listing; finished ones reach clients as updates and through /jobs."""
+        return [job for job in self.jobs() if not job.finished]
+
+    def job_dict(self, job):
+        return job_to_dict(job, self._history_entries.get(job.id))
+
+    def settings(self):
+        bandwidth = self.downloader.bandwidth
+        return {
+            "max_workers": self.scheduler.max_workers,
+            "max_bandwidth": bandwidth.limit(),
+            "batch_bandwidth": bandwidth.limit(BATCH),
+            "interactive_bandwidth": bandwidth.limit(INTERACTIVE),
+        }
+
+    def update_settings(self, settings):
+        """Applies the given settings at once; caps of None are lifted. Returns the resulting settings."""
+        unknown = set(settings) - set(self.settings())
+        if unknown:
+            raise ValueError(f"Unknown settings: {', '.join(sorted(unknown))}")
+        # Everything is checked before anything changes, so a refused request leaves the settings as they were
+        caps = {key: check_rate(settings[key]) for key in BANDWIDTH_SETTINGS if key in settings}
+        if "max_workers" in settings:
+            max_workers = settings["max_workers"]
+            if isinstance(max_workers, bool) or not isinstance(max_workers, int) or max_workers < 1:
+                raise ValueError(f"Invalid max_workers: {max_workers!r}")
+            self.scheduler.set_max_workers(max_workers)
+        for key, rate in caps.items():
+            self.downloader.bandwidth.set_limit(rate, priority=BANDWIDTH_SETTINGS[key])
+        return self.settings()
+
+    def status(self):
+        status = {
+            "jobs": self.scheduler.counts(),
+            "listing": sum(1 for job in self.jobs() if job.status == EXPANDING),
+            "throughput": self.downloader.metrics.throughput(),
+            "totals": self.downloader.metrics.totals(),
+            "settings": self.settings(),
+            "pid": os.getpid(),
+        }
+        if self.shared_queue is not None:
+            status["shared_queue"] = self.shared_queue.counts()
+        return status
+
+    def search(self, query, start=0, count=10):
+        """
+        One page of search results. A query's listing stays open between pages for
+        SEARCH_SESSION_TTL, so asking for the next page only fetches what is new.
+        """
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for key, session in list(self._searches.items()):
+                if now - session.last_used > SEARCH_SESSION_TTL:
+                    expired.append(self._searches.pop(key))
+            session = self._searches.pop(query, None) or SearchSession(self.downloader.search_iter(query))
+            self._searches[query] = session
+            while len(self._searches) > MAX_SEARCH_SESSIONS:
+                expired.append(self._searches.popitem(last=False)[1])
+        for old in expired:
+            old.close()
+        return session.page(start, count)
+
+    def unfinished(self):
+        """Journaled jobs a previous run left unfinished, minus the ones this daemon already has."""
+        if self.journal is None:
+            return []
+        active = {job.journal_id for job in self.jobs()}
+        return [row for row in self.journal.unfinished(UNFINISHED_STATES) if row[0] not in active]
+
+    def subscribe(self):
+        subscription = Subscription()
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+        subscription.close()
+
+    def add_listener(self, listener):
+        """`listener(job)` is called on every job update, from the thread that made it."""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def close(self):
+        """Stops the jobs, leaving them journaled as unfinished for the next start, and closes the stores."""
+        self._closed.set()
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.close()
+        with self._lock:
+            searches, self._searches = list(self._searches.values()), OrderedDict()
+        for session in searches:
+            session.close()
+        self.scheduler.shutdown(cancel_running=True)
+        self.scheduler.join(timeout=10)
+        self.downloader.engine.close()
+        for store in (self.archive, self.journal, self.history, self.shared_queue):
+            if store is not None:
+                store.close()
+
+    def _check_options(self, options):
+        unknown = set(options) - set(JOB_OPTIONS) - {'download_path'}
+        if unknown:
+            raise ValueError(f"Unknown job options: {', '.join(sorted(unknown))}")
+        if options.get('priority', BATCH) not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {options['priority']}")
+        check_rate(options.get('rate_limit'))
+        if not options.get('download_path'):
+            raise ValueError("download_path is required")
+        if not os.path.isdir(options['download_path']):
+            raise ValueError(f"Download folder does not exist: {options['download_path']}")
+        return {**JOB_OPTIONS, **options}
+
+    def _expand_into_queue(self, url, options):
+        try:
+            for entry in self.downloader.playlist_iter(url):
+                if (self.archive is not None and not options['ignore_archive']
+                        and self.archive.contains_url(entry['url'], options['file_format'])):
+                    continue
+                self.shared_queue.put(entry['url'], options)
+        except Exception as e:
+            logging.error(f"Listing {url} into the shared queue failed: {e}", exc_info=True)
+
+    def _on_update(self, job):
+        if self.history is not None and job.status == COMPLETED and job.result and job.id not in self._history_entries:
+            try:
+                self._history_entries[job.id] = self.history.add(job.title, job.result, video_id=job.video_id,
+                                                                 file_format=job.options.get('file_format'))
+                while len(self._history_entries) > self.scheduler.keep_finished:
+                    self._history_entries.popitem(last=False)
+            except Exception as e:
+                logging.error(f"Could not record {job.result} in the history: {e}")
+        with self._lock:
+            subscribers = list(self._subscribers)
+            listeners = list(self._listeners)
+        if subscribers:
+            event = {"event": "job", "job": self.job_dict(job)}
+            for subscription in subscribers:
+                subscription.put(("job", job.id), event)
+        for listener in listeners:
+            try:
+                listener(job)
+            except Exception as e:
+                logging.error(f"Job listener failed: {e}")
+
+    def _publish_status(self):
+        while not self._closed.wait(STATUS_INTERVAL):
+            with self._lock:
+                subscribers = list(self._subscribers)
+            if subscribers:
+                event = {"event": "status", "status": self.status()}
+                for subscription in subscribers:
+                    subscription.put("status", event)
+
+
+class QueueWorker:
+    """
+    Pulls jobs from a shared queue into this daemon whenever its scheduler has idle
+    workers. `queue` is a SharedJobQueue this daemon hosts or a ServiceClient for the
+    daemon that does; both offer claim, renew, release and finish. Leases of running
+    jobs are renewed every `renew_interval` seconds, and each job's final status is
+    reported back. On shutdown, jobs not finished are released for other hosts.
+
+    A job's download_path is the folder as the submitting host named it, which only
+    works where all hosts mount it at the same path. With `download_path`, this
+    worker saves every job it claims there instead. A job this daemon cannot take
+    (e.g. its folder does not exist here) is finished as failed with the reason.
+    """
+
+    def __init__(self, service, queue, worker_id=None, poll_interval=2.0, renew_interval=30.0, download_path=None):
+        self.service = service
+        self.queue = queue
+        self.download_path = download_path
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.poll_interval = poll_interval
+        self.renew_interval = renew_interval
+        # Reentrant: submitting a job reports its first update on the submitting thread
+        self._lock = threading.RLock()
+        self._claimed = {}
+        self._stop = threading.Event()
+        self._thread = None
+        service.add_listener(self._on_update)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops pulling and hands the jobs still held back to the queue."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            claimed, self._claimed = self._claimed, {}
+        for job_id, queue_id in claimed.items():
+            try:
+                self.queue.release(queue_id, self.worker_id)
+            except Exception as e:
+                logging.error(f"Could not release shared job {queue_id}: {e}")
+            job = self.service.job(job_id)
+            if job is not None and job.journal_id is not None and self.service.journal is not None:
+                # Another host carries on with it; this daemon must not resume it on its next start
+                self.service.journal.update(job.journal_id, CANCELLED)
+
+    def _run(self):
+        last_renewal = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                while not self._stop.is_set() and self.service.scheduler.idle_slots() > 0:
+                    item = self.queue.claim(self.worker_id)
+                    if item is None:
+                        break
+                    options = dict(item['options'])
+                    if self.download_path is not None:
+                        options['download_path'] = self.download_path
+                    with self._lock:
+                        try:
+                            job = self.service.submit(item['url'], **options)
+                        except Exception as e:
+                            logging.error(f"Cannot run shared job {item['id']} here: {e}")
+                            self.queue.finish(item['id'], self.worker_id, FAILED, error=f"{self.worker_id}: {e}")
+                            continue
+                        self._claimed[job.id] = item['id']
+                if time.monotonic() - last_renewal >= self.renew_interval:
+                    last_renewal = time.monotonic()
+                    self._renew()
+            except Exception as e:
+                logging.error(f"Shared queue unavailable: {e}")
+            self._stop.wait(self.poll_interval)
+
+    def _renew(self):
+        with self._lock:
+            claimed = list(self._claimed.items())
+        for job_id, queue_id in claimed:
+            if not self.queue.renew(queue_id, self.worker_id):
+                logging.warning(f"Lost the lease on shared job {queue_id}; another host may run it as well")
+
+    def _on_update(self, job):
+        if not job.finished or self._stop.is_set():
+            return
+        with self._lock:
+            queue_id = self._claimed.pop(job.id, None)
+        if queue_id is None:
+            return
+        try:
+            self.queue.finish(queue_id, self.worker_id, job.status, result=job.result, error=job.error)
+        except Exception as e:
+            # The lease runs out and the job is handed out again
+            logging.error(f"Could not report shared job {queue_id}: {e}")
+
+
+class ServiceRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    ROUTES = [
+        ("GET", r"/status", "get_status"),
+        ("GET", r"/jobs", "list_jobs"),
+        ("POST", r"/jobs", "submit_jobs"),
+        ("GET", r"/jobs/(\d+)", "get_job"),
+        ("PATCH", r"/jobs/(\d+)", "update_job"),
+        ("POST", r"/jobs/(\d+)/cancel", "cancel_job"),
+        ("POST", r"/jobs/(\d+)/retry", "retry_job"),
+        ("GET", r"/events", "stream_events"),
+        ("GET", r"/settings", "get_settings"),
+        ("PUT", r"/settings", "put_settings"),
+        ("GET", r"/info", "get_info"),
+        ("GET", r"/search", "search"),
+        ("GET", r"/unfinished", "list_unfinished"),
+        ("POST", r"/unfinished/resume", "resume_unfinished"),
+        ("POST", r"/unfinished/discard", "discard_unfinished"),
+        ("POST", r"/queue", "enqueue_shared"),
+        ("GET", r"/queue", "queue_counts"),
+        ("POST", r"/queue/claim", "claim_shared"),
+        ("POST", r"/queue/(\d+)/renew", "renew_shared"),
+        ("POST", r"/queue/(\d+)/release", "release_shared"),
+        ("POST", r"/queue/(\d+)/finish", "finish_shared"),
+    ]
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} {format % args}")
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def do_PATCH(self):
+        self._dispatch("PATCH")
+
+    def _dispatch(self, method):
+        parts = urlsplit(self.path)
+        self.query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        if self.headers.get('Origin') is not None:
+            return self._send(403, {"error": "Requests from web pages are not accepted"})
+        if self.server.loopback_only and not is_loopback(urlsplit(f"//{self.headers.get('Host', '')}").hostname):
+            return self._send(403, {"error": "This daemon only answers to localhost"})
+        if self.server.token and not secrets.compare_digest(self.headers.get('Authorization', ''),
+                                                            f"Bearer {self.server.token}"):
+            return self._send(401, {"error": "A valid token is required"})
+        content_type = self.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if method != "GET" and content_type != "application/json":
+            return self._send(415, {"error": "Request bodies must be application/json"})
+        allowed = False
+        for route_method, pattern, handler in self.ROUTES:
+            match = re.fullmatch(pattern, parts.path.rstrip('/') or '/')
+            if not match:
+                continue
+            allowed = True
+            if route_method != method:
+                continue
+            try:
+                args = [int(arg) for arg in match.groups()]
+                result = getattr(self, handler)(*args)
+            except (ValueError, TypeError, json.JSONDecodeError) as e:
+                return self._send(400, {"error": str(e)})
+            except LookupError as e:
+                return self._send(404, {"error": str(e)})
+            except Exception as e:
+                logging.error(f"{method} {self.path} failed: {e}", exc_info=True)
+                return self._send(500, {"error": str(e)})
+            if result is not None:
+                self._send(200, result)
+            return
+        self._send(405 if allowed else 404, {"error": "Method not allowed" if allowed else "Not found"})
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY_SIZE:
+            raise ValueError("Request body too large")
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not isinstance(body, dict):
+            raise ValueError("Expected a JSON object")
+        return body
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _job(self, job_id):
+        job = self.service.job(job_id)
+        if job is None:
+            raise LookupError(f"No job {job_id}")
+        return job
+
+    def _urls(self, body):
+        urls = body.get('urls') or ([body['url']] if body.get('url') else [])
+        if not urls or not all(isinstance(url, str) and url.strip() for url in urls):
+            raise ValueError("Give a 'url' or a list of 'urls'")
+        return [url.strip() for url in urls]
+
+    def get_status(self):
+        return self.service.status()
+
+    def list_jobs(self):
+        return {"jobs": [self.service.job_dict(job) for job in self.service.jobs()]}
+
+    def submit_jobs(self):
+        body = self._body()
+        options = body.get('options') or {}
+        jobs = [self.service.submit(url, **options) for url in self._urls(body)]
+        return {"jobs": [self.service.job_dict(job) for job in jobs]}
+
+    def get_job(self, job_id):
+        return self.service.job_dict(self._job(job_id))
+
+    def update_job(self, job_id):
+        body = self._body()
+        job = self._job(job_id)
+        # Both are checked before either changes
+        if body.get('priority', BATCH) not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {body['priority']}")
+        check_rate(body.get('rate_limit'))
+        if 'priority' in body:
+            self.service.scheduler.set_priority(job.id, body['priority'])
+        if 'rate_limit' in body:
+            self.service.scheduler.set_rate_limit(job.id, body['rate_limit'])
+        return self.service.job_dict(job)
+
+    def cancel_job(self, job_id):
+        return {"cancelled": self.service.scheduler.cancel(self._job(job_id).id)}
+
+    def retry_job(self, job_id):
+        return {"retried": self.service.scheduler.retry(self._job(job_id).id)}
+
+    def get_settings(self):
+        return self.service.settings()
+
+    def put_settings(self):
+        return self.service.update_settings(self._body())
+
+    def get_info(self):
+        if not self.query.get('url'):
+            raise ValueError("The 'url' parameter is required")
+        return self.service.downloader.get_video_info(self.query['url'])
+
+    def search(self):
+        query = self.query.get('q')
+        if not query:
+            raise ValueError("The 'q' parameter is required")
+        start, count = int(self.query.get('start', 0)), min(int(self.query.get('count', 10)), 100)
+        if start < 0 or count < 0:
+            raise ValueError("'start' and 'count' must not be negative")
+        return {"results": self.service.search(query, start, count)}
+
+    def list_unfinished(self):
+        return {"jobs": [{"journal_id": journal_id, "url": url, "options": options}
+                         for journal_id, url, options in self.service.unfinished()]}
+
+    def resume_unfinished(self):
+        return {"jobs": [self.service.job_dict(job) for job in self.service.scheduler.resume_unfinished()]}
+
+    def discard_unfinished(self):
+        self.service.scheduler.discard_unfinished()
+        return {"discarded": True}
+
+    def enqueue_shared(self):
+        body = self._body()
+        options = body.get('options') or {}
+        return {"queue_ids": [self.service.enqueue_shared(url, **options) for url in self._urls(body)]}
+
+    def _shared_queue(self):
+        if self.service.shared_queue is None:
+            raise LookupError("This daemon does not host a shared queue")
+        return self.service.shared_queue
+
+    def _worker(self, body):
+        if not body.get('worker'):
+            raise ValueError("'worker' is required")
+        return body['worker']
+
+    def queue_counts(self):
+        return self._shared_queue().counts()
+
+    def claim_shared(self):
+        body = self._body()
+        return {"item": self._shared_queue().claim(self._worker(body))}
+
+    def renew_shared(self, queue_id):
+        body = self._body()
+        return {"renewed": self._shared_queue().renew(queue_id, self._worker(body))}
+
+    def release_shared(self, queue_id):
+        body = self._body()
+        return {"released": self._shared_queue().release(queue_id, self._worker(body))}
+
+    def finish_shared(self, queue_id):
+        body = self._body()
+        finished = self._shared_queue().finish(queue_id, self._worker(body), body.get('status'),
+                                               result=body.get('result'), error=body.get('error'))
+        return {"finished": finished}
+
+    def stream_events(self):
+        """Sends the live jobs once, then updates as they happen, one JSON object per line."""
+        subscription = self.service.subscribe()
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.close_connection = True
+            snapshot = {"event": "snapshot", "jobs": [self.service.job_dict(job) for job in self.service.live_jobs()],
+                        "status": self.service.status()}
+            self._write_event(snapshot)
+            while not subscription.closed:
+                events = subscription.get(timeout=HEARTBEAT_INTERVAL)
+                for event in events or [{"event": "heartbeat"}]:
+                    self._write_event(event)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.service.unsubscribe(subscription)
+
+    def _write_event(self, event):
+        self.wfile.write(json.dumps(event).encode('utf-8') + b"\n")
+        self.wfile.flush()
+
+
+class ServiceServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, service, host=DEFAULT_HOST, port=DEFAULT_PORT, token=None):
+        self.loopback_only = is_loopback(host)
+        if not token and not self.loopback_only:
+            raise ValueError(f"A token is required to listen on {host}")
+        self.service = service
+        self.token = token
+        super().__init__((host, port), ServiceRequestHandler)
+
+    def handle_error(self, request, client_address):
+        # Clients going away mid-stream is normal, not worth a traceback
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
@@ -0,0 +1,109 @@
+import ctypes
+import errno
+import logging
+import os
+import shutil
+import sys
+
+# Reserves blocks without changing the file size, so yt-dlp still resumes from the real end of the data
+FALLOC_FL_KEEP_SIZE = 0x01
+# Left free on top of a job's own needs, for the filesystem and everything else writing to it
+FREE_SPACE_MARGIN = 64 * 1024 * 1024
+MAX_NAME_ATTEMPTS = 1000
+
+
+class InsufficientSpace(OSError):
+    """A job was refused because its target folder lacks the space it needs."""
+
+    def __init__(self, path, needed, free):
+        super().__init__(errno.ENOSPC, f"Not enough free space in {path}: needs about {_size(needed)}, "
+                                       f"{_size(free)} free")
+        self.path = path
+        self.needed = needed
+        self.free = free
+
+
+def _size(size):
+    for unit in ('B', 'KB', 'MB', 'GB', 'TB'):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} PB"
+
+
+def _load_fallocate():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        fallocate = ctypes.CDLL(None, use_errno=True).fallocate
+    except (OSError, AttributeError):
+        return None
+    fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+    fallocate.restype = ctypes.c_int
+    return fallocate
+
+
+_fallocate = _load_fallocate()
+
+
+def check_free_space(directory, needed, margin=FREE_SPACE_MARGIN):
+    """Raises InsufficientSpace unless `directory` has `needed` bytes free plus `margin`."""
+    free = shutil.disk_usage(directory).free
+    if needed + margin > free:
+        raise InsufficientSpace(directory, needed + margin, free)
+    return free
+
+
+def preallocate(path, size):
+    """
+    Reserves `size` bytes on disk for the file at `path` without changing its
+    length, so a full disk fails the write right away rather than minutes in,
+    and the file is laid out in as few extents as possible. Linux only; returns
+    whether anything was reserved.
+    """
+    if _fallocate is None or size <= 0:
+        return False
+    try:
+        fd = os.open(path, os.O_WRONLY)
+    except OSError:
+        return False
+    try:
+        if _fallocate(fd, FALLOC_FL_KEEP_SIZE, 0, size) == 0:
+            return True
+        err = ctypes.get_errno()
+        if err == errno.ENOSPC:
+            raise InsufficientSpace(os.path.dirname(path), size, shutil.disk_usage(os.path.dirname(path) or '.').free)
+        # Filesystems such as NFS or FAT cannot do it; the download goes ahead regardless
+        logging.debug(f"Cannot preallocate {path}: {os.strerror(err)}")
+        return False
+    finally:
+        os.close(fd)
+
+
+def move_into_place(source, directory, filename):
+    """
+    Renames `source` to `filename` in `directory` without ever replacing another
+    file: a taken name becomes "name (1).ext", "name (2).ext" and so on. The name
+    is claimed with an exclusive create and the file swapped in with one atomic
+    rename, so concurrent jobs and other programs cannot race for it. Returns the
+    final path.
+    """
+    stem, ext = os.path.splitext(filename)
+    for attempt in range(MAX_NAME_ATTEMPTS):
+        target = os.path.join(directory, filename if attempt == 0 else f"{stem} ({attempt}){ext}")
+        if os.path.abspath(target) == os.path.abspath(source):
+            return source
+        try:
+            os.close(os.open(target, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            continue
+        try:
+            os.replace(source, target)
+        except OSError:
+            try:
+                os.remove(target)
+            except OSError:
+                pass
+            raise
+        return target
+    raise FileExistsError(errno.EEXIST, f"No free name for {filename} in {directory}")
@@ -0,0 +1,150 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from yt_dlp.networking import Request
+
+# Tried in order when the video's own language has no track either
+DEFAULT_LANGUAGES = ('en',)
+# Subtitle formats in order of preference; YouTube's json3/srv* formats are for its own player
+PREFERRED_EXTS = ('vtt', 'srt', 'ass', 'ttml')
+
+
+def parse_languages(value):
+    """Turns "en, de-DE" (or a list) into ['en', 'de-DE']; None and "" mean the defaults."""
+    if not value:
+        return list(DEFAULT_LANGUAGES)
+    if isinstance(value, str):
+        value = value.split(',')
+    return [lang.strip() for lang in value if lang.strip()]
+
+
+def _find_language(tracks, lang):
+    """The track list for `lang`, or failing that for a regional variant of it ("en" takes "en-US")."""
+    if tracks.get(lang):
+        return lang
+    lang = lang.lower()
+    for code in tracks:
+        if tracks[code] and (code.lower() == lang or code.lower().split('-')[0] == lang):
+            return code
+    return None
+
+
+def _pick_format(formats):
+    usable = [f for f in formats if f.get('url') or f.get('data')]
+    for ext in PREFERRED_EXTS:
+        for f in usable:
+            if f.get('ext') == ext:
+                return f
+    return usable[0] if usable else None
+
+
+def select_subtitles(info, languages=None, auto_captions=False):
+    """
+    Picks one subtitle track for a video: the first of `languages` it has, then
+    its own spoken language. Uploaded subtitles in a language beat auto-generated
+    captions in it, which are only considered with `auto_captions`. Returns a dict
+    with lang, auto, ext and url (or data), or None when nothing fits.
+    """
+    candidates = parse_languages(languages)
+    if info.get('language') and info['language'] not in candidates:
+        candidates.append(info['language'])
+    sources = [(False, info.get('subtitles') or {})]
+    if auto_captions:
+        sources.append((True, info.get('automatic_captions') or {}))
+    for lang in candidates:
+        for auto, tracks in sources:
+            code = _find_language(tracks, lang)
+            track = _pick_format(tracks[code]) if code else None
+            if track is not None:
+                return {'lang': code, 'auto': auto, 'ext': track.get('ext') or 'vtt', 'url': track.get('url'),
+                        'data': track.get('data'), 'http_headers': track.get('http_headers')}
+    return None
+
+
+class SubtitleCache:
+    """
+    On-disk cache of subtitle tracks, keyed by video, language, kind (uploaded or
+    automatic) and format, so a track is downloaded once however often its video is.
+    Least recently used tracks are evicted once the compressed data exceeds `max_bytes`.
+    """
+
+    def __init__(self, path="subtitle_cache.sqlite", ttl=30 * 24 * 3600, max_bytes=32 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS subtitles (
+            key TEXT PRIMARY KEY, data BLOB NOT NULL, size INTEGER NOT NULL,
+            stored_at REAL NOT NULL, accessed_at REAL NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS subtitles_accessed ON subtitles (accessed_at)")
+        self._db.commit()
+
+    @staticmethod
+    def key(video_key, track):
+        return f"{video_key}:{track['lang']}:{'auto' if track['auto'] else 'manual'}:{track['ext']}"
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT data, stored_at FROM subtitles WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                self._db.execute("DELETE FROM subtitles WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+            self._db.execute("UPDATE subtitles SET accessed_at = ? WHERE key = ?", (now, key))
+            self._db.commit()
+        return zlib.decompress(row[0])
+
+    def put(self, key, data):
+        blob = zlib.compress(data)
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO subtitles VALUES (?, ?, ?, ?, ?)", (key, blob, len(blob), now, now))
+            self._evict(now)
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _evict(self, now):
+        self._db.execute("DELETE FROM subtitles WHERE stored_at < ?", (now - self.ttl,))
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM subtitles").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute("SELECT key, size FROM subtitles ORDER BY accessed_at").fetchall():
+            self._db.execute("DELETE FROM subtitles WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+
+def fetch_subtitle(engine, cache, info, track, path):
+    """
+    Writes `track` of the video described by `info` to `path`, from the cache when
+    it has it, and returns the path. Runs on the downloader's subtitle pool, so it
+    overlaps with the media transfer.
+    """
+    key = SubtitleCache.key(f"{info.get('extractor_key') or info.get('extractor')}:{info.get('id')}", track)
+    data = cache.get(key)
+    if data is None:
+        if track.get('data') is not None:
+            data = track['data'].encode('utf-8')
+        else:
+            with engine.checkout() as ydl:
+                with ydl.urlopen(Request(track['url'], headers=track.get('http_headers') or {})) as response:
+                    data = response.read()
+        cache.put(key, data)
+    else:
+        logging.debug(f"Subtitles {key} served from the cache")
+    tmp_path = f"{path}.part"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,62 @@
+import sqlite3
+
+import pytest
+
+from archive import DownloadArchive, archive_id_for_url
+
+INFO = {'id': "dQw4w9WgXcQ", 'extractor_key': 'Youtube'}
+URL = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+
+@pytest.fixture
+def archive(tmp_path):
+    archive = DownloadArchive(str(tmp_path / "archive.sqlite"))
+    yield archive
+    archive.close()
+
+
+def test_video_counts_as_downloaded_in_its_format_only(archive, tmp_path):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(b"data")
+    archive.add(INFO, str(path), "mp4")
+    assert archive.contains_url(URL, "mp4")
+    assert archive.contains_info(INFO, "mp4")
+    assert not archive.contains_url(URL, "mp3")
+    assert not archive.contains_url("https://youtu.be/aaaaaaaaaaa", "mp4")
+
+
+def test_entry_stops_counting_once_its_file_is_gone(archive, tmp_path):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(b"data")
+    archive.add(INFO, str(path), "mp4")
+    path.unlink()
+    assert not archive.contains_info(INFO, "mp4")
+    archive.add(INFO, str(tmp_path / "video (1).mp4"), "mp4")
+    (tmp_path / "video (1).mp4").write_bytes(b"data")
+    assert archive.contains_info(INFO, "mp4")
+
+
+def test_entries_survive_a_restart(tmp_path):
+    db = str(tmp_path / "archive.sqlite")
+    archive = DownloadArchive(db)
+    archive.add(INFO, None, "mp3")
+    archive.close()
+    archive = DownloadArchive(db)
+    assert len(archive) == 1
+    assert archive.contains_url(URL, "mp3")
+    archive.close()
+
+
+def test_archive_without_formats_is_migrated(tmp_path):
+    db = str(tmp_path / "archive.sqlite")
+    path = tmp_path / "video.MKV"
+    path.write_bytes(b"data")
+    legacy = sqlite3.connect(db)
+    legacy.execute("CREATE TABLE archive (archive_id TEXT PRIMARY KEY, path TEXT, downloaded_at REAL NOT NULL)")
+    legacy.execute("INSERT INTO archive VALUES (?, ?, 0)", (archive_id_for_url(URL), str(path)))
+    legacy.commit()
+    legacy.close()
+    archive = DownloadArchive(db)
+    assert archive.contains_url(URL, "mkv")
+    assert not archive.contains_url(URL, "mp4")
+    archive.close()
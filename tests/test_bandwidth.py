@@ -0,0 +1,90 @@
+import threading
+import time
+
+import pytest
+
+from bandwidth import TokenBucket, BandwidthManager, INTERACTIVE, BATCH
+
+
+def test_unlimited_bucket_never_waits():
+    bucket = TokenBucket()
+    assert bucket.take(10 * 1024 * 1024) < 0.01
+
+
+def test_bucket_holds_the_average_rate():
+    rate = 1_000_000
+    bucket = TokenBucket(rate, burst=0.05)
+    start = time.monotonic()
+    for _ in range(10):
+        bucket.take(50_000)
+    elapsed = time.monotonic() - start
+    # 500 KB at 1 MB/s, less the 50 KB burst the bucket starts with
+    assert 0.35 <= elapsed <= 0.8
+
+
+def test_interactive_takers_go_before_waiting_batch_takers():
+    bucket = TokenBucket(200_000, burst=0.05)
+    # Run the bucket a quarter of a second into debt, so both takers below have to wait
+    bucket.take(60_000)
+    order = []
+
+    def take(priority):
+        bucket.take(10_000, priority)
+        order.append(priority)
+
+    batch = threading.Thread(target=take, args=(BATCH,))
+    batch.start()
+    time.sleep(0.05)
+    interactive = threading.Thread(target=take, args=(INTERACTIVE,))
+    interactive.start()
+    batch.join(5)
+    interactive.join(5)
+    assert order == [INTERACTIVE, BATCH]
+
+
+def test_lifting_the_cap_releases_a_waiting_taker():
+    bucket = TokenBucket(1_000, burst=0.01)
+    bucket.take(100_000)
+    waited = []
+    taker = threading.Thread(target=lambda: waited.append(bucket.take(1_000)))
+    taker.start()
+    time.sleep(0.05)
+    bucket.set_rate(None)
+    taker.join(2)
+    assert waited and waited[0] < 1.0
+
+
+def test_cancelled_taker_stops_waiting():
+    bucket = TokenBucket(1_000, burst=0.01)
+    bucket.take(100_000)
+    assert bucket.take(1_000, cancelled=lambda: True) < 0.5
+
+
+def test_manager_reports_and_changes_caps():
+    manager = BandwidthManager(limit=5_000_000, class_limits={BATCH: 1_000_000})
+    share = manager.share(BATCH)
+    assert share.limited
+    assert manager.limit() == 5_000_000 and manager.limit(BATCH) == 1_000_000 and manager.limit(INTERACTIVE) is None
+    manager.set_limit(None)
+    manager.set_limit(None, priority=BATCH)
+    assert not share.limited
+    share.set_limit(2_000)
+    assert share.limited
+
+
+def test_unknown_priority_is_refused():
+    with pytest.raises(ValueError):
+        BandwidthManager().share("urgent")
+
+
+@pytest.mark.parametrize("rate", ["abc", -1, 0, float("nan"), float("inf"), True])
+def test_invalid_rate_is_refused_without_changing_the_cap(rate):
+    manager = BandwidthManager(limit=1_000_000)
+    with pytest.raises(ValueError):
+        manager.set_limit(rate)
+    assert manager.limit() == 1_000_000
+    share = manager.share(BATCH)
+    with pytest.raises(ValueError):
+        share.set_limit(rate)
+    assert share.limit is None
+    share.consume(1_000)
@@ -0,0 +1,11 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_client_side_imports_do_not_load_yt_dlp():
+    code = "import sys, client, main; main.summarize([]); print('yt_dlp' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "False"
@@ -0,0 +1,35 @@
+from downloader import YoutubeDLPool
+
+FORMATS = [
+    {'format_id': 'v', 'ext': 'mp4', 'vcodec': 'avc1', 'acodec': 'none', 'url': 'http://media/v', 'protocol': 'https',
+     'height': 720},
+    {'format_id': 'a', 'ext': 'webm', 'vcodec': 'none', 'acodec': 'opus', 'url': 'http://media/a', 'protocol': 'https'},
+]
+
+
+def merged_ext(ydl):
+    ctx = {'formats': [dict(f) for f in FORMATS], 'incomplete_formats': False, 'has_merged_format': False}
+    return next(iter(ydl.format_selector(ctx)))['ext']
+
+
+def test_concurrent_checkouts_keep_their_own_merge_format():
+    pool = YoutubeDLPool()
+    with pool.checkout({'format': 'v+a', 'merge_output_format': 'webm'}) as webm:
+        with pool.checkout({'format': 'v+a', 'merge_output_format': 'mkv'}) as mkv:
+            assert merged_ext(mkv) == 'mkv'
+            assert merged_ext(webm) == 'webm'
+    pool.close()
+
+
+def test_options_are_rolled_back_on_return():
+    pool = YoutubeDLPool()
+    with pool.checkout({'format': 'v+a', 'merge_output_format': 'mkv'}) as ydl:
+        selector = ydl.format_selector
+    with pool.checkout() as again:
+        assert again is ydl
+        assert 'merge_output_format' not in again.params
+    # The compiled selector is reused by the same instance on its next checkout
+    with pool.checkout({'format': 'v+a', 'merge_output_format': 'mp4'}) as again:
+        assert again.format_selector is selector
+        assert merged_ext(again) == 'mp4'
+    pool.close()
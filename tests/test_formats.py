@@ -0,0 +1,49 @@
+from formats import plan_formats, DIRECT, REMUX, TRANSCODE, AUTO
+
+AAC_AUDIO = {'format_id': '140', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'abr': 129, 'filesize': 3_000_000}
+OPUS_AUDIO = {'format_id': '251', 'ext': 'webm', 'vcodec': 'none', 'acodec': 'opus', 'abr': 135, 'filesize': 3_200_000}
+AVC_1080 = {'format_id': '137', 'ext': 'mp4', 'vcodec': 'avc1.640028', 'acodec': 'none', 'height': 1080, 'tbr': 4400,
+            'filesize': 90_000_000}
+VP9_1080 = {'format_id': '248', 'ext': 'webm', 'vcodec': 'vp9', 'acodec': 'none', 'height': 1080, 'tbr': 2600,
+            'filesize': 60_000_000}
+AVC_720 = {'format_id': '136', 'ext': 'mp4', 'vcodec': 'avc1.4d401f', 'acodec': 'none', 'height': 720, 'tbr': 2300,
+           'filesize': 45_000_000}
+
+
+def test_aac_audio_is_downloaded_as_m4a_directly():
+    plan = plan_formats({'formats': [OPUS_AUDIO, AAC_AUDIO]}, 'm4a')
+    assert plan.path == DIRECT
+    assert plan.format_spec.startswith('140/')
+    assert plan.postprocessors == []
+    assert plan.space_needed == AAC_AUDIO['filesize']
+
+
+def test_opus_audio_is_transcoded_to_mp3():
+    plan = plan_formats({'formats': [OPUS_AUDIO]}, 'mp3')
+    assert plan.path == TRANSCODE
+    assert plan.format_spec.startswith('251/')
+    assert plan.postprocessors == [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3'}]
+    # FFmpeg writes the mp3 while the downloaded stream is still on disk
+    assert plan.space_needed == 2 * OPUS_AUDIO['filesize']
+
+
+def test_avc_and_aac_are_remuxed_into_mp4():
+    plan = plan_formats({'formats': [VP9_1080, AVC_1080, OPUS_AUDIO, AAC_AUDIO]}, 'mp4', '1080p')
+    assert plan.path == REMUX
+    assert plan.format_spec.startswith('137+140/')
+    # The merger copies the streams; no converter runs after it
+    assert plan.postprocessors == []
+    assert plan.merge_output_format == 'mp4'
+
+
+def test_quality_caps_the_height():
+    plan = plan_formats({'formats': [AVC_1080, AVC_720, AAC_AUDIO]}, 'mp4', '720p')
+    assert plan.format_spec.startswith('136+140/')
+    assert 'height<=720' in plan.format_spec
+
+
+def test_info_without_formats_leaves_the_choice_to_yt_dlp():
+    plan = plan_formats({}, 'mp3')
+    assert plan.path == AUTO
+    assert plan.format_spec == 'bestaudio/best'
+    assert plan.space_needed is None
@@ -0,0 +1,44 @@
+from gui_queue import GuiUpdateQueue
+
+
+def calls(queue):
+    return [(widget, method, args) for widget, method, args, _ in queue.drain()]
+
+
+def test_ordered_events_are_all_delivered_in_order():
+    queue = GuiUpdateQueue()
+    for i in range(3):
+        queue.put("log", "insert", (i,))
+    assert calls(queue) == [("log", "insert", (0,)), ("log", "insert", (1,)), ("log", "insert", (2,))]
+
+
+def test_latest_replaces_pending_update_in_place():
+    queue = GuiUpdateQueue()
+    queue.put("row", "create")
+    queue.put_latest("progress", "bar", "set", (0.1,))
+    queue.put("row", "relabel")
+    queue.put_latest("progress", "bar", "set", (0.5,))
+    queue.put_latest("speed", "label", "configure", ("1 MB/s",))
+    assert calls(queue) == [
+        ("row", "create", ()),
+        # Newest value, but still where the first update for the key was queued
+        ("bar", "set", (0.5,)),
+        ("row", "relabel", ()),
+        ("label", "configure", ("1 MB/s",)),
+    ]
+    assert queue.stats() == {'events_received': 5, 'events_applied': 4, 'events_coalesced': 1}
+
+
+def test_key_drained_once_is_queued_afresh():
+    queue = GuiUpdateQueue()
+    queue.put_latest("progress", "bar", "set", (0.1,))
+    queue.drain()
+    queue.put("row", "create")
+    queue.put_latest("progress", "bar", "set", (0.2,))
+    assert calls(queue) == [("row", "create", ()), ("bar", "set", (0.2,))]
+    assert queue.drain() == []
+
+
+def test_frame_interval_follows_max_fps():
+    assert GuiUpdateQueue(max_fps=20).frame_interval_ms == 50
+    assert GuiUpdateQueue(max_fps=5000).frame_interval_ms == 1
@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+from history import HistoryStore
+
+
+@pytest.fixture
+def history(tmp_path):
+    history = HistoryStore(str(tmp_path / "history.sqlite"), legacy_json=None)
+    yield history
+    history.close()
+
+
+def test_legacy_json_is_imported_once_in_order(tmp_path):
+    legacy = tmp_path / "download_history.json"
+    legacy.write_text(json.dumps([{'title': "Newest", 'path': "/d/newest.mp4"},
+                                  {'title': "Broken entry"},
+                                  {'title': "Oldest", 'path': "/d/oldest.mp4"}]))
+    history = HistoryStore(str(tmp_path / "history.sqlite"), legacy_json=str(legacy))
+    assert [entry['title'] for entry in history.page()] == ["Newest", "Oldest"]
+    history.close()
+    assert not legacy.exists()
+    assert (tmp_path / "download_history.json.migrated").exists()
+    history = HistoryStore(str(tmp_path / "history.sqlite"), legacy_json=str(legacy))
+    assert history.count() == 2
+    history.close()
+
+
+def test_pages_are_newest_first(history):
+    for i in range(5):
+        history.add(f"Video {i}", f"/d/{i}.mp4", size=1)
+    assert [entry['title'] for entry in history.page(offset=1, limit=2)] == ["Video 3", "Video 2"]
+    assert history.count() == 5
+
+
+def test_search_matches_words_and_a_trailing_prefix(history):
+    history.add("Learning Python in one hour", "/d/a.mp4", size=1)
+    history.add("Python tips", "/d/b.mp4", size=1)
+    history.add("Cooking pasta", "/d/c.mp4", size=1)
+    assert [entry['title'] for entry in history.page(query="pyth")] == ["Python tips", "Learning Python in one hour"]
+    assert history.count(query="python hour") == 1
+    # FTS syntax in the query is taken literally instead of failing
+    assert history.count(query='"pasta') == 1
+    assert history.count(query="cooking OR tips") == 0
+
+
+def test_entries_are_found_by_video_id(history):
+    first = history.add("Video", "/d/v.mp4", video_id="abc", file_format="mp4", size=1)
+    second = history.add("Video", "/d/v.mp3", video_id="abc", file_format="mp3", size=1)
+    assert [entry['id'] for entry in history.find_by_video_id("abc")] == [second['id'], first['id']]
@@ -0,0 +1,60 @@
+import time
+
+import pytest
+
+from downloader import MetadataCache
+
+INFO = {'id': "dQw4w9WgXcQ", 'title': "Video", 'formats': [{'format_id': "18", 'url': "https://stub.test/18"}]}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = MetadataCache(str(tmp_path / "metadata.sqlite"), ttl=60)
+    yield cache
+    cache._db.close()
+
+
+def test_spellings_of_a_video_url_share_an_entry(cache, clock):
+    cache.put("https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=10", INFO)
+    assert cache.get("https://youtu.be/dQw4w9WgXcQ") == INFO
+    assert cache.get("https://youtu.be/aaaaaaaaaaa") is None
+
+
+def test_entry_expires_after_its_ttl(cache, clock):
+    cache.put("https://youtu.be/dQw4w9WgXcQ", INFO)
+    clock.now += 59
+    assert cache.get("https://youtu.be/dQw4w9WgXcQ") == INFO
+    clock.now += 2
+    assert cache.get("https://youtu.be/dQw4w9WgXcQ") is None
+    assert cache._db.execute("SELECT COUNT(*) FROM metadata").fetchone()[0] == 0
+
+
+def test_least_recently_used_entries_go_first_when_over_size(tmp_path, clock):
+    cache = MetadataCache(str(tmp_path / "metadata.sqlite"), ttl=60)
+    urls = [f"https://stub.test/video{i}" for i in range(3)]
+    for url in urls:
+        cache.put(url, {**INFO, 'webpage_url': url})
+        clock.now += 1
+    cache.get(urls[0])
+    size = cache._db.execute("SELECT MAX(size) FROM metadata").fetchone()[0]
+    cache.max_bytes = 3 * size
+    clock.now += 1
+    cache.put("https://stub.test/video3", INFO)
+    assert cache.get(urls[1]) is None
+    assert cache.get(urls[0]) is not None and cache.get(urls[2]) is not None
+    cache._db.close()
@@ -0,0 +1,238 @@
+import threading
+import time
+
+from bandwidth import BandwidthManager, INTERACTIVE, BATCH
+from metrics import MetricsRecorder
+from scheduler import DownloadScheduler, CANCELLED, COMPLETED, FAILED, POSTPROCESSING, SKIPPED
+
+OPTIONS = {'download_path': '/downloads', 'file_format': 'mp4'}
+
+
+class StubPending:
+    def __init__(self, url, needs_postprocessing):
+        self.url = url
+        self.needs_postprocessing = needs_postprocessing
+
+
+class StubDownloader:
+    """Stands in for Downloader: fetch blocks on a URL's gate until the test opens it, finish returns a path."""
+
+    def __init__(self, postprocess=False):
+        self.metrics = MetricsRecorder()
+        self.bandwidth = BandwidthManager()
+        self.postprocess = postprocess
+        self.gates = {}
+        self.failing = set()
+        self.fetched = []
+        self.finished = []
+        # Set to an Event to hold finish (the post-processing stage) until the test opens it
+        self.finish_gate = None
+
+    def gate(self, url):
+        self.gates[url] = threading.Event()
+        return self.gates[url]
+
+    def get_video_info(self, url, metrics=None):
+        return {'id': url.rsplit('/', 1)[-1], 'extractor_key': 'Youtube', 'title': url}
+
+    def fetch(self, url, progress_hook=None, info=None, **options):
+        self.fetched.append(url)
+        gate = self.gates.get(url)
+        while gate is not None and not gate.wait(0.01):
+            progress_hook({'status': 'downloading', 'downloaded_bytes': 1, 'total_bytes': 2})
+        if url in self.failing:
+            raise RuntimeError(f"{url} failed")
+        progress_hook({'status': 'finished'})
+        return StubPending(url, self.postprocess)
+
+    def finish(self, pending):
+        self.finished.append(pending.url)
+        if self.finish_gate is not None:
+            self.finish_gate.wait(5)
+        return f"/downloads/{pending.url.rsplit('/', 1)[-1]}.mp4"
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def url(name):
+    return f"https://stub.test/{name}"
+
+
+def test_interactive_job_starts_before_queued_batch_jobs():
+    downloader = StubDownloader()
+    blocker = downloader.gate(url("running"))
+    scheduler = DownloadScheduler(downloader, max_workers=1)
+    scheduler.submit(url("running"), **OPTIONS)
+    wait_until(lambda: downloader.fetched)
+    jobs = [scheduler.submit(url(f"batch{i}"), **OPTIONS, priority=BATCH) for i in range(4)]
+    jobs.append(scheduler.submit(url("interactive"), **OPTIONS, priority=INTERACTIVE))
+    blocker.set()
+    assert scheduler.join(timeout=5)
+    assert [u.rsplit('/', 1)[-1] for u in downloader.fetched] == [
+        "running", "interactive", "batch0", "batch1", "batch2", "batch3"]
+    assert all(job.status == COMPLETED for job in jobs)
+    scheduler.shutdown()
+
+
+
+def test_cancelled_queued_job_never_starts():
+    downloader = StubDownloader()
+    blocker = downloader.gate(url("running"))
+    scheduler = DownloadScheduler(downloader, max_workers=1)
+    scheduler.submit(url("running"), **OPTIONS)
+    wait_until(lambda: downloader.fetched)
+    queued = scheduler.submit(url("queued"), **OPTIONS)
+    assert scheduler.cancel(queued.id)
+    assert queued.status == CANCELLED
+    blocker.set()
+    assert scheduler.join(timeout=5)
+    assert downloader.fetched == [url("running")]
+    assert not scheduler.cancel(queued.id)
+    scheduler.shutdown()
+
+
+def test_running_job_is_cancelled_at_its_next_progress_tick():
+    downloader = StubDownloader()
+    downloader.gate(url("running"))
+    scheduler = DownloadScheduler(downloader, max_workers=1)
+    job = scheduler.submit(url("running"), **OPTIONS)
+    wait_until(lambda: downloader.fetched)
+    assert scheduler.cancel(job.id)
+    assert scheduler.join(timeout=5)
+    assert job.status == CANCELLED
+    assert downloader.finished == []
+    scheduler.shutdown()
+
+
+def test_failed_job_can_be_retried_and_completed_one_cannot():
+    downloader = StubDownloader()
+    downloader.failing.add(url("flaky"))
+    scheduler = DownloadScheduler(downloader, max_workers=1)
+    job = scheduler.submit(url("flaky"), **OPTIONS)
+    assert scheduler.join(timeout=5)
+    assert job.status == FAILED and "flaky failed" in job.error
+    downloader.failing.clear()
+    assert scheduler.retry(job.id)
+    assert scheduler.join(timeout=5)
+    assert (job.status, job.attempts, job.error) == (COMPLETED, 2, None)
+    assert job.result == "/downloads/flaky.mp4"
+    assert not scheduler.retry(job.id)
+    scheduler.shutdown()
+
+
+def test_duplicate_job_attaches_to_the_running_one():
+    downloader = StubDownloader()
+    gate = downloader.gate(url("video"))
+    scheduler = DownloadScheduler(downloader, max_workers=2)
+    owner = scheduler.submit(url("video"), **OPTIONS)
+    wait_until(lambda: downloader.fetched)
+    duplicate = scheduler.submit(url("video"), **OPTIONS)
+    wait_until(lambda: duplicate.progress_info.get('attached_to') == owner.id)
+    gate.set()
+    assert scheduler.join(timeout=5)
+    assert downloader.fetched == [url("video")]
+    assert (duplicate.status, duplicate.result) == (COMPLETED, owner.result)
+    scheduler.shutdown()
+
+
+def test_attached_job_downloads_itself_when_its_owner_is_cancelled():
+    downloader = StubDownloader()
+    downloader.gate(url("video"))
+    scheduler = DownloadScheduler(downloader, max_workers=2)
+    owner = scheduler.submit(url("video"), **OPTIONS)
+    wait_until(lambda: downloader.fetched)
+    duplicate = scheduler.submit(url("video"), **OPTIONS)
+    wait_until(lambda: duplicate.progress_info.get('attached_to') == owner.id)
+    del downloader.gates[url("video")]
+    assert scheduler.cancel(owner.id)
+    assert scheduler.join(timeout=5)
+    assert owner.status == CANCELLED
+    assert duplicate.status == COMPLETED
+    assert downloader.fetched == [url("video"), url("video")]
+    scheduler.shutdown()
+
+
+def test_post_processing_frees_the_worker_for_the_next_download():
+    downloader = StubDownloader(postprocess=True)
+    downloader.finish_gate = threading.Event()
+    scheduler = DownloadScheduler(downloader, max_workers=1, postprocess_workers=1)
+    first = scheduler.submit(url("first"), **OPTIONS)
+    second = scheduler.submit(url("second"), **OPTIONS)
+    third = scheduler.submit(url("third"), **OPTIONS)
+    # first is in FFmpeg, second waits for the post-processing pool, third downloads meanwhile
+    wait_until(lambda: len(downloader.fetched) == 3)
+    assert first.status == POSTPROCESSING and second.status == POSTPROCESSING
+    assert scheduler.cancel(second.id)
+    downloader.finish_gate.set()
+    assert scheduler.join(timeout=5)
+    assert (first.status, second.status, third.status) == (COMPLETED, CANCELLED, COMPLETED)
+    assert downloader.finished == [url("first"), url("third")]
+    scheduler.shutdown()
+
+def test_oldest_finished_jobs_leave_jobs_but_stay_counted():
+    downloader = StubDownloader()
+    downloader.failing.add(url("broken"))
+    scheduler = DownloadScheduler(downloader, max_workers=1, keep_finished=2)
+    broken = scheduler.submit(url("broken"), **OPTIONS)
+    assert scheduler.join(timeout=5)
+    jobs = [scheduler.submit(url(f"video{i}"), **OPTIONS) for i in range(3)]
+    assert scheduler.join(timeout=5)
+    assert set(scheduler.jobs) == {jobs[1].id, jobs[2].id}
+    assert scheduler.counts() == {COMPLETED: 3, FAILED: 1}
+    assert not scheduler.retry(broken.id)
+    scheduler.shutdown()
+
+
+def test_retried_job_is_kept_until_it_finishes_again():
+    downloader = StubDownloader()
+    downloader.failing.add(url("flaky"))
+    scheduler = DownloadScheduler(downloader, max_workers=2, keep_finished=2)
+    flaky = scheduler.submit(url("flaky"), **OPTIONS)
+    assert scheduler.join(timeout=5)
+    gate = downloader.gate(url("flaky"))
+    downloader.failing.clear()
+    assert scheduler.retry(flaky.id)
+    others = [scheduler.submit(url(f"other{i}"), **OPTIONS) for i in range(2)]
+    wait_until(lambda: all(job.status == COMPLETED for job in others))
+    assert flaky.id in scheduler.jobs
+    gate.set()
+    assert scheduler.join(timeout=5)
+    assert flaky.status == COMPLETED
+    assert set(scheduler.jobs) == {others[1].id, flaky.id}
+    scheduler.shutdown()
+
+
+class StubArchive:
+    def __init__(self, *archived):
+        self.archived = set(archived)
+        self.added = []
+
+    def contains_url(self, url, file_format):
+        return (url, file_format) in self.archived
+
+    def contains_info(self, info, file_format):
+        return (info['title'], file_format) in self.archived
+
+    def add(self, info, path, file_format):
+        self.added.append((info['title'], path, file_format))
+
+
+def test_archived_video_is_skipped_unless_the_job_ignores_the_archive():
+    downloader = StubDownloader()
+    archive = StubArchive((url("seen"), "mp4"))
+    scheduler = DownloadScheduler(downloader, max_workers=1, archive=archive)
+    skipped = scheduler.submit(url("seen"), **OPTIONS)
+    other_format = scheduler.submit(url("seen"), **{**OPTIONS, 'file_format': 'mp3'})
+    assert scheduler.join(timeout=5)
+    again = scheduler.submit(url("seen"), **OPTIONS, ignore_archive=True)
+    assert scheduler.join(timeout=5)
+    assert skipped.status == SKIPPED
+    assert other_format.status == COMPLETED and again.status == COMPLETED
+    assert downloader.fetched == [url("seen"), url("seen")]
+    assert archive.added == [(url("seen"), "/downloads/seen.mp4", "mp3"), (url("seen"), "/downloads/seen.mp4", "mp4")]
+    scheduler.shutdown()
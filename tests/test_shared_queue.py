@@ -0,0 +1,65 @@
+import time
+
+import pytest
+
+from archive import SharedJobQueue
+
+OPTIONS = {'download_path': '/downloads', 'file_format': 'mp4'}
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = SharedJobQueue(str(tmp_path / "queue.sqlite"), lease=0.2, max_attempts=2)
+    yield queue
+    queue.close()
+
+
+def status(queue, queue_id):
+    return queue._db.execute("SELECT status, worker, attempts, error FROM queue WHERE id = ?", (queue_id,)).fetchone()
+
+
+def test_claimed_job_is_leased_to_one_worker(queue):
+    queue_id = queue.put("https://youtu.be/a", OPTIONS)
+    item = queue.claim("host-a")
+    assert item == {'id': queue_id, 'url': "https://youtu.be/a", 'options': OPTIONS}
+    assert queue.claim("host-b") is None
+    assert queue.finish(queue_id, "host-a", "completed", result="/downloads/a.mp4")
+    assert queue.counts() == {'completed': 1}
+
+
+def test_expired_lease_goes_back_to_queued(queue):
+    queue_id = queue.put("https://youtu.be/a", OPTIONS)
+    queue.claim("host-a")
+    time.sleep(0.3)
+    assert queue.counts() == {'queued': 1}
+    assert queue.claim("host-b")['id'] == queue_id
+    # The first worker lost its lease and cannot report any more
+    assert not queue.renew(queue_id, "host-a")
+    assert not queue.finish(queue_id, "host-a", "completed")
+    assert status(queue, queue_id)[:3] == ("claimed", "host-b", 2)
+
+
+def test_lease_expiring_too_often_fails_the_job(queue):
+    queue_id = queue.put("https://youtu.be/a", OPTIONS)
+    for worker in ("host-a", "host-b"):
+        assert queue.claim(worker)['id'] == queue_id
+        time.sleep(0.3)
+    assert queue.claim("host-c") is None
+    assert status(queue, queue_id) == ("failed", None, 2, "Lease expired too often")
+
+
+def test_renewed_lease_does_not_expire(queue):
+    queue_id = queue.put("https://youtu.be/a", OPTIONS)
+    queue.claim("host-a")
+    for _ in range(4):
+        time.sleep(0.1)
+        assert queue.renew(queue_id, "host-a")
+    assert status(queue, queue_id)[0] == "claimed"
+
+
+def test_released_job_does_not_count_the_attempt(queue):
+    queue_id = queue.put("https://youtu.be/a", OPTIONS)
+    queue.claim("host-a")
+    assert not queue.release(queue_id, "host-b")
+    assert queue.release(queue_id, "host-a")
+    assert status(queue, queue_id)[:3] == ("queued", None, 0)
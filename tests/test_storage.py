@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+from storage import move_into_place, check_free_space, InsufficientSpace
+
+
+def write(path, data):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(data)
+
+
+def read(path):
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def test_free_name_is_used_as_is(tmp_path):
+    source = tmp_path / "abc.tmp-mp4.mp4"
+    write(source, "new")
+    final = move_into_place(str(source), str(tmp_path), "Title.mp4")
+    assert final == os.path.join(str(tmp_path), "Title.mp4")
+    assert read(final) == "new"
+    assert not source.exists()
+
+
+def test_taken_name_gets_a_number(tmp_path):
+    write(tmp_path / "Title.mp4", "old")
+    write(tmp_path / "Title (1).mp4", "older")
+    source = tmp_path / "abc.tmp-mp4.mp4"
+    write(source, "new")
+    final = move_into_place(str(source), str(tmp_path), "Title.mp4")
+    assert os.path.basename(final) == "Title (2).mp4"
+    assert read(final) == "new"
+    # Nothing that was there before is replaced
+    assert read(tmp_path / "Title.mp4") == "old"
+    assert read(tmp_path / "Title (1).mp4") == "older"
+
+
+def test_first_collision_becomes_one(tmp_path):
+    write(tmp_path / "Title.mp4", "old")
+    source = tmp_path / "abc.tmp-mp4.mp4"
+    write(source, "new")
+    assert os.path.basename(move_into_place(str(source), str(tmp_path), "Title.mp4")) == "Title (1).mp4"
+
+
+def test_file_already_in_place_stays(tmp_path):
+    source = tmp_path / "Title.mp4"
+    write(source, "same")
+    assert move_into_place(str(source), str(tmp_path), "Title.mp4") == str(source)
+    assert sorted(os.listdir(tmp_path)) == ["Title.mp4"]
+
+
+def test_failed_rename_leaves_no_placeholder(tmp_path):
+    with pytest.raises(OSError):
+        move_into_place(str(tmp_path / "missing.tmp"), str(tmp_path), "Title.mp4")
+    assert os.listdir(tmp_path) == []
+
+
+def test_free_space_check(tmp_path):
+    assert check_free_space(str(tmp_path), 0, margin=0) > 0
+    with pytest.raises(InsufficientSpace) as error:
+        check_free_space(str(tmp_path), 1 << 60)
+    assert error.value.needed > 1 << 60
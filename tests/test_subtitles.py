@@ -0,0 +1,45 @@
+from subtitles import parse_languages, select_subtitles
+
+
+def track(ext, url=None):
+    return {'ext': ext, 'url': url or f"https://stub.test/sub.{ext}"}
+
+
+def test_languages_default_to_english():
+    assert parse_languages(None) == ['en']
+    assert parse_languages(" de, en-GB ,") == ['de', 'en-GB']
+    assert parse_languages(['fr']) == ['fr']
+
+
+def test_first_listed_language_the_video_has_wins():
+    info = {'subtitles': {'fr': [track('vtt')], 'de': [track('vtt')]}}
+    assert select_subtitles(info, "es, de, fr")['lang'] == 'de'
+
+
+def test_regional_variant_stands_in_for_the_language():
+    info = {'subtitles': {'en-US': [track('vtt')]}}
+    assert select_subtitles(info, "en")['lang'] == 'en-US'
+
+
+def test_spoken_language_is_the_fallback():
+    info = {'language': 'ja', 'subtitles': {'ja': [track('vtt')]}}
+    assert select_subtitles(info, "en")['lang'] == 'ja'
+    assert select_subtitles({'subtitles': {'ja': [track('vtt')]}}, "en") is None
+
+
+def test_uploaded_subtitles_beat_auto_captions():
+    info = {'subtitles': {'en': [track('srt')]}, 'automatic_captions': {'en': [track('vtt')]}}
+    selected = select_subtitles(info, "en", auto_captions=True)
+    assert (selected['auto'], selected['ext']) == (False, 'srt')
+
+
+def test_auto_captions_only_when_asked_for():
+    info = {'automatic_captions': {'en': [track('vtt')]}}
+    assert select_subtitles(info, "en") is None
+    assert select_subtitles(info, "en", auto_captions=True)['auto'] is True
+
+
+def test_preferred_format_is_picked_from_the_track_list():
+    info = {'subtitles': {'en': [track('json3'), {'ext': 'vtt'}, track('srv1'), track('srt'), track('vtt')]}}
+    selected = select_subtitles(info, "en")
+    assert selected['ext'] == 'vtt' and selected['url'] == "https://stub.test/sub.vtt"
@@ -0,0 +1,132 @@
+import customtkinter as ctk
+from PIL import Image
+import requests
+from requests.adapters import HTTPAdapter
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import hashlib
+import logging
+import os
+import threading
+
+
+class ThumbnailCache:
+    """
+    Two-tier thumbnail cache: an LRU of decoded images bounded by `memory_budget`
+    bytes, backed by a directory of already-resized JPEGs bounded by `disk_budget`.
+
+    Misses are fetched over one pooled `requests.Session` on a fixed-size executor.
+    """
+    PRUNE_EVERY = 100
+
+    def __init__(self, cache_dir="thumbnail_cache", memory_budget=32 * 1024 * 1024,
+                 disk_budget=256 * 1024 * 1024, workers=4):
+        self.cache_dir = cache_dir
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers, max_retries=1)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnail")
+
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_writes = 0
+        self._lock = threading.Lock()
+        self._prune_disk()
+
+    def get(self, url, size):
+        """Returns a CTkImage no larger than `size`, or None if it cannot be loaded. Blocks on a miss."""
+        if not url: return None
+        key = (url, tuple(size))
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key][0]
+        try:
+            img = self._load_from_disk(url, size) or self._download(url, size)
+        except Exception as e:
+            logging.error(f"Thumbnail fetch failed for {url}: {e}")
+            return None
+        ctk_img = ctk.CTkImage(light_image=img, dark_image=img, size=(img.width, img.height))
+        self._remember(key, ctk_img, img.width * img.height * len(img.getbands()))
+        return ctk_img
+
+    def fetch_async(self, url, size, callback):
+        """Loads a thumbnail on the fetch pool and calls `callback(image)`. Cancel the future to drop it."""
+        return self._executor.submit(lambda: callback(self.get(url, size)))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+    def _disk_path(self, url, size):
+        digest = hashlib.sha1(f"{url}|{size[0]}x{size[1]}".encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.jpg")
+
+    def _load_from_disk(self, url, size):
+        path = self._disk_path(url, size)
+        try:
+            with Image.open(path) as img:
+                img.load()
+                img = img.copy()
+            os.utime(path)
+            return img
+        except (OSError, ValueError):
+            return None
+
+    def _download(self, url, size):
+        response = self.session.get(url, timeout=5)
+        response.raise_for_status()
+        img = Image.open(BytesIO(response.content))
+        # Lets the JPEG decoder scale down while decoding, so the full-size image is never materialized
+        img.draft('RGB', size)
+        img.thumbnail(size)
+        img = img.convert('RGB')
+        self._save_to_disk(img, self._disk_path(url, size))
+        return img
+
+    def _save_to_disk(self, img, path):
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            img.save(tmp_path, "JPEG", quality=85)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.error(f"Could not write thumbnail cache file {path}: {e}")
+            return
+        with self._lock:
+            self._disk_writes += 1
+            prune = self._disk_writes % self.PRUNE_EVERY == 0
+        if prune:
+            self._prune_disk()
+
+    def _remember(self, key, ctk_img, nbytes):
+        with self._lock:
+            if key in self._memory:
+                self._memory_bytes -= self._memory.pop(key)[1]
+            self._memory[key] = (ctk_img, nbytes)
+            self._memory_bytes += nbytes
+            while self._memory_bytes > self.memory_budget and len(self._memory) > 1:
+                _, (_, evicted_bytes) = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted_bytes
+
+    def _prune_disk(self):
+        """Deletes the least recently used files until the directory fits in `disk_budget`."""
+        try:
+            entries = [entry for entry in os.scandir(self.cache_dir) if entry.is_file()]
+        except OSError:
+            return
+        stats = sorted(((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in entries))
+        total = sum(size for _, size, _ in stats)
+        for _, size, path in stats:
+            if total <= self.disk_budget:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass